@@ -18,6 +18,10 @@ def find_free_port(start_port=8000):
                 port += 1 
 
 def main():
+    # 恢复上次遗留的训练任务；放在这里而不是导入时，spawn 子进程重新导入本模块时不会重复执行
+    from visiofirm.routes.training import start_training_queue
+    start_training_queue()
+
     port = find_free_port()
     url = f"http://localhost:{port}"
     
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+预标注性能基准测试脚本
+生成合成项目数据库和图像集，使用桩模型（或指定的小型YOLO模型）运行
+PreAnnotator.run_inferences，输出各阶段耗时、images/sec 和峰值内存。
+
+用法:
+    python scripts/benchmark_preannotation.py --images 200 --setup "Segmentation"
+    python scripts/benchmark_preannotation.py --model yolov8n.pt --json report.json
+    python scripts/benchmark_preannotation.py --baseline report.json --max-regression 0.2
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from visiofirm.models.project import Project
+from visiofirm.utils.VFPreAnnotator import PreAnnotator, ModelPool
+
+# 每个类别用一种纯色绘制，桩检测器按颜色找回目标
+CLASS_COLORS = {
+    'car': (255, 0, 0),
+    'person': (0, 255, 0),
+    'dog': (0, 0, 255),
+}
+STAGES = ['decode', 'detect', 'cluster', 'clip', 'sam', 'contour', 'db_insert']
+
+
+def peak_rss_mb():
+    """当前进程的峰值常驻内存（MB）"""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux 单位为 KB，macOS 为字节
+        return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+    except ImportError:
+        import psutil
+        return psutil.Process().memory_info().rss / (1024 * 1024)
+
+
+def create_synthetic_project(root, num_images=50, image_size=(1280, 720), setup_type="Bounding Box",
+                             objects_per_image=6, seed=0):
+    """
+    创建合成项目：随机位置的纯色矩形/椭圆作为目标
+
+    Returns:
+        str: config.db 路径
+    """
+    rng = np.random.default_rng(seed)
+    project_path = os.path.join(root, 'benchmark_project')
+    images_dir = os.path.join(project_path, 'images')
+    os.makedirs(images_dir, exist_ok=True)
+    project = Project('benchmark_project', 'synthetic benchmark', setup_type, project_path)
+    project.add_classes(list(CLASS_COLORS))
+
+    width, height = image_size
+    paths = []
+    for i in range(num_images):
+        canvas = np.zeros((height, width, 3), dtype=np.uint8)
+        for _ in range(objects_per_image):
+            color = list(CLASS_COLORS.values())[rng.integers(len(CLASS_COLORS))]
+            w = int(rng.integers(width // 20, width // 5))
+            h = int(rng.integers(height // 20, height // 5))
+            x = int(rng.integers(0, width - w))
+            y = int(rng.integers(0, height - h))
+            if rng.random() < 0.5:
+                cv2.rectangle(canvas, (x, y), (x + w, y + h), color, thickness=-1)
+            else:
+                cv2.ellipse(canvas, (x + w // 2, y + h // 2), (w // 2, h // 2), 0, 0, 360, color, thickness=-1)
+        path = os.path.join(images_dir, f'synthetic_{i:05d}.jpg')
+        Image.fromarray(canvas).save(path, quality=90)
+        paths.append(path)
+    project.add_images(paths)
+    return project.db_path
+
+
+class SyntheticProcessor:
+    """
+    桩检测器：按类别颜色阈值分割并提取连通域
+
+    每个检测额外生成一个轻微偏移的重复框，以覆盖聚类去重阶段。
+    """
+
+    def __init__(self, detect_delay=0.0):
+        self.detect_delay = detect_delay
+
+    def process_image(self, image, classes_str, mode="BoundingBox", box_threshold=None, text_threshold=None):
+        start = time.perf_counter()
+        pixels = np.asarray(image)
+        boxes, scores, labels, masks = [], [], [], []
+        for label, color in CLASS_COLORS.items():
+            class_mask = (np.abs(pixels.astype(np.int16) - color).sum(axis=2) < 90).astype(np.uint8)
+            count, components, stats, _ = cv2.connectedComponentsWithStats(class_mask)
+            for idx in range(1, count):
+                x, y, w, h, area = stats[idx]
+                if area < 50:
+                    continue
+                for dx in (0, 1):
+                    boxes.append([x + dx, y, x + w + dx, y + h])
+                    scores.append(0.9 - 0.1 * dx)
+                    labels.append(label)
+                    if mode == "Segmentation":
+                        masks.append((components == idx).astype(np.float32))
+        if self.detect_delay:
+            time.sleep(self.detect_delay)
+        result = {
+            "boxes": np.array(boxes, dtype=np.float32).reshape(-1, 4),
+            "scores": np.array(scores, dtype=np.float32),
+            "labels": labels,
+            "timings": {"detect": time.perf_counter() - start},
+        }
+        if mode == "Segmentation":
+            result["masks"] = np.array(masks, dtype=np.float32).reshape(-1, pixels.shape[0], pixels.shape[1])
+            result["timings"]["sam"] = 0.0
+        return result
+
+    def process_batch(self, images, classes_str, mode="BoundingBox", box_threshold=None, text_threshold=None):
+        return [self.process_image(image, classes_str, mode, box_threshold, text_threshold) for image in images]
+
+
+class SyntheticModelPool(ModelPool):
+    """总是返回桩检测器的模型池"""
+
+    def __init__(self, processor):
+        super().__init__(max_models=1)
+        self.processor = processor
+
+    def get_processor(self, *args, **kwargs):
+        return self.processor
+
+
+def run_benchmark(num_images=50, setup_type="Bounding Box", image_size=(1280, 720), model_path=None,
+                  device='cpu', detect_delay=0.0, workdir=None):
+    """
+    运行一次基准测试
+
+    Args:
+        model_path: 指定时使用真实的YOLO模型（例如 yolov8n.pt），否则使用桩检测器
+
+    Returns:
+        dict: 报告（各阶段耗时、images/sec、峰值内存等）
+    """
+    own_workdir = workdir is None
+    workdir = workdir or tempfile.mkdtemp(prefix='vf_bench_')
+    try:
+        db_path = create_synthetic_project(workdir, num_images, image_size, setup_type)
+        if model_path:
+            annotator = PreAnnotator(model_type='yolo', yolo_model_path=model_path, device=device,
+                                     config_db_path=db_path, pool=ModelPool(max_models=1))
+        else:
+            annotator = PreAnnotator(model_type='yolo', device=device, config_db_path=db_path,
+                                     pool=SyntheticModelPool(SyntheticProcessor(detect_delay)))
+
+        start = time.perf_counter()
+        annotator.run_inferences()
+        elapsed = time.perf_counter() - start
+        timings = annotator.get_stage_timings()
+        inserted = annotator.conn.execute("SELECT COUNT(*) FROM Preannotations").fetchone()[0]
+        del annotator
+
+        return {
+            'images': num_images,
+            'setup_type': setup_type,
+            'image_size': list(image_size),
+            'model': model_path or 'synthetic',
+            'total_seconds': round(elapsed, 4),
+            'images_per_second': round(num_images / elapsed, 3) if elapsed > 0 else None,
+            'preannotations': inserted,
+            'stage_ms_per_image': {stage: round(timings.get(stage, 0.0) * 1000 / num_images, 3) for stage in STAGES},
+            'peak_rss_mb': round(peak_rss_mb(), 1),
+        }
+    finally:
+        if own_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def print_report(report):
+    print(f"模型: {report['model']}  类型: {report['setup_type']}  图像: {report['images']} @ {report['image_size']}")
+    print(f"总耗时: {report['total_seconds']:.2f}s  吞吐: {report['images_per_second']} images/sec  "
+          f"预标注: {report['preannotations']}  峰值内存: {report['peak_rss_mb']} MB")
+    print("各阶段平均耗时 (ms/image):")
+    for stage in STAGES:
+        print(f"  {stage:<10} {report['stage_ms_per_image'][stage]:>10.3f}")
+
+
+def check_regression(report, baseline, max_regression):
+    """吞吐下降超过 max_regression（比例）时返回错误信息"""
+    base = baseline.get('images_per_second')
+    current = report.get('images_per_second')
+    if not base or not current:
+        return None
+    drop = (base - current) / base
+    if drop > max_regression:
+        return f"吞吐下降 {drop:.1%}（基线 {base}, 当前 {current} images/sec），超过允许的 {max_regression:.0%}"
+    return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='VisioFirm 预标注基准测试')
+    parser.add_argument('--images', type=int, default=50, help='合成图像数量')
+    parser.add_argument('--width', type=int, default=1280)
+    parser.add_argument('--height', type=int, default=720)
+    parser.add_argument('--setup', default='Bounding Box', choices=['Bounding Box', 'Segmentation'])
+    parser.add_argument('--model', default=None, help='使用真实YOLO模型（如 yolov8n.pt），默认使用桩检测器')
+    parser.add_argument('--device', default='cpu')
+    parser.add_argument('--detect-delay', type=float, default=0.0, help='桩检测器每张图额外的模拟耗时（秒）')
+    parser.add_argument('--json', dest='json_path', help='将报告写入JSON文件')
+    parser.add_argument('--baseline', help='基线报告JSON，用于回归检查')
+    parser.add_argument('--max-regression', type=float, default=0.2, help='允许的吞吐下降比例')
+    args = parser.parse_args(argv)
+
+    report = run_benchmark(args.images, args.setup, (args.width, args.height), args.model,
+                           args.device, args.detect_delay)
+    print_report(report)
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            error = check_regression(report, json.load(f), args.max_regression)
+        if error:
+            print(f"❌ {error}")
+            return 1
+        print("✓ 未发现性能回归")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
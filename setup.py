@@ -38,6 +38,9 @@ setup(
         'uvicorn==0.32.0',
         'waitress==3.0.2',
     ],
+    extras_require={
+        'parquet': ['pyarrow>=14.0.0'],
+    },
     entry_points={
         'console_scripts': [
             'visiofirm = run:main',  
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+批量大小探测测试模块
+测试预算内的批量选择、worker 数选择、探测结果缓存以及按新预算重新选择或重新探测
+"""
+
+import unittest
+import tempfile
+import shutil
+import os
+import sys
+from unittest import mock
+
+import cv2
+import numpy as np
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from visiofirm.utils import batch_finder
+from visiofirm.utils.batch_finder import (BatchFinder, MB, choose_batch, choose_workers, probe_batch_sizes,
+                                          probe_workers, worker_candidates)
+
+
+def _tiny_model():
+    return torch.nn.Sequential(torch.nn.Conv2d(3, 4, 3, padding=1), torch.nn.BatchNorm2d(4), torch.nn.ReLU())
+
+
+class TestBatchSelection(unittest.TestCase):
+    """批量与 worker 数选择测试类"""
+
+    def test_choose_batch_within_budget(self):
+        results = [
+            {'batch': 2, 'imgs_per_sec': 10.0, 'peak_mb': 100},
+            {'batch': 4, 'imgs_per_sec': 20.0, 'peak_mb': 200},
+            {'batch': 8, 'imgs_per_sec': 19.5, 'peak_mb': 400},
+            {'batch': 16, 'imgs_per_sec': 30.0, 'peak_mb': 800},
+        ]
+        # 吞吐量接近时取更大的批量
+        self.assertEqual(choose_batch(results, 500 * MB)['batch'], 8)
+        self.assertEqual(choose_batch(results, 1000 * MB)['batch'], 16)
+        self.assertEqual(choose_batch(results, 150 * MB)['batch'], 2)
+        self.assertIsNone(choose_batch(results, 50 * MB))
+
+    def test_choose_workers(self):
+        results = [
+            {'workers': 0, 'imgs_per_sec': 15.0},
+            {'workers': 2, 'imgs_per_sec': 45.0},
+            {'workers': 4, 'imgs_per_sec': 80.0},
+        ]
+        # 需要达到训练吞吐量的 BATCH_FINDER_LOADER_HEADROOM 倍
+        with mock.patch.object(batch_finder, 'BATCH_FINDER_LOADER_HEADROOM', 2.0):
+            self.assertEqual(choose_workers(results, 20.0, 4), 2)
+            self.assertEqual(choose_workers(results, 100.0, 4), 4)
+            self.assertEqual(choose_workers(results, 100.0, 2), 2)
+        self.assertEqual(worker_candidates(6), [0, 1, 2, 4, 6])
+        self.assertEqual(worker_candidates(0), [0])
+
+
+class TestBatchProbing(unittest.TestCase):
+    """实际探测与缓存测试类"""
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.cache_path = os.path.join(self.test_dir, 'batch_finder.json')
+        self.image_paths = []
+        for i in range(3):
+            path = os.path.join(self.test_dir, f'{i}.jpg')
+            cv2.imwrite(path, np.full((48, 64, 3), i * 40, dtype=np.uint8))
+            self.image_paths.append(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_probe_stops_at_budget(self):
+        results = probe_batch_sizes(_tiny_model(), 32, 'cpu', 1024 ** 4, batch_sizes=(1, 2, 4), steps=1)
+        self.assertEqual([r['batch'] for r in results], [1, 2, 4])
+        self.assertTrue(all(r['imgs_per_sec'] > 0 and r['fits'] for r in results))
+
+        # 第一档已超出预算时不再尝试更大的批量
+        results = probe_batch_sizes(_tiny_model(), 256, 'cpu', 1, batch_sizes=(8, 16, 32), steps=1)
+        self.assertEqual(len(results), 1)
+        self.assertFalse(results[0]['fits'])
+
+    def test_probe_workers(self):
+        results = probe_workers(self.image_paths, 32, 2, 0, batches=2)
+        self.assertEqual([r['workers'] for r in results], [0])
+        self.assertGreater(results[0]['imgs_per_sec'], 0)
+        self.assertEqual(probe_workers([], 32, 2, 4), [])
+
+    def test_find_caches_results(self):
+        finder = BatchFinder(self.cache_path)
+        probes = [
+            {'batch': 2, 'imgs_per_sec': 10.0, 'peak_mb': 100, 'fits': True},
+            {'batch': 4, 'imgs_per_sec': 30.0, 'peak_mb': 200, 'fits': True},
+        ]
+        with mock.patch.object(batch_finder, 'probe_batch_sizes', return_value=probes) as probe:
+            first = finder.find(_tiny_model(), 'tiny.pt', 32, 'cpu', 1024 * MB, self.image_paths, 0)
+            second = finder.find(_tiny_model(), 'tiny.pt', 32, 'cpu', 150 * MB, self.image_paths, 0)
+            self.assertEqual(probe.call_count, 1)
+        self.assertEqual((first['batch'], first['workers'], first['cached']), (4, 0, False))
+        # 缓存命中时按新的预算重新选择
+        self.assertEqual((second['batch'], second['cached']), (2, True))
+        self.assertTrue(os.path.exists(self.cache_path))
+
+        with mock.patch.object(batch_finder, 'probe_batch_sizes', return_value=probes) as probe:
+            finder.find(_tiny_model(), 'tiny.pt', 64, 'cpu', 1024 * MB, self.image_paths, 0)
+            self.assertEqual(probe.call_count, 1)
+
+    def test_find_reprobes_truncated_cache_for_larger_budget(self):
+        """缓存的探测因预算较小而提前停止时，更大的预算重新探测以尝试更大的批量"""
+        finder = BatchFinder(self.cache_path)
+        small = [
+            {'batch': 2, 'imgs_per_sec': 10.0, 'peak_mb': 100, 'fits': True},
+            {'batch': 4, 'imgs_per_sec': 20.0, 'peak_mb': 200, 'fits': True},
+        ]
+        large = small + [{'batch': 8, 'imgs_per_sec': 40.0, 'peak_mb': 400, 'fits': True}]
+        with mock.patch.object(batch_finder, 'probe_batch_sizes', side_effect=[small, large]) as probe:
+            first = finder.find(_tiny_model(), 'tiny.pt', 32, 'cpu', 250 * MB, self.image_paths, 0)
+            same = finder.find(_tiny_model(), 'tiny.pt', 32, 'cpu', 250 * MB, self.image_paths, 0)
+            self.assertEqual(probe.call_count, 1)
+            larger = finder.find(_tiny_model(), 'tiny.pt', 32, 'cpu', 450 * MB, self.image_paths, 0)
+            self.assertEqual(probe.call_count, 2)
+            # 新的探测记录了更大的预算，较小的预算直接使用缓存
+            smaller = finder.find(_tiny_model(), 'tiny.pt', 32, 'cpu', 250 * MB, self.image_paths, 0)
+            self.assertEqual(probe.call_count, 2)
+        self.assertEqual((first['batch'], same['cached']), (4, True))
+        self.assertEqual((larger['batch'], larger['cached']), (8, False))
+        self.assertEqual((smaller['batch'], smaller['cached']), (4, True))
+
+    def test_find_without_fitting_batch(self):
+        probes = [{'batch': 2, 'imgs_per_sec': 10.0, 'peak_mb': 100, 'fits': False}]
+        with mock.patch.object(batch_finder, 'probe_batch_sizes', return_value=probes):
+            self.assertIsNone(BatchFinder(self.cache_path).find(
+                _tiny_model(), 'tiny.pt', 32, 'cpu', 10 * MB, self.image_paths, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
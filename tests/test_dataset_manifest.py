@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+训练数据集增量物化测试模块
+测试清单记录、增量同步、划分变化以及标签重新生成
+"""
+
+import unittest
+import tempfile
+import os
+import shutil
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from visiofirm.utils.dataset_manifest import DatasetManifest, MANIFEST_FILE
+
+
+class TestDatasetManifest(unittest.TestCase):
+    """数据集清单测试类"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.dataset_dir = os.path.join(self.temp_dir, 'dataset')
+        self.images = []
+        for i in range(4):
+            path = os.path.join(self.temp_dir, f'img_{i}.jpg')
+            with open(path, 'wb') as f:
+                f.write(b'image-%d' % i)
+            self.images.append({'id': i + 1, 'path': path, 'name': f'img_{i}.jpg',
+                                'width': 10, 'height': 10, 'annotation_version': 1})
+        self.labelled = []
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def write_labels(self, items):
+        for info, label_path in items:
+            self.labelled.append(info['name'])
+            with open(label_path, 'w') as f:
+                f.write(f"0 0.5 0.5 0.1 0.1 # v{info['annotation_version']}\n")
+
+    def sync(self, splits, classes=('cat',)):
+        self.labelled = []
+        return DatasetManifest(self.dataset_dir).sync(splits, self.write_labels, list(classes))
+
+    def test_first_sync_links_everything(self):
+        """首次同步链接所有图像并写出清单"""
+        stats = self.sync({'train': self.images[:3], 'val': self.images[3:]})
+        self.assertEqual((stats['linked'], stats['relabeled']), (4, 4))
+        self.assertEqual(stats['splits'], {'train': 3, 'val': 1})
+        linked = os.path.join(self.dataset_dir, 'train', 'images', 'img_0.jpg')
+        self.assertTrue(os.path.samefile(linked, self.images[0]['path']))
+        self.assertTrue(os.path.exists(os.path.join(self.dataset_dir, 'val', 'labels', 'img_3.txt')))
+        self.assertTrue(os.path.exists(os.path.join(self.dataset_dir, MANIFEST_FILE)))
+
+    def test_unchanged_sync_is_noop(self):
+        """无变化时不重新链接也不重新生成标签"""
+        splits = {'train': self.images[:3], 'val': self.images[3:]}
+        self.sync(splits)
+        stats = self.sync(splits)
+        self.assertEqual((stats['linked'], stats['relabeled'], stats['unchanged']), (0, 0, 4))
+
+    def test_delta_only(self):
+        """只处理标注版本变化、划分变化和被移除的图像"""
+        self.sync({'train': self.images[:3], 'val': self.images[3:]})
+        self.images[0]['annotation_version'] = 2
+        stats = self.sync({'train': self.images[:2], 'val': [self.images[3], self.images[2]]})
+        self.assertEqual(stats['linked'], 1)
+        self.assertEqual(sorted(self.labelled), ['img_0.jpg', 'img_2.jpg'])
+        self.assertEqual(stats['removed'], 1)
+        self.assertFalse(os.path.exists(os.path.join(self.dataset_dir, 'train', 'images', 'img_2.jpg')))
+        self.assertFalse(os.path.exists(os.path.join(self.dataset_dir, 'train', 'labels', 'img_2.txt')))
+        self.assertTrue(os.path.exists(os.path.join(self.dataset_dir, 'val', 'images', 'img_2.jpg')))
+
+    def test_content_change_relinks(self):
+        """源文件被替换时重新链接，只 touch 时保持不变"""
+        splits = {'train': self.images[:2]}
+        self.sync(splits)
+        source = self.images[0]['path']
+        os.utime(source, ns=(0, 10 ** 9))
+        self.assertEqual(self.sync(splits)['linked'], 0)
+
+        os.unlink(source)
+        with open(source, 'wb') as f:
+            f.write(b'replaced')
+        self.assertEqual(self.sync(splits)['linked'], 1)
+        with open(os.path.join(self.dataset_dir, 'train', 'images', 'img_0.jpg'), 'rb') as f:
+            self.assertEqual(f.read(), b'replaced')
+
+    def test_stale_disk_cache_removed(self):
+        """图像重新链接或移除时删除旁边的 .npy 磁盘缓存"""
+        splits = {'train': self.images[:2]}
+        self.sync(splits)
+        cache_paths = [os.path.join(self.dataset_dir, 'train', 'images', f'img_{i}.npy') for i in range(2)]
+        for path in cache_paths:
+            open(path, 'wb').close()
+        self.assertEqual(self.sync(splits)['linked'], 0)
+        self.assertTrue(all(os.path.exists(path) for path in cache_paths))
+
+        with open(self.images[0]['path'], 'wb') as f:
+            f.write(b'replaced-content')
+        self.sync({'train': self.images[:1]})
+        self.assertFalse(os.path.exists(cache_paths[0]))
+        self.assertFalse(os.path.exists(cache_paths[1]))
+
+    def test_variant_change_rematerializes(self):
+        """图像变体（如缩放尺寸）变化时重新物化图像，但不重新生成标签"""
+        splits = {'train': self.images[:2]}
+        self.sync(splits)
+        placed = []
+
+        def materialize(source, image_path, sha1):
+            placed.append((os.path.basename(image_path), sha1))
+            shutil.copyfile(source, image_path)
+
+        manifest = DatasetManifest(self.dataset_dir)
+        stats = manifest.sync(splits, self.write_labels, ['cat'], materialize=materialize, variant='resize:64')
+        self.assertEqual((stats['linked'], stats['relabeled']), (2, 0))
+        self.assertEqual(sorted(name for name, _ in placed), ['img_0.jpg', 'img_1.jpg'])
+        stats = DatasetManifest(self.dataset_dir).sync(splits, self.write_labels, ['cat'],
+                                                       materialize=materialize, variant='resize:64')
+        self.assertEqual(stats['linked'], 0)
+
+    def test_class_change_relabels_all(self):
+        """类别列表变化时全部标签重新生成"""
+        splits = {'train': self.images[:2]}
+        self.sync(splits)
+        stats = self.sync(splits, classes=('cat', 'dog'))
+        self.assertEqual((stats['linked'], stats['relabeled']), (0, 2))
+
+    def test_legacy_directory_is_reset(self):
+        """没有清单的旧数据集目录会先被清空"""
+        stale = os.path.join(self.dataset_dir, 'val', 'images', 'old.jpg')
+        os.makedirs(os.path.dirname(stale))
+        open(stale, 'wb').close()
+        self.sync({'train': self.images[:1]})
+        self.assertFalse(os.path.exists(stale))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+后台导出任务测试模块
+测试任务执行、进度、失败处理和元数据持久化
+"""
+
+import unittest
+import tempfile
+import os
+import shutil
+import sys
+import json
+import time
+import zipfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from visiofirm.utils.export_jobs import ExportJobManager, JOB_FILE
+from visiofirm.utils.export_utils import generate_yolo_export
+from tests.test_export_utils import ExportTestCase
+
+
+def wait_for(manager, job_id, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = manager.get(job_id)
+        if job['status'] in ('completed', 'failed'):
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"job {job_id} did not finish")
+
+
+class TestExportJobs(ExportTestCase):
+    """导出任务测试类"""
+
+    def setUp(self):
+        super().setUp()
+        self.exports_dir = os.path.join(self.temp_dir, 'exports')
+        self.manager = ExportJobManager(root=self.exports_dir, max_workers=1)
+
+    def test_job_completes_with_artifact(self):
+        """任务完成后产物可用，进度达到100"""
+        progress = []
+
+        def write(output, progress_callback):
+            def track(done, total):
+                progress.append((done, total))
+                progress_callback(done, total)
+            generate_yolo_export(self.project, self.splits, self.setup_type, 'export_project', '',
+                                 output=output, progress_callback=track)
+
+        job_id = self.manager.start(write, 'export_project_YOLO.zip', project_name='export_project')
+        job = wait_for(self.manager, job_id)
+        self.assertEqual(job['status'], 'completed')
+        self.assertEqual(job['progress'], 100)
+        self.assertEqual(progress[-1], (3, 3))
+
+        artifact = self.manager.artifact_path(job_id)
+        self.assertEqual(os.path.basename(artifact), 'export_project_YOLO.zip')
+        self.assertEqual(job['size'], os.path.getsize(artifact))
+        with zipfile.ZipFile(artifact) as zf:
+            self.assertIsNone(zf.testzip())
+        self.assertFalse(os.path.exists(artifact + '.part'))
+
+    def test_failed_job(self):
+        """写出异常时任务失败且不留下半成品"""
+        def write(output, progress_callback):
+            with open(output, 'wb') as f:
+                f.write(b'partial')
+            raise IOError('disk full')
+
+        job_id = self.manager.start(write, 'broken.zip')
+        job = wait_for(self.manager, job_id)
+        self.assertEqual(job['status'], 'failed')
+        self.assertIn('disk full', job['error'])
+        self.assertIsNone(self.manager.artifact_path(job_id))
+        self.assertEqual(os.listdir(os.path.join(self.exports_dir, job_id)), [JOB_FILE])
+
+    def test_metadata_survives_restart(self):
+        """新的管理器实例可读取已完成任务，未完成任务标记为中断"""
+        job_id = self.manager.start(lambda output, cb: open(output, 'wb').close(), 'empty.zip')
+        wait_for(self.manager, job_id)
+
+        stale_id = 'stale'
+        os.makedirs(os.path.join(self.exports_dir, stale_id))
+        with open(os.path.join(self.exports_dir, stale_id, JOB_FILE), 'w') as f:
+            json.dump({'job_id': stale_id, 'status': 'running', 'filename': 'x.zip', 'created_at': time.time()}, f)
+
+        restarted = ExportJobManager(root=self.exports_dir)
+        self.assertEqual(restarted.get(job_id)['status'], 'completed')
+        self.assertIsNotNone(restarted.artifact_path(job_id))
+        self.assertEqual(restarted.get(stale_id)['status'], 'failed')
+        self.assertIsNone(restarted.get('../etc'))
+
+    def test_cleanup_expired(self):
+        """超过保留时间的任务被删除"""
+        job_id = self.manager.start(lambda output, cb: open(output, 'wb').close(), 'old.zip')
+        wait_for(self.manager, job_id)
+        self.manager.retention_seconds = 0
+        time.sleep(0.01)
+        self.manager.cleanup_expired()
+        self.assertIsNone(self.manager.get(job_id))
+        self.assertFalse(os.path.exists(os.path.join(self.exports_dir, job_id)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+导出工具测试模块
+测试各导出格式的内容以及流式写出
+"""
+
+import unittest
+import tempfile
+import os
+import shutil
+import sys
+import json
+import zipfile
+import tarfile
+import errno
+from io import BytesIO
+from unittest import mock
+
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from visiofirm.models.project import Project
+from visiofirm.utils.archive_writer import link_or_copy
+from visiofirm.utils.export_cache import ExportCache
+from visiofirm.utils.export_utils import (
+    generate_coco_export, generate_yolo_export, generate_pascal_voc_export,
+    generate_csv_export, iter_zip_stream, iter_export_records
+)
+
+
+class ExportTestCase(unittest.TestCase):
+    """创建带标注的临时项目"""
+
+    setup_type = "Bounding Box"
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.project_path = os.path.join(self.temp_dir, 'export_project')
+        os.makedirs(os.path.join(self.project_path, 'images'))
+        self.project = Project('export_project', 'export test', self.setup_type, self.project_path)
+        self.project.add_classes(['cat', 'dog'])
+        self.image_paths = []
+        for i in range(3):
+            path = os.path.join(self.project_path, 'images', f'img_{i}.jpg')
+            Image.new('RGB', (200, 100), color=(i * 40, 0, 0)).save(path)
+            self.image_paths.append(path)
+        self.project.add_images(self.image_paths)
+        for i, path in enumerate(self.image_paths):
+            self.project.save_annotations(path, self.annotations_for(i))
+        self.splits = {'train': self.image_paths[:2], 'val': self.image_paths[2:]}
+
+    def annotations_for(self, index):
+        return [
+            {'type': 'rect', 'label': 'cat', 'bbox': [10 + index, 20, 50, 40]},
+            {'type': 'rect', 'label': 'dog', 'bbox': [100, 10, 20, 30]},
+        ]
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+
+class TestBoundingBoxExports(ExportTestCase):
+    """检测框项目导出测试类"""
+
+    def test_coco_export(self):
+        """COCO 导出包含图像和每个划分的标注 JSON"""
+        buffer = generate_coco_export(self.project, self.splits, self.setup_type, 'export_project', '')
+        with zipfile.ZipFile(buffer) as zf:
+            names = zf.namelist()
+            self.assertIn('images/train/img_0.jpg', names)
+            self.assertIn('images/val/img_2.jpg', names)
+            coco = json.loads(zf.read('annotations/instances_train.json'))
+        self.assertEqual(len(coco['images']), 2)
+        self.assertEqual(len(coco['annotations']), 4)
+        first = coco['annotations'][0]
+        self.assertEqual(first['bbox'], [10, 20, 50, 40])
+        self.assertEqual(first['area'], 2000)
+
+    def test_yolo_export(self):
+        """YOLO 标签按图像尺寸归一化"""
+        buffer = generate_yolo_export(self.project, self.splits, self.setup_type, 'export_project', '')
+        with zipfile.ZipFile(buffer) as zf:
+            lines = zf.read('train/labels/img_0.txt').decode().splitlines()
+            self.assertIn('data.yaml', zf.namelist())
+        class_id, xc, yc, w, h = lines[0].split()
+        self.assertEqual(class_id, '0')
+        self.assertAlmostEqual(float(xc), 35 / 200)
+        self.assertAlmostEqual(float(yc), 40 / 100)
+        self.assertAlmostEqual(float(w), 0.25)
+        self.assertAlmostEqual(float(h), 0.4)
+
+    def test_voc_and_csv_exports(self):
+        """VOC 和 CSV 导出包含所有目标"""
+        with zipfile.ZipFile(generate_pascal_voc_export(self.project, self.splits, self.setup_type)) as zf:
+            xml = zf.read('VOC2007/Annotations/img_1.xml').decode()
+            self.assertEqual(xml.count('<object>'), 2)
+            self.assertEqual(zf.read('VOC2007/ImageSets/Main/val.txt').decode(), 'img_2')
+        with zipfile.ZipFile(generate_csv_export(self.project, self.splits, self.setup_type)) as zf:
+            rows = zf.read('annotation/train.csv').decode().splitlines()
+        self.assertEqual(rows[0], 'image_name,class_name,x,y,width,height')
+        self.assertEqual(len(rows), 5)
+
+    def test_export_to_path(self):
+        """指定输出路径时直接写入文件"""
+        zip_path = os.path.join(self.temp_dir, 'out.zip')
+        generate_yolo_export(self.project, self.splits, self.setup_type, 'export_project', '', output=zip_path)
+        with zipfile.ZipFile(zip_path) as zf:
+            self.assertIsNone(zf.testzip())
+            self.assertIn('val/labels/img_2.txt', zf.namelist())
+
+    def test_streamed_export_matches(self):
+        """流式导出得到完整有效的压缩包"""
+        chunks = list(iter_zip_stream(
+            lambda output: generate_coco_export(self.project, self.splits, self.setup_type, 'export_project', '', output=output),
+            max_pending_chunks=2
+        ))
+        with zipfile.ZipFile(BytesIO(b''.join(chunks))) as zf:
+            self.assertIsNone(zf.testzip())
+            with open(self.image_paths[0], 'rb') as f:
+                self.assertEqual(zf.read('images/train/img_0.jpg'), f.read())
+
+    def test_export_records_keep_order(self):
+        """批量查询按传入顺序返回图像，未标注图像的标注为空"""
+        self.project.save_annotations(self.image_paths[1], [])
+        order = [self.image_paths[2], self.image_paths[0], self.image_paths[1]]
+        records = list(iter_export_records(self.project.db_path, order))
+        self.assertEqual([r.path for r in records], order)
+        self.assertEqual([len(r.annotations) for r in records], [2, 2, 0])
+        self.assertEqual((records[0].width, records[0].height), (200, 100))
+        self.assertEqual([row[4] for row in records[1].annotations], ['cat', 'dog'])
+
+    def test_images_stored_text_deflated(self):
+        """图像条目直接存储，标签文本使用 deflate"""
+        buffer = generate_yolo_export(self.project, self.splits, self.setup_type, 'export_project', '')
+        with zipfile.ZipFile(buffer) as zf:
+            self.assertEqual(zf.getinfo('train/images/img_0.jpg').compress_type, zipfile.ZIP_STORED)
+            self.assertEqual(zf.getinfo('train/labels/img_0.txt').compress_type, zipfile.ZIP_DEFLATED)
+
+    def test_tar_and_directory_outputs(self):
+        """tar 流式输出和目录输出包含相同条目"""
+        chunks = list(iter_zip_stream(
+            lambda output: generate_csv_export(self.project, self.splits, self.setup_type, output=output, archive_format='tar')
+        ))
+        with tarfile.open(fileobj=BytesIO(b''.join(chunks))) as tf:
+            tar_names = set(tf.getnames())
+            self.assertEqual(len(tf.extractfile('annotation/train.csv').read().decode().splitlines()), 5)
+
+        out_dir = os.path.join(self.temp_dir, 'out_dir')
+        generate_csv_export(self.project, self.splits, self.setup_type, output=out_dir, archive_format='dir')
+        dir_names = set()
+        for root, _, files in os.walk(out_dir):
+            for name in files:
+                dir_names.add(os.path.relpath(os.path.join(root, name), out_dir).replace(os.sep, '/'))
+        self.assertEqual(dir_names, tar_names)
+        self.assertIn('train/img_0.jpg', dir_names)
+
+    def test_link_directory_output(self):
+        """link 输出中的图像与源文件共享 inode，标签文件正常写入"""
+        out_dir = os.path.join(self.temp_dir, 'linked')
+        generate_yolo_export(self.project, self.splits, self.setup_type, 'export_project', '',
+                             output=out_dir, archive_format='link')
+        linked = os.path.join(out_dir, 'train', 'images', 'img_0.jpg')
+        self.assertTrue(os.path.samefile(linked, self.image_paths[0]))
+        self.assertTrue(os.path.isfile(os.path.join(out_dir, 'train', 'labels', 'img_0.txt')))
+
+        # 重复导出到同一目录会替换已有链接
+        generate_yolo_export(self.project, self.splits, self.setup_type, 'export_project', '',
+                             output=out_dir, archive_format='link')
+        self.assertTrue(os.path.samefile(linked, self.image_paths[0]))
+
+    def test_link_or_copy_fallback(self):
+        """无法硬链接时回退为复制"""
+        target = os.path.join(self.temp_dir, 'copied.jpg')
+        with mock.patch('os.link', side_effect=OSError(errno.EXDEV, 'cross-device link')), \
+                mock.patch('visiofirm.utils.archive_writer._reflink', side_effect=OSError(errno.ENOTSUP, 'no reflink')):
+            self.assertEqual(link_or_copy(self.image_paths[0], target), 'copy')
+        self.assertFalse(os.path.samefile(target, self.image_paths[0]))
+        with open(target, 'rb') as a, open(self.image_paths[0], 'rb') as b:
+            self.assertEqual(a.read(), b.read())
+
+    def test_incremental_cache(self):
+        """第二次导出复用缓存，只重新生成标注有变化的图像"""
+        def export():
+            cache = ExportCache.for_project(self.project, 'YOLO', self.setup_type, self.project.get_classes())
+            buffer = generate_yolo_export(self.project, self.splits, self.setup_type, 'export_project', '', cache=cache)
+            with zipfile.ZipFile(buffer) as zf:
+                labels = {name: zf.read(name) for name in zf.namelist() if name.endswith('.txt')}
+            return cache, labels
+
+        first_cache, first = export()
+        self.assertEqual((first_cache.hits, first_cache.misses), (0, 3))
+        second_cache, second = export()
+        self.assertEqual((second_cache.hits, second_cache.misses), (3, 0))
+        self.assertEqual(first, second)
+
+        self.project.save_annotations(self.image_paths[0], [{'type': 'rect', 'label': 'dog', 'bbox': [0, 0, 20, 10]}])
+        third_cache, third = export()
+        self.assertEqual((third_cache.hits, third_cache.misses), (2, 1))
+        self.assertEqual(third['train/labels/img_0.txt'].decode().split()[0], '1')
+        self.assertEqual(third['val/labels/img_2.txt'], first['val/labels/img_2.txt'])
+
+        self.project.add_classes(['bird'])
+        fourth_cache, _ = export()
+        self.assertEqual(fourth_cache.hits, 0)
+
+    def test_stream_propagates_errors(self):
+        """写出过程中的异常传递给消费者"""
+        def failing(output):
+            output.write(b'partial')
+            raise IOError('disk gone')
+        with self.assertRaises(IOError):
+            list(iter_zip_stream(failing))
+
+
+class TestSegmentationExports(ExportTestCase):
+    """分割项目导出测试类"""
+
+    setup_type = "Segmentation"
+
+    def annotations_for(self, index):
+        return [{'label': 'cat', 'segmentation': [10, 10, 50, 10, 50, 30, 10, 30]}]
+
+    def coco_annotations(self, **kwargs):
+        buffer = generate_coco_export(self.project, self.splits, self.setup_type, 'export_project', '', **kwargs)
+        with zipfile.ZipFile(buffer) as zf:
+            return json.loads(zf.read('annotations/instances_train.json'))['annotations']
+
+    def test_coco_rle_encoding(self):
+        """mask_encoding='rle' 时 segmentation 为压缩 RLE，面积为像素数"""
+        polygon = self.coco_annotations()[0]
+        self.assertEqual(polygon['segmentation'], [[10, 10, 50, 10, 50, 30, 10, 30]])
+        self.assertEqual(polygon['area'], 800)
+
+        rle = self.coco_annotations(mask_encoding='rle')[0]
+        self.assertEqual(rle['segmentation']['size'], [100, 200])
+        self.assertIsInstance(rle['segmentation']['counts'], str)
+        # 栅格化包含边界像素
+        self.assertEqual(rle['area'], 41 * 21)
+        self.assertEqual(rle['bbox'], polygon['bbox'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+几何计算模块测试
+测试旋转框角点、多边形外接框/面积以及坐标归一化
+"""
+
+import unittest
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from visiofirm.utils.geometry import (
+    annotation_boxes, as_points, obb_to_corners, corners_to_obb, polygon_bbox, polygon_extent,
+    polygons_bbox, polygon_area, normalize_points, denormalize_points,
+    xywh_to_yolo, yolo_to_xywh, format_values
+)
+
+
+class TestGeometry(unittest.TestCase):
+    """几何计算测试类"""
+
+    def test_as_points_formats(self):
+        """扁平列表、点字典和二维数组得到相同结果"""
+        expected = [[1, 2], [3, 4]]
+        np.testing.assert_array_equal(as_points([1, 2, 3, 4]), expected)
+        np.testing.assert_array_equal(as_points([{'x': 1, 'y': 2}, {'x': 3, 'y': 4}]), expected)
+        np.testing.assert_array_equal(as_points(expected), expected)
+        self.assertEqual(as_points([]).shape, (0, 2))
+
+    def test_obb_corners_round_trip(self):
+        """旋转框转角点后可以还原"""
+        boxes = np.array([[10, 20, 40, 10, 0], [0, 0, 20, 20, 90], [5, 5, 30, 12, 33]], dtype=float)
+        corners = obb_to_corners(boxes)
+        self.assertEqual(corners.shape, (3, 4, 2))
+        np.testing.assert_allclose(corners[0], [[10, 20], [50, 20], [50, 30], [10, 30]])
+        np.testing.assert_allclose(corners_to_obb(corners), boxes, atol=1e-9)
+
+    def test_polygon_bbox_and_area(self):
+        """外接框和鞋带面积，三角形面积为外接框的一半"""
+        triangle = [0, 0, 10, 0, 0, 10]
+        np.testing.assert_array_equal(polygon_bbox(triangle), [0, 0, 10, 10])
+        self.assertEqual(polygon_extent(triangle), (0.0, 0.0, 10.0, 10.0))
+        self.assertAlmostEqual(polygon_area(triangle), 50.0)
+        rotated_square = obb_to_corners([0, 0, 10, 10, 45])[0]
+        self.assertAlmostEqual(polygon_area(rotated_square), 100.0)
+        self.assertEqual(polygon_area([0, 0, 1, 1]), 0.0)
+        np.testing.assert_allclose(polygons_bbox(obb_to_corners([[0, 0, 4, 2, 0], [1, 1, 2, 2, 0]])),
+                                   [[0, 0, 4, 2], [1, 1, 2, 2]])
+
+    def test_normalization(self):
+        """归一化与反归一化互逆，YOLO 框转换互逆"""
+        points = normalize_points([50, 25, 200, 100], 200, 100)
+        np.testing.assert_allclose(points, [[0.25, 0.25], [1.0, 1.0]])
+        np.testing.assert_allclose(denormalize_points(points, 200, 100), [[50, 25], [200, 100]])
+        yolo = xywh_to_yolo([[10, 20, 50, 40]], 200, 100)
+        np.testing.assert_allclose(yolo, [[0.175, 0.4, 0.25, 0.4]])
+        np.testing.assert_allclose(yolo_to_xywh(yolo, 200, 100), [[10, 20, 50, 40]])
+        self.assertEqual(xywh_to_yolo([], 200, 100).shape, (0, 4))
+        self.assertEqual(format_values([[0.5, 1]]), '0.5 1.0')
+
+    def test_annotation_boxes(self):
+        """标注行的框列堆叠为 (N, 5)，NULL 记为 0"""
+        row = (1, 1, None, 'rect', 'cat', 10, 20, 50, 40, None, None)
+        np.testing.assert_allclose(annotation_boxes([row]), [[10, 20, 50, 40, 0]])
+        self.assertEqual(annotation_boxes([]).shape, (0, 5))
+
+
+if __name__ == '__main__':
+    unittest.main()
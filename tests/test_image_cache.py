@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+训练图像缩放缓存测试模块
+测试按训练尺寸缩小、缓存命中、小图直接链接以及过期缓存清理
+"""
+
+import unittest
+import tempfile
+import os
+import shutil
+import sys
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from visiofirm.utils.image_cache import ResizedImageCache, resized_shape
+from visiofirm.utils.dataset_manifest import file_digest
+
+
+class TestResizedImageCache(unittest.TestCase):
+    """缩放缓存测试类"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache = ResizedImageCache(os.path.join(self.temp_dir, 'cache'), 64)
+        self.large = self.write_image('large.jpg', 200, 100)
+        self.small = self.write_image('small.png', 40, 30)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def write_image(self, name, width, height):
+        path = os.path.join(self.temp_dir, name)
+        cv2.imwrite(path, np.full((height, width, 3), 128, dtype=np.uint8))
+        return path
+
+    def test_resized_shape(self):
+        """长边缩放到 imgsz，保持宽高比且不放大"""
+        self.assertEqual(resized_shape(4000, 3000, 640), (640, 480))
+        self.assertEqual(resized_shape(300, 200, 640), (300, 200))
+
+    def test_large_image_resized_and_cached(self):
+        """大图生成缩放副本，再次物化时命中缓存"""
+        dest = os.path.join(self.temp_dir, 'dest.jpg')
+        digest = file_digest(self.large)
+        self.assertEqual(self.cache.materialize(self.large, dest, digest), 'resized')
+        self.assertEqual(cv2.imread(dest).shape[:2], (32, 64))
+        self.assertTrue(os.path.samefile(dest, self.cache.cache_path(self.large, digest)))
+        self.assertEqual(self.cache.materialize(self.large, dest, digest), 'cached')
+
+    def test_small_image_linked(self):
+        """长边不超过 imgsz 的图像直接链接原图"""
+        dest = os.path.join(self.temp_dir, 'dest.png')
+        self.assertEqual(self.cache.materialize(self.small, dest, file_digest(self.small)), 'original')
+        self.assertTrue(os.path.samefile(dest, self.small))
+        self.assertEqual(os.listdir(self.cache.cache_dir), [])
+
+    def test_prune(self):
+        """清理未被引用的哈希和其他尺寸的缓存"""
+        digest = file_digest(self.large)
+        self.cache.materialize(self.large, os.path.join(self.temp_dir, 'a.jpg'), digest)
+        other_size = ResizedImageCache(self.cache.cache_dir, 32)
+        other_size.materialize(self.large, os.path.join(self.temp_dir, 'b.jpg'), digest)
+        self.assertEqual(self.cache.prune({digest}), 1)
+        self.assertEqual(os.listdir(self.cache.cache_dir), [os.path.basename(self.cache.cache_path(self.large, digest))])
+        self.assertEqual(self.cache.prune(set()), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+推理服务测试模块
+测试微批次收集、优先级排序以及服务进程的端到端请求处理
+"""
+
+import unittest
+import tempfile
+import os
+import shutil
+import sys
+import queue
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from visiofirm.utils.inference_server import (
+    InferenceClient, _collect_batch, PRIORITY_ON_DEMAND, PRIORITY_BACKGROUND
+)
+
+
+class StubProcessor:
+    """按批次大小返回空检测结果的处理器"""
+
+    def process_batch(self, images, classes_str, mode="BoundingBox", box_threshold=None):
+        return [
+            {
+                "boxes": np.zeros((0, 4), dtype=np.float32),
+                "scores": np.zeros((0,), dtype=np.float32),
+                "labels": [],
+                "batch_size": len(images),
+                "width": image.width,
+            }
+            for image in images
+        ]
+
+
+def stub_processor_factory(config):
+    return StubProcessor()
+
+
+def _request(seq, priority=PRIORITY_BACKGROUND):
+    return {'id': seq, 'seq': seq, 'priority': priority}
+
+
+class TestCollectBatch(unittest.TestCase):
+    """微批次收集测试类"""
+
+    def test_batch_is_capped_at_max_size(self):
+        """批次大小不超过上限，剩余请求留在本地堆中"""
+        q = queue.Queue()
+        for i in range(5):
+            q.put(_request(i))
+        pending = []
+        batch, stop = _collect_batch(q, pending, max_batch_size=3, max_wait_ms=50)
+        self.assertFalse(stop)
+        self.assertEqual([r['seq'] for r in batch], [0, 1, 2])
+        self.assertEqual(len(pending), 2)
+
+    def test_on_demand_requests_are_served_first(self):
+        """按需请求排在已排队的后台请求之前"""
+        q = queue.Queue()
+        for i in range(3):
+            q.put(_request(i))
+        q.put(_request(3, PRIORITY_ON_DEMAND))
+        batch, _ = _collect_batch(q, [], max_batch_size=2, max_wait_ms=10)
+        self.assertEqual([r['seq'] for r in batch], [3, 0])
+
+    def test_stop_signal(self):
+        """收到 None 时返回停止标志"""
+        q = queue.Queue()
+        q.put(_request(0))
+        q.put(None)
+        batch, stop = _collect_batch(q, [], max_batch_size=4, max_wait_ms=10)
+        self.assertTrue(stop)
+        self.assertEqual(len(batch), 1)
+
+
+class TestInferenceClient(unittest.TestCase):
+    """推理服务端到端测试类"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.image_paths = []
+        for i in range(4):
+            path = os.path.join(self.temp_dir, f"img_{i}.png")
+            Image.new("RGB", (32 + i, 24)).save(path)
+            self.image_paths.append(path)
+        self.client = InferenceClient(max_batch_size=4, max_wait_ms=500,
+                                      processor_factory=stub_processor_factory)
+
+    def tearDown(self):
+        self.client.shutdown()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_concurrent_requests_are_coalesced(self):
+        """并发提交的请求被合并成一个批次并正确分发结果"""
+        config = {'model_type': 'yolo', 'device': 'cpu'}
+        futures = [self.client.submit(path, "cat, dog", config) for path in self.image_paths]
+        results = [f.result(timeout=60) for f in futures]
+        self.assertEqual([r['width'] for r in results], [32, 33, 34, 35])
+        self.assertTrue(all(r['batch_size'] > 1 for r in results))
+
+    def test_missing_image_raises(self):
+        """无法读取的图像以异常形式返回给调用方"""
+        future = self.client.submit(os.path.join(self.temp_dir, "missing.png"), "cat", {'model_type': 'yolo'})
+        with self.assertRaises(RuntimeError):
+            future.result(timeout=60)
+
+
+if __name__ == '__main__':
+    unittest.main()
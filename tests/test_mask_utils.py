@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+掩码 RLE 工具测试模块
+测试 RLE 编解码、压缩 counts 字符串以及多边形互转
+"""
+
+import unittest
+import os
+import sys
+import json
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from visiofirm.utils.mask_utils import (
+    encode_rle, decode_rle, counts_to_string, string_to_counts,
+    rle_area, rle_bbox, polygon_to_mask, parse_segmentation, segmentation_polygon
+)
+
+
+class TestRLE(unittest.TestCase):
+    """RLE 编解码测试类"""
+
+    def setUp(self):
+        self.mask = np.zeros((6, 8), dtype=np.uint8)
+        self.mask[1:4, 2:7] = 1
+
+    def test_round_trip(self):
+        """编码后解码还原原掩码，包括以前景开头的掩码"""
+        for mask in (self.mask, 1 - self.mask, np.zeros((3, 3), np.uint8)):
+            for compressed in (True, False):
+                np.testing.assert_array_equal(decode_rle(encode_rle(mask, compressed)), mask)
+
+    def test_column_major_counts(self):
+        """counts 按列优先计数且从背景开始"""
+        mask = np.array([[1, 0], [1, 1]], dtype=np.uint8)
+        self.assertEqual(encode_rle(mask, compressed=False)['counts'], [0, 2, 1, 1])
+
+    def test_counts_string(self):
+        """压缩字符串可还原为行程列表"""
+        counts = [0, 5, 120, 3, 40000, 7, 1]
+        self.assertEqual(string_to_counts(counts_to_string(counts)), counts)
+
+    def test_area_and_bbox(self):
+        """面积为前景像素数，外接框为 [x, y, w, h]"""
+        rle = encode_rle(self.mask)
+        self.assertEqual(rle_area(rle), 15)
+        self.assertEqual(rle_bbox(rle), [2, 1, 5, 3])
+        self.assertEqual(rle_bbox(encode_rle(np.zeros((4, 4)))), [0, 0, 0, 0])
+
+
+class TestPolygonConversion(unittest.TestCase):
+    """多边形转换测试类"""
+
+    def test_polygon_to_mask(self):
+        """矩形多边形栅格化包含边界像素"""
+        mask = polygon_to_mask([2, 1, 6, 1, 6, 3, 2, 3], 8, 6)
+        self.assertEqual(mask.shape, (6, 8))
+        self.assertEqual(int(mask.sum()), 15)
+
+    def test_segmentation_polygon(self):
+        """数据库中的多边形原样返回，RLE 解码为外轮廓，无效值返回空列表"""
+        self.assertEqual(segmentation_polygon('[1, 2, 3, 4, 5, 6]'), [1, 2, 3, 4, 5, 6])
+        self.assertEqual(segmentation_polygon(None), [])
+        self.assertEqual(segmentation_polygon('not json'), [])
+        self.assertIsNone(parse_segmentation('{"a": 1}'))
+
+        mask = polygon_to_mask([2, 1, 6, 1, 6, 3, 2, 3], 8, 6)
+        polygon = segmentation_polygon(json.dumps(encode_rle(mask)))
+        xs, ys = polygon[0::2], polygon[1::2]
+        self.assertEqual((min(xs), min(ys), max(xs), max(ys)), (2, 1, 6, 3))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+训练指标中心测试模块
+测试事件顺序、环形缓冲区上限、批量持久化以及订阅者等待
+"""
+
+import unittest
+import threading
+import time
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from visiofirm.utils.metrics_hub import MetricsHub, FINAL_EVENT
+
+
+class TestMetricsHub(unittest.TestCase):
+    """指标中心测试类"""
+
+    def setUp(self):
+        self.persisted = []
+        self.hub = MetricsHub(buffer_size=5, flush_rows=3, flush_seconds=3600)
+        self.key = ('demo', 1)
+        self.hub.open(self.key, persist=self.persisted.append)
+
+    def test_events_in_order(self):
+        first = self.hub.publish(self.key, 'batch', {'batch': 1})
+        second = self.hub.publish(self.key, 'epoch', {'epoch': 1})
+        events = self.hub.wait_for(self.key, 0, timeout=0)
+        self.assertEqual([e['seq'] for e in events], [first, second])
+        self.assertEqual(self.hub.wait_for(self.key, first, timeout=0)[0]['data'], {'epoch': 1})
+        self.assertEqual(self.hub.latest(self.key, 'batch')['data'], {'batch': 1})
+        self.assertIsNone(self.hub.latest(self.key, 'status'))
+
+    def test_ring_buffer_bounded(self):
+        for i in range(12):
+            self.hub.publish(self.key, 'batch', {'batch': i})
+        events = self.hub.wait_for(self.key, 0, timeout=0)
+        self.assertEqual([e['data']['batch'] for e in events], [7, 8, 9, 10, 11])
+
+    def test_epochs_persisted_in_batches(self):
+        for epoch in range(1, 5):
+            self.hub.publish(self.key, 'epoch', {'epoch': epoch})
+            self.hub.publish(self.key, 'batch', {'epoch': epoch})
+        # 满 3 条写一次，批次事件不写库
+        self.assertEqual(self.persisted, [[{'epoch': 1}, {'epoch': 2}, {'epoch': 3}]])
+
+        self.hub.close(self.key, 'completed')
+        self.assertEqual(self.persisted[-1], [{'epoch': 4}])
+        self.assertEqual(self.hub.latest(self.key, FINAL_EVENT)['data'], {'status': 'completed'})
+
+    def test_wait_wakes_on_publish_and_close(self):
+        def producer():
+            time.sleep(0.05)
+            self.hub.publish(self.key, 'epoch', {'epoch': 1})
+
+        thread = threading.Thread(target=producer)
+        thread.start()
+        events = self.hub.wait_for(self.key, 0, timeout=5)
+        thread.join()
+        self.assertEqual(len(events), 1)
+
+        last_seq = events[-1]['seq']
+        self.hub.close(self.key, 'stopped')
+        self.assertTrue(self.hub.is_closed(self.key))
+        started = time.monotonic()
+        events = self.hub.wait_for(self.key, last_seq, timeout=5)
+        self.assertEqual(events[-1]['type'], FINAL_EVENT)
+        # 已关闭且无新事件时立即返回
+        self.assertEqual(self.hub.wait_for(self.key, events[-1]['seq'], timeout=5), [])
+        self.assertLess(time.monotonic() - started, 1)
+
+    def test_reopen_drops_finished_streams(self):
+        self.hub.publish(self.key, 'epoch', {'epoch': 1})
+        self.hub.close(self.key, 'completed')
+        self.hub.open(('demo', 2))
+        self.assertFalse(self.hub.has_stream(self.key))
+        self.assertTrue(self.hub.has_stream(('demo', 2)))
+        self.assertFalse(self.hub.is_closed(('demo', 2)))
+
+
+if __name__ == '__main__':
+    unittest.main()
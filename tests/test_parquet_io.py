@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Parquet 导出导入测试模块
+测试列类型、多边形打包以及导出后再导入的往返一致性
+"""
+
+import unittest
+import os
+import sys
+import zipfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from visiofirm.models.project import Project
+from visiofirm.utils.parquet_io import (
+    PARQUET_AVAILABLE, IMAGES_FILE, ANNOTATIONS_FILE,
+    generate_parquet_export, import_parquet_annotations
+)
+from tests.test_export_utils import ExportTestCase
+
+if PARQUET_AVAILABLE:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+
+def annotation_rows(project):
+    return sorted(
+        (a['class_name'], a['x'], a['y'], a['width'], a['height'], tuple((p['x'], p['y']) for p in a['points']))
+        for image_id, _, _, _ in project.get_images()
+        for a in project.get_annotations_by_image_id(image_id)
+    )
+
+
+@unittest.skipUnless(PARQUET_AVAILABLE, "pyarrow not installed")
+class TestParquetBoundingBox(ExportTestCase):
+    """检测框项目 Parquet 测试类"""
+
+    def export_tables(self):
+        buffer = generate_parquet_export(self.project, self.splits, self.setup_type)
+        extract_dir = os.path.join(self.temp_dir, 'extracted')
+        with zipfile.ZipFile(buffer) as zf:
+            self.assertIn('images/val/img_2.jpg', zf.namelist())
+            zf.extractall(extract_dir)
+        return os.path.join(extract_dir, IMAGES_FILE), os.path.join(extract_dir, ANNOTATIONS_FILE)
+
+    def test_typed_columns(self):
+        """导出的表带有类型化的列和类别元数据"""
+        images_path, annotations_path = self.export_tables()
+        images = pq.read_table(images_path)
+        annotations = pq.read_table(annotations_path)
+        self.assertEqual(images.num_rows, 3)
+        self.assertEqual(annotations.num_rows, 6)
+        self.assertEqual(annotations.schema.field('x').type, pa.float64())
+        self.assertEqual(annotations.schema.field('polygon').type, pa.list_(pa.float64()))
+        self.assertEqual(sorted(images.column('split').to_pylist()), ['train', 'train', 'val'])
+        self.assertIn(b'visiofirm.classes', annotations.schema.metadata)
+
+    def test_round_trip(self):
+        """导出的标注导入到同图像的新项目后保持一致"""
+        _, annotations_path = self.export_tables()
+        target_path = os.path.join(self.temp_dir, 'target')
+        os.makedirs(target_path)
+        target = Project('target', '', self.setup_type, target_path)
+        target.add_images(self.image_paths)
+
+        result = import_parquet_annotations(target, annotations_path)
+        self.assertEqual(result, {'annotations': 6, 'images': 3, 'skipped': 0})
+        self.assertEqual(annotation_rows(target), annotation_rows(self.project))
+        self.assertEqual(sorted(target.get_classes()), ['cat', 'dog'])
+
+        # 重复导入默认替换已有标注
+        import_parquet_annotations(target, annotations_path)
+        self.assertEqual(len(annotation_rows(target)), 6)
+
+
+@unittest.skipUnless(PARQUET_AVAILABLE, "pyarrow not installed")
+class TestParquetSegmentation(ExportTestCase):
+    """分割项目 Parquet 测试类"""
+
+    setup_type = "Segmentation"
+
+    def annotations_for(self, index):
+        return [{'label': 'cat', 'segmentation': [0, 0, 10 + index, 0, 0, 10]}]
+
+    def test_polygon_round_trip(self):
+        """多边形以数值列表存储并可还原"""
+        out_dir = os.path.join(self.temp_dir, 'parquet_dir')
+        generate_parquet_export(self.project, self.splits, self.setup_type, output=out_dir, archive_format='dir')
+        polygons = pq.read_table(os.path.join(out_dir, ANNOTATIONS_FILE)).column('polygon').to_pylist()
+        self.assertIn([0.0, 0.0, 10.0, 0.0, 0.0, 10.0], polygons)
+
+        self.project.save_annotations(self.image_paths[0], [])
+        import_parquet_annotations(self.project, os.path.join(out_dir, ANNOTATIONS_FILE))
+        self.assertEqual(len(annotation_rows(self.project)), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+性能管理器测试模块
+测试CPU预算的分配、重新平衡和释放，数据集缓存策略，以及后台资源采样和基于趋势的优化建议
+"""
+
+import unittest
+import os
+import sys
+import time
+from collections import namedtuple
+from unittest import mock
+
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from visiofirm.utils.performance_config import PerformanceManager
+from visiofirm.utils import resource_sampler
+from visiofirm.utils.resource_sampler import ResourceSampler
+
+
+class TestCpuBudget(unittest.TestCase):
+    """CPU预算测试类"""
+
+    def setUp(self):
+        self.manager = PerformanceManager()
+        self.manager.cpu_budget = 12
+        self.original_threads = torch.get_num_threads()
+
+    def tearDown(self):
+        torch.set_num_threads(self.original_threads)
+
+    def test_single_training_job_gets_whole_budget(self):
+        """单个训练任务获得全部核数，其中一部分给数据加载进程"""
+        allocation = self.manager.allocate_cpu('train-1', kind='training')
+        self.assertEqual(allocation['threads'] + allocation['workers'], 12)
+        self.assertGreater(allocation['workers'], 0)
+
+    def test_rebalance_when_jobs_start_and_finish(self):
+        """新任务加入时按权重缩减，任务结束后恢复"""
+        alone = self.manager.allocate_cpu('train-1', kind='training')
+        self.manager.allocate_cpu('pre-1', kind='preannotation')
+        shared = self.manager.get_cpu_allocation('train-1')
+        pre = self.manager.get_cpu_allocation('pre-1')
+        self.assertLess(shared['threads'], alone['threads'])
+        self.assertLessEqual(shared['threads'] + shared['workers'] + pre['threads'], 12)
+        self.assertEqual(pre['workers'], 0)
+
+        self.manager.release_cpu('pre-1')
+        self.assertEqual(self.manager.get_cpu_allocation('train-1')['threads'], alone['threads'])
+        self.assertIsNone(self.manager.get_cpu_allocation('pre-1'))
+
+    def test_register_task_allocates_cpu(self):
+        """注册训练任务时自动分配CPU，注销时释放"""
+        self.manager.register_task(7, {'model_type': 'yolov8n'})
+        self.assertIsNotNone(self.manager.get_cpu_allocation(7))
+        self.manager.unregister_task(7)
+        self.assertIsNone(self.manager.get_cpu_allocation(7))
+
+    def test_in_process_jobs_share_one_thread_pool(self):
+        """本进程内的任务按份额之和设置一次进程级线程数，全部结束后恢复"""
+        default = self.manager._default_threads
+        self.manager.allocate_cpu('train-1', kind='training')
+        # 训练在子进程中运行，不改变本进程的线程数
+        self.assertEqual(torch.get_num_threads(), default)
+
+        self.manager.allocate_cpu('pre-1', kind='preannotation', in_process=True)
+        self.manager.allocate_cpu('pre-2', kind='preannotation', in_process=True)
+        shares = [self.manager.get_cpu_allocation(job)['threads'] for job in ('pre-1', 'pre-2')]
+        self.assertEqual(torch.get_num_threads(), sum(shares))
+
+        self.manager.release_cpu('pre-1')
+        self.assertEqual(torch.get_num_threads(), self.manager.get_cpu_allocation('pre-2')['threads'])
+        self.manager.release_cpu('pre-2')
+        self.assertEqual(torch.get_num_threads(), default)
+
+
+class TestDatasetCacheMode(unittest.TestCase):
+    """数据集缓存策略测试类"""
+
+    GB = 1024 ** 3
+    DiskUsage = namedtuple('DiskUsage', 'total used free')
+
+    def setUp(self):
+        self.manager = PerformanceManager()
+
+    def choose(self, task_id, image_sizes, ram_gb, disk_gb):
+        memory = mock.Mock(available=ram_gb * self.GB)
+        with mock.patch('visiofirm.utils.performance_config.psutil.virtual_memory', return_value=memory), \
+                mock.patch('visiofirm.utils.performance_config.shutil.disk_usage',
+                           return_value=self.DiskUsage(0, 0, disk_gb * self.GB)):
+            return self.manager.choose_cache_mode(task_id, image_sizes, 640, '/tmp')
+
+    def test_estimate_uses_resized_dimensions(self):
+        """按长边缩放到 imgsz 后的尺寸估算，未知尺寸按正方形计"""
+        self.assertEqual(self.manager.estimate_cache_bytes([(4000, 3000)], 640), 640 * 480 * 3)
+        self.assertEqual(self.manager.estimate_cache_bytes([(None, None)], 640), 640 * 640 * 3)
+
+    def test_ram_then_disk_then_none(self):
+        """内存放得下用内存，否则用磁盘，都不够时不缓存"""
+        sizes = [(4000, 3000)] * 2000  # 约 1.8GB，加余量约 2.75GB
+        self.assertEqual(self.choose(1, sizes, ram_gb=16, disk_gb=100), 'ram')
+        self.assertEqual(self.choose(2, sizes, ram_gb=4, disk_gb=100), 'disk')
+        self.assertIs(self.choose(3, sizes, ram_gb=4, disk_gb=6), False)
+
+    def test_reservations_of_other_tasks(self):
+        """其他任务的预占从可用量中扣除，任务注销后释放"""
+        sizes = [(4000, 3000)] * 2000
+        self.assertEqual(self.choose(1, sizes, ram_gb=7, disk_gb=0), 'ram')
+        self.assertIs(self.choose(2, sizes, ram_gb=7, disk_gb=0), False)
+        self.manager.register_task(1, {})
+        self.manager.unregister_task(1)
+        self.assertEqual(self.choose(2, sizes, ram_gb=7, disk_gb=0), 'ram')
+
+    def test_training_memory_budget_excludes_ram_cache(self):
+        """批量探测的内存预算扣除内存缓存预占和保留余量"""
+        sizes = [(4000, 3000)] * 2000
+        self.assertEqual(self.choose(1, sizes, ram_gb=16, disk_gb=0), 'ram')
+        reserved = self.manager.cache_reservations[1]['bytes']
+        memory = mock.Mock(available=16 * self.GB)
+        with mock.patch('visiofirm.utils.performance_config.psutil.virtual_memory', return_value=memory), \
+                mock.patch('visiofirm.utils.performance_config.BATCH_FINDER_MEMORY_FRACTION', 0.5):
+            budget = self.manager.training_memory_budget(1)
+        self.assertEqual(budget, int((16 * self.GB - reserved - 2 * self.GB) * 0.5))
+
+    def test_loaded_caches_not_counted_twice(self):
+        """已加载的缓存已体现在可用内存中，不再从后续任务的可用量和探测预算中扣除"""
+        sizes = [(4000, 3000)] * 2000
+        self.assertEqual(self.choose(1, sizes, ram_gb=7, disk_gb=0), 'ram')
+        self.assertIs(self.choose(2, sizes, ram_gb=7, disk_gb=0), False)
+        memory = mock.Mock(available=16 * self.GB)
+        with mock.patch('visiofirm.utils.performance_config.psutil.virtual_memory', return_value=memory), \
+                mock.patch('visiofirm.utils.performance_config.BATCH_FINDER_MEMORY_FRACTION', 1.0):
+            before = self.manager.training_memory_budget(3)
+            self.manager.mark_cache_loaded(1)
+            after = self.manager.training_memory_budget(3)
+        self.assertEqual(after - before, self.manager.cache_reservations[1]['bytes'])
+        # 任务 1 的缓存加载后可用内存下降，剩余部分足够任务 2 缓存
+        self.assertEqual(self.choose(2, sizes, ram_gb=5, disk_gb=0), 'ram')
+
+
+class TestResourceSampler(unittest.TestCase):
+    """资源采样与趋势建议测试类"""
+
+    def test_ring_buffer_and_history(self):
+        """缓冲区长度固定，采样包含进程内存和磁盘 I/O"""
+        sampler = ResourceSampler(interval=60, history_size=3)
+        for _ in range(5):
+            sample = sampler.sample()
+        self.assertEqual(len(sampler.history()), 3)
+        self.assertIs(sampler.latest(), sample)
+        self.assertEqual(sample['processes'][0]['pid'], os.getpid())
+        self.assertGreater(sample['rss_mb'], 0)
+        self.assertIn('gpu_info', sample)
+
+    def test_start_does_not_block(self):
+        """启动采样线程后读取最新采样无需等待"""
+        sampler = ResourceSampler(interval=60)
+        started = time.monotonic()
+        sampler.start()
+        sampler.start()
+        self.assertIsNotNone(sampler.latest())
+        self.assertLess(time.monotonic() - started, 0.9)
+        sampler.stop()
+
+    def test_gpu_info_does_not_initialize_cuda(self):
+        """NVML 不可用且本进程未初始化 CUDA 时不调用 mem_get_info，显存总量取自设备属性"""
+        cuda = 'visiofirm.utils.resource_sampler.torch.cuda'
+        with mock.patch(f'{cuda}.is_available', return_value=True), \
+                mock.patch(f'{cuda}.device_count', return_value=1), \
+                mock.patch(f'{cuda}.is_initialized', return_value=False), \
+                mock.patch(f'{cuda}.device_memory_used', side_effect=ModuleNotFoundError('pynvml')), \
+                mock.patch(f'{cuda}.get_device_properties', return_value=mock.Mock(total_memory=8 * 1024 ** 3)), \
+                mock.patch(f'{cuda}.get_device_name', return_value='Fake GPU'), \
+                mock.patch(f'{cuda}.memory_reserved', return_value=2 * 1024 ** 3), \
+                mock.patch(f'{cuda}.utilization', side_effect=ModuleNotFoundError('pynvml')), \
+                mock.patch(f'{cuda}.mem_get_info') as mem_get_info:
+            info = resource_sampler._gpu_info()
+        mem_get_info.assert_not_called()
+        self.assertEqual(info[0]['memory_total_gb'], 8.0)
+        self.assertEqual(info[0]['memory_percent'], 25.0)
+        self.assertNotIn('utilization', info[0])
+
+    def test_trend_slope(self):
+        """趋势斜率按每分钟计算"""
+        sampler = ResourceSampler(history_size=10)
+        now = time.time()
+        for i in range(4):
+            sampler.samples.append({'timestamp': now - 30 + i * 10, 'cpu_percent': 50.0,
+                                    'memory_percent': 40.0 + i * 5, 'rss_mb': 100.0, 'gpu_info': []})
+        trend = sampler.trend(60)
+        self.assertAlmostEqual(trend['memory_percent']['slope'], 30.0)
+        self.assertEqual(trend['cpu_percent']['slope'], 0.0)
+        self.assertEqual(trend['memory_percent']['samples'], 4)
+
+    def test_suggestions_use_trend(self):
+        """内存持续上升时提前给出建议，CPU 以窗口均值判断"""
+        manager = PerformanceManager()
+        usage = {'memory_percent': 70, 'cpu_percent': 99, 'gpu_info': []}
+        trend = {
+            'memory_percent': {'mean': 65, 'max': 70, 'slope': 3.0, 'samples': 10},
+            'cpu_percent': {'mean': 60, 'max': 99, 'slope': 0.0, 'samples': 10},
+        }
+        types = [s['type'] for s in manager.suggest_optimization('yolov8n', {'batch': 16}, usage, trend)]
+        self.assertIn('memory', types)
+        self.assertNotIn('cpu', types)
+
+        trend['memory_percent']['slope'] = 0.0
+        trend['cpu_percent']['mean'] = 95
+        types = [s['type'] for s in manager.suggest_optimization('yolov8n', {'batch': 16}, usage, trend)]
+        self.assertEqual(types, ['cpu'])
+
+
+if __name__ == '__main__':
+    unittest.main()
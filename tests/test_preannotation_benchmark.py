@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+预标注基准测试脚本的测试模块
+使用小规模合成项目验证报告中的各阶段耗时和回归检查
+"""
+
+import unittest
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'scripts'))
+
+from benchmark_preannotation import run_benchmark, check_regression, STAGES
+
+
+class TestPreannotationBenchmark(unittest.TestCase):
+    """预标注基准测试类"""
+
+    def test_bounding_box_report(self):
+        """检测框项目：报告包含吞吐、各阶段耗时和写入数量"""
+        report = run_benchmark(num_images=4, image_size=(320, 240))
+        self.assertEqual(report['images'], 4)
+        self.assertGreater(report['images_per_second'], 0)
+        self.assertGreater(report['preannotations'], 0)
+        self.assertEqual(set(report['stage_ms_per_image']), set(STAGES))
+        self.assertGreater(report['stage_ms_per_image']['detect'], 0)
+        self.assertGreater(report['peak_rss_mb'], 0)
+
+    def test_segmentation_report(self):
+        """分割项目：轮廓阶段被计时"""
+        report = run_benchmark(num_images=3, setup_type='Segmentation', image_size=(320, 240))
+        self.assertGreater(report['preannotations'], 0)
+        self.assertGreater(report['stage_ms_per_image']['contour'], 0)
+
+    def test_regression_check(self):
+        """吞吐下降超过阈值时给出错误"""
+        self.assertIsNone(check_regression({'images_per_second': 9.0}, {'images_per_second': 10.0}, 0.2))
+        self.assertIsNotNone(check_regression({'images_per_second': 7.0}, {'images_per_second': 10.0}, 0.2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+预标注模型池测试模块
+测试常驻模型池的LRU淘汰以及按需请求的优先级调度
+"""
+
+import unittest
+import json
+import os
+import sys
+import sqlite3
+import tempfile
+import shutil
+import threading
+import time
+from concurrent.futures import Future
+from unittest import mock
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from visiofirm.utils import VFPreAnnotator
+from visiofirm.utils.VFPreAnnotator import ModelPool, PreAnnotator, _PriorityGate
+
+
+class TestModelPool(unittest.TestCase):
+    """模型池测试类"""
+
+    def test_processors_are_reused_and_evicted_lru(self):
+        """相同配置复用处理器，超出容量时淘汰最久未使用的"""
+        with mock.patch.object(VFPreAnnotator, 'ImageProcessor', side_effect=lambda **kw: object()):
+            pool = ModelPool(max_models=2)
+            a = pool.get_processor('yolo', 'a.pt', 'sam.pt', 'cpu')
+            b = pool.get_processor('yolo', 'b.pt', 'sam.pt', 'cpu')
+            self.assertIs(pool.get_processor('yolo', 'a.pt', 'sam.pt', 'cpu'), a)
+            pool.get_processor('yolo', 'c.pt', 'sam.pt', 'cpu')
+            self.assertIs(pool.get_processor('yolo', 'a.pt', 'sam.pt', 'cpu'), a)
+            self.assertIsNot(pool.get_processor('yolo', 'b.pt', 'sam.pt', 'cpu'), b)
+
+    def test_slow_load_does_not_block_warm_hits(self):
+        """冷加载配置 A 时命中已缓存的配置 B 不等待，同一配置只加载一次"""
+        release = threading.Event()
+        calls = []
+
+        def build(**kw):
+            calls.append(kw['yolo_model_path'])
+            if kw['yolo_model_path'] == 'a.pt':
+                release.wait(5)
+            return object()
+
+        with mock.patch.object(VFPreAnnotator, 'ImageProcessor', side_effect=build):
+            pool = ModelPool(max_models=2)
+            b = pool.get_processor('yolo', 'b.pt', 'sam.pt', 'cpu')
+            results = []
+            loaders = [threading.Thread(target=lambda: results.append(pool.get_processor('yolo', 'a.pt', 'sam.pt', 'cpu')))
+                       for _ in range(2)]
+            for t in loaders:
+                t.start()
+            time.sleep(0.05)
+
+            started = time.monotonic()
+            self.assertIs(pool.get_processor('yolo', 'b.pt', 'sam.pt', 'cpu'), b)
+            self.assertLess(time.monotonic() - started, 0.5)
+
+            release.set()
+            for t in loaders:
+                t.join(timeout=2)
+        self.assertEqual(calls, ['b.pt', 'a.pt'])
+        self.assertEqual(len(results), 2)
+        self.assertIs(results[0], results[1])
+
+    def test_priority_callers_run_before_waiting_background_work(self):
+        """等待中的按需请求优先于后台批处理"""
+        gate = _PriorityGate()
+        order = []
+        release = threading.Event()
+
+        def holder():
+            with gate.acquire():
+                release.wait()
+
+        def worker(name, priority):
+            with gate.acquire(priority=priority):
+                order.append(name)
+
+        t0 = threading.Thread(target=holder)
+        t0.start()
+        time.sleep(0.05)
+        background = threading.Thread(target=worker, args=('background', False))
+        background.start()
+        time.sleep(0.05)
+        on_demand = threading.Thread(target=worker, args=('on_demand', True))
+        on_demand.start()
+        time.sleep(0.05)
+        release.set()
+        for t in (t0, background, on_demand):
+            t.join(timeout=2)
+
+        self.assertEqual(order, ['on_demand', 'background'])
+
+
+class _WindowedClient:
+    """记录同时在途请求数的推理客户端替身：凑满 expected 个请求后一起返回，否则 1 秒后逐个返回"""
+
+    def __init__(self, expected):
+        self.expected = expected
+        self.pending = []
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def submit(self, image_path, classes_str, config, mode="BoundingBox", box_threshold=None, priority=False):
+        future = Future()
+        with self.lock:
+            self.pending.append(future)
+            self.max_in_flight = max(self.max_in_flight, len(self.pending))
+            if len(self.pending) >= self.expected:
+                ready, self.pending = self.pending, []
+            else:
+                ready = []
+                threading.Timer(1.0, self._resolve, args=(future,)).start()
+        for f in ready:
+            self._resolve(f)
+        return future
+
+    def _resolve(self, future):
+        with self.lock:
+            if future in self.pending:
+                self.pending.remove(future)
+        if not future.done():
+            future.set_result({"boxes": np.zeros((0, 4)), "scores": np.zeros((0,)), "labels": []})
+
+
+class TestRemoteInferences(unittest.TestCase):
+    """后台预标注使用推理服务时的批量提交测试类"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.temp_dir, 'config.db')
+        conn = sqlite3.connect(self.db_path)
+        conn.executescript("""
+            CREATE TABLE Project_Configuration (setup_type TEXT);
+            INSERT INTO Project_Configuration VALUES ('Bounding Box');
+            CREATE TABLE Classes (class_name TEXT);
+            INSERT INTO Classes VALUES ('cat');
+            CREATE TABLE Images (image_id INTEGER PRIMARY KEY, absolute_path TEXT);
+            CREATE TABLE Annotations (image_id INTEGER);
+            CREATE TABLE Preannotations (image_id INTEGER, type TEXT, class_name TEXT, x REAL, y REAL, width REAL,
+                                         height REAL, rotation REAL, segmentation TEXT, confidence REAL);
+        """)
+        # 图像文件不存在：远程推理时本进程不应解码图像
+        conn.executemany("INSERT INTO Images VALUES (?, ?)",
+                         [(i, os.path.join(self.temp_dir, f'missing_{i}.jpg')) for i in range(1, 4)])
+        conn.commit()
+        conn.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_background_requests_submitted_as_window(self):
+        """后台预标注一次提交多张图像，让推理服务能够组成微批次"""
+        client = _WindowedClient(expected=3)
+        annotator = PreAnnotator(model_type="yolo", device="cpu", config_db_path=self.db_path, inference_client=client)
+        with mock.patch.object(VFPreAnnotator.Image, 'open', side_effect=AssertionError("decoded locally")):
+            started = time.monotonic()
+            annotator.run_inferences()
+        self.assertEqual(client.max_in_flight, 3)
+        self.assertLess(time.monotonic() - started, 1.0)
+        self.assertEqual(annotator.get_stage_timings().get("decode", 0.0), 0.0)
+
+    def test_rle_masks_stored_with_mask_type(self):
+        """RLE 掩码以 'mask' 类型存储，画布和一键接受时转换为多边形"""
+        from visiofirm.routes.annotation import _annotation_from_preannotation, _format_preannotation
+        from visiofirm.utils.mask_utils import encode_rle
+
+        mask = np.zeros((6, 8), dtype=bool)
+        mask[1:4, 2:7] = True
+        annotator = PreAnnotator(model_type="yolo", device="cpu", config_db_path=self.db_path,
+                                 inference_client=_WindowedClient(expected=1), mask_format="rle")
+        annos = [{"label": "cat", "score": 0.9, "rle": encode_rle(mask)},
+                 {"label": "cat", "score": 0.8, "rle": encode_rle(np.zeros((6, 8), dtype=bool))}]
+        cursor = annotator.conn.cursor()
+        self.assertEqual(annotator._insert_annotations(cursor, 1, 'img.jpg', annos, "Segmentation"), 1)
+        cursor.execute("SELECT rowid, image_id, type, class_name, x, y, width, height, rotation, segmentation, confidence "
+                       "FROM Preannotations")
+        row = cursor.fetchone()
+        self.assertEqual(row[2:8], ('mask', 'cat', 2.0, 1.0, 5.0, 3.0))
+
+        canvas = _format_preannotation(row, 'Segmentation')
+        self.assertEqual(canvas['type'], 'polygon')
+        xs = [p['x'] for p in canvas['points']]
+        self.assertEqual((min(xs), max(xs)), (2, 6))
+        annotation_type, segmentation = _annotation_from_preannotation(row[2], row[9])
+        self.assertEqual(annotation_type, 'polygon')
+        self.assertIsInstance(json.loads(segmentation), list)
+
+
+if __name__ == '__main__':
+    unittest.main()
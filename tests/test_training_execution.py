@@ -10,6 +10,7 @@ import tempfile
 import os
 import shutil
 import sys
+from unittest import mock
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
 
@@ -17,9 +18,11 @@ try:
     from visiofirm.utils.TrainingEngine import TrainingEngine
     from visiofirm.models.training import TrainingTask
     from visiofirm.models.project import Project
+    from tests.test_export_utils import ExportTestCase
     IMPORTS_OK = True
 except ImportError as e:
     print(f"警告: 训练模块导入失败: {e}")
+    ExportTestCase = unittest.TestCase
     IMPORTS_OK = False
 
 
@@ -161,5 +164,190 @@ class TestTrainingExecution(unittest.TestCase):
             self.engine.export_model('/nonexistent/model.pt', 'onnx')
 
 
+
+class TestYoloLabelGeneration(ExportTestCase):
+    """训练标签批量生成测试类"""
+
+    def setUp(self):
+        if not IMPORTS_OK:
+            self.skipTest("训练模块导入失败")
+        super().setUp()
+        self.engine = TrainingEngine('export_project', self.project_path)
+
+    def test_bulk_labels(self):
+        """一次生成多个标签文件，坐标按图像尺寸归一化"""
+        items = []
+        for info in self.project.get_annotated_images():
+            items.append((info, os.path.join(self.temp_dir, os.path.splitext(info['name'])[0] + '.txt')))
+        self.engine._generate_yolo_labels(items)
+
+        with open(items[0][1]) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(lines, ['0 0.175000 0.400000 0.250000 0.400000',
+                                 '1 0.550000 0.250000 0.100000 0.300000'])
+        self.assertTrue(all(os.path.exists(label_path) for _, label_path in items))
+
+    def test_label_failures_are_per_image(self):
+        """单张图像渲染失败或缺少尺寸时只跳过该图像，其余标签照常生成"""
+        import sqlite3
+        with sqlite3.connect(self.project.db_path) as conn:
+            conn.execute("UPDATE Images SET width = 0 WHERE absolute_path = ?", (self.image_paths[1],))
+        render = TrainingEngine._render_yolo_label
+
+        def flaky_render(record, class_map):
+            if record.path == self.image_paths[2]:
+                raise ValueError("无法渲染的几何")
+            return render(record, class_map)
+
+        items = [({'path': path}, os.path.join(self.temp_dir, f'{i}.txt')) for i, path in enumerate(self.image_paths)]
+        with mock.patch.object(TrainingEngine, '_render_yolo_label', side_effect=flaky_render):
+            self.engine._generate_yolo_labels(items)
+        self.assertEqual([os.path.exists(label_path) for _, label_path in items], [True, False, False])
+
+    def test_prepare_dataset_writes_labels(self):
+        """准备数据集时每张图像都有对应标签"""
+        dataset_dir = self.engine.prepare_dataset({'train': 0.7, 'val': 0.2, 'test': 0.1})
+        labels = [name for split in ('train', 'val') for name in os.listdir(os.path.join(dataset_dir, split, 'labels'))]
+        self.assertEqual(sorted(labels), ['img_0.txt', 'img_1.txt', 'img_2.txt'])
+
+
+class _FakeTrainingProcess:
+    """记录启动参数并回放预设消息的训练子进程替身"""
+
+    instances = []
+
+    def __init__(self, model_path, train_args, log_path, cpu_allocation=None, auto_batch=None):
+        self.model_path = model_path
+        self.train_args = train_args
+        self.auto_batch = auto_batch
+        self.exitcode = 0
+        _FakeTrainingProcess.instances.append(self)
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def set_cpu_budget(self, allocation):
+        pass
+
+    def events(self, poll_interval=1.0, on_idle=None):
+        save_dir = os.path.join(os.path.dirname(self.model_path), 'run')
+        last = os.path.join(save_dir, 'weights', 'last.pt')
+        os.makedirs(os.path.dirname(last), exist_ok=True)
+        open(last, 'wb').close()
+        yield {'type': 'checkpoint', 'path': last, 'epoch': 1}
+        yield {'type': 'epoch', 'epoch': 1, 'epochs': 2, 'loss': 1.0, 'metrics': {}}
+        yield {'type': 'result', 'save_dir': save_dir, 'metrics': {}}
+
+
+class TestTrainingResume(ExportTestCase):
+    """从检查点继续训练测试类"""
+
+    config = {'epochs': 2, 'image_size': 64, 'resize_images': False, 'cache': False}
+
+    def setUp(self):
+        if not IMPORTS_OK:
+            self.skipTest("训练模块导入失败")
+        super().setUp()
+        self.engine = TrainingEngine('export_project', self.project_path)
+        self.task = TrainingTask('export_project', self.project_path)
+        self.task_id = self.task.create_training_task('t', 'yolov8n', {'train': 0.7, 'val': 0.2, 'test': 0.1}, self.config)
+        self.base_model = os.path.join(self.temp_dir, 'yolov8n.pt')
+        open(self.base_model, 'wb').close()
+        _FakeTrainingProcess.instances = []
+        patches = [
+            mock.patch('visiofirm.utils.TrainingEngine.TrainingProcess', _FakeTrainingProcess),
+            mock.patch.object(self.engine, 'ensure_model_available', return_value=self.base_model),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def run_training(self, resume):
+        self.engine._run_training(self.task_id, 'yolov8n', {'train': 0.7, 'val': 0.2, 'test': 0.1}, self.config, resume)
+        return _FakeTrainingProcess.instances[-1]
+
+    def test_checkpoint_recorded(self):
+        """训练过程中上报的 last.pt 被记录到任务中"""
+        process = self.run_training(resume=False)
+        self.assertEqual(process.model_path, self.base_model)
+        self.assertEqual(process.train_args['epochs'], 2)
+        details = self.task.get_task_details(self.task_id)
+        self.assertEqual(details['status'], 'completed')
+        self.assertTrue(details['checkpoint_path'].endswith(os.path.join('weights', 'last.pt')))
+
+    def test_resume_from_checkpoint(self):
+        """继续训练时以检查点为模型并只覆盖设备相关参数"""
+        checkpoint = os.path.join(self.temp_dir, 'last.pt')
+        open(checkpoint, 'wb').close()
+        self.task.set_checkpoint(self.task_id, checkpoint)
+        process = self.run_training(resume=True)
+        self.assertEqual(process.model_path, checkpoint)
+        self.assertIs(process.train_args['resume'], True)
+        self.assertNotIn('epochs', process.train_args)
+        self.assertTrue(process.train_args['data'].endswith('dataset.yaml'))
+
+    def test_missing_checkpoint_starts_over(self):
+        """检查点文件丢失时从头训练"""
+        self.task.set_checkpoint(self.task_id, os.path.join(self.temp_dir, 'missing.pt'))
+        process = self.run_training(resume=True)
+        self.assertEqual(process.model_path, self.base_model)
+        self.assertNotIn('resume', process.train_args)
+
+    def test_auto_batch_probed_in_worker(self):
+        """batch_size 为 auto 且在 CPU 上训练时交给子进程探测，继续训练时沿用检查点中的批量"""
+        self.config = {**self.config, 'batch_size': 'auto', 'device': 'cpu'}
+        process = self.run_training(resume=False)
+        self.assertIsInstance(process.train_args['batch'], int)
+        self.assertEqual(process.auto_batch['model_name'], 'yolov8n.pt')
+        self.assertEqual(process.auto_batch['fallback_batch'], process.train_args['batch'])
+        self.assertTrue(process.auto_batch['image_paths'])
+        self.assertTrue(all(os.path.exists(path) for path in process.auto_batch['image_paths']))
+
+        checkpoint = os.path.join(self.temp_dir, 'last.pt')
+        open(checkpoint, 'wb').close()
+        self.task.set_checkpoint(self.task_id, checkpoint)
+        process = self.run_training(resume=True)
+        self.assertIsNone(process.auto_batch)
+        self.assertNotIn('batch', process.train_args)
+
+    def test_running_task_with_live_worker_not_requeued(self):
+        """恢复时仍由本进程训练线程运行的任务不重新入队，没有训练线程的才重新入队"""
+        import threading
+        from visiofirm.routes import training as training_routes
+        from visiofirm.utils.training_queue import TrainingQueue
+
+        queue = TrainingQueue(os.path.join(self.temp_dir, 'queue.db'), capacity=1)
+        launched = []
+        queue.set_launcher(lambda project_name, task_id: launched.append((project_name, task_id)) or True)
+        release = threading.Event()
+        self.addCleanup(release.set)
+        worker = threading.Thread(target=release.wait, daemon=True)
+        worker.start()
+        self.engine.current_task_id = self.task_id
+        self.engine.training_thread = worker
+        self.task.update_task_status(self.task_id, 'running', 50)
+
+        with mock.patch.object(training_routes, 'PROJECTS_FOLDER', self.temp_dir), \
+                mock.patch.object(training_routes, 'training_queue', queue), \
+                mock.patch.dict(training_routes.training_engines, {'export_project': self.engine}, clear=True):
+            training_routes._requeue_orphaned_tasks()
+            self.assertEqual(queue.get_entries(), [])
+            self.assertEqual(self.task.get_task_details(self.task_id)['status'], 'running')
+
+            release.set()
+            worker.join(timeout=5)
+            training_routes._requeue_orphaned_tasks()
+        self.assertEqual(launched, [('export_project', self.task_id)])
+
+    def test_interrupted_tasks_listed(self):
+        """按状态查询任务，用于启动时重新排队"""
+        self.task.update_task_status(self.task_id, 'running', 50)
+        self.assertEqual(self.task.get_task_ids_by_status('running', 'queued'), [self.task_id])
+        self.assertEqual(self.task.get_task_ids_by_status('completed'), [])
+
+
 if __name__ == '__main__':
     unittest.main(verbosity=2)
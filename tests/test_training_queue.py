@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+训练任务队列测试模块
+测试优先级派发、容量控制、取消以及重启恢复
+"""
+
+import unittest
+import tempfile
+import os
+import shutil
+import subprocess
+import sys
+import json
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from visiofirm.utils.training_queue import TrainingQueue
+
+
+class TestTrainingQueue(unittest.TestCase):
+    """训练队列测试类"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.temp_dir, 'queue.db')
+        self.queue = TrainingQueue(self.db_path, capacity=1)
+        self.launched = []
+        self.queue.start(self.launch)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def launch(self, project_name, task_id):
+        self.launched.append((project_name, task_id))
+        return True
+
+    def submit(self, project_name, task_id, priority=0):
+        self.queue.enqueue(project_name, task_id, priority)
+        return self.queue.dispatch()
+
+    def test_capacity_and_priority(self):
+        """满容量时排队，空出后先派发高优先级，同优先级先进先出"""
+        self.assertEqual(self.submit('a', 1), [('a', 1)])
+        self.assertEqual(self.submit('b', 2), [])
+        self.assertEqual(self.submit('c', 3), [])
+        self.assertEqual(self.submit('d', 4, priority=5), [])
+        self.assertEqual(self.queue.position('d', 4), 1)
+        self.assertEqual(self.queue.position('c', 3), 3)
+
+        self.queue.finish('a', 1, 'completed')
+        self.queue.finish('d', 4, 'completed')
+        self.queue.finish('b', 2, 'completed')
+        self.assertEqual(self.launched, [('a', 1), ('d', 4), ('b', 2), ('c', 3)])
+
+    def test_one_task_per_project(self):
+        """同一项目的任务不会并发运行"""
+        self.queue.capacity = 2
+        self.submit('a', 1)
+        self.submit('a', 2)
+        self.submit('b', 3)
+        self.assertEqual(self.launched, [('a', 1), ('b', 3)])
+        self.queue.finish('a', 1)
+        self.assertEqual(self.launched[-1], ('a', 2))
+
+    def test_duplicate_enqueue(self):
+        """重复入队只更新优先级"""
+        self.submit('a', 1)
+        first = self.queue.enqueue('b', 2)
+        self.assertEqual(self.queue.enqueue('b', 2, priority=3), first)
+        self.assertEqual([e['priority'] for e in self.queue.get_entries('b')], [3])
+
+    def test_cancel(self):
+        """排队中的任务可取消，运行中的任务不能"""
+        self.submit('a', 1)
+        self.submit('b', 2)
+        self.assertTrue(self.queue.cancel('b', 2))
+        self.assertFalse(self.queue.cancel('a', 1))
+        self.queue.finish('a', 1)
+        self.assertEqual(self.launched, [('a', 1)])
+
+    def test_failed_launch_frees_capacity(self):
+        """启动失败的任务被标记失败，继续派发后续任务"""
+        self.queue.start(lambda project_name, task_id: task_id != 1 and self.launch(project_name, task_id))
+        self.submit('b', 2)
+        self.queue.finish('b', 2)
+        self.queue.enqueue('a', 1)
+        self.queue.enqueue('c', 3)
+        self.assertEqual(self.queue.dispatch(), [('c', 3)])
+        self.assertEqual([e['task_id'] for e in self.queue.get_entries()], [3])
+
+    def test_restart_recovery(self):
+        """重启后运行中的任务回到队列并重新派发，排队任务保持顺序"""
+        self.submit('a', 1)
+        self.submit('b', 2)
+
+        restarted = TrainingQueue(self.db_path, capacity=1)
+        launched = []
+        recovered = restarted.start(lambda project_name, task_id: launched.append((project_name, task_id)) or True)
+        self.assertEqual(recovered, [('a', 1)])
+        self.assertEqual(launched, [('a', 1)])
+        restarted.finish('a', 1)
+        self.assertEqual(launched, [('a', 1), ('b', 2)])
+
+
+# 在独立的解释器中运行（使用临时 HOME），模拟 spawn 子进程重新导入路由模块
+_STARTUP_SCRIPT = """
+import json
+from unittest import mock
+from visiofirm.config import TRAINING_QUEUE_DB
+from visiofirm.utils.training_queue import TrainingQueue
+
+queue = TrainingQueue(TRAINING_QUEUE_DB, capacity=1)
+queue.set_launcher(lambda project_name, task_id: True)
+queue.enqueue('demo', 1)
+queue.dispatch()
+
+import visiofirm.routes.training as training_routes
+
+def status():
+    return [(e['task_id'], e['status']) for e in queue.get_entries()]
+
+result = {'after_import': status()}
+with mock.patch('multiprocessing.parent_process', return_value=object()):
+    result['child_started'] = training_routes.start_training_queue()
+result['after_child'] = status()
+result['started'] = training_routes.start_training_queue()
+result['started_again'] = training_routes.start_training_queue()
+print(json.dumps(result))
+"""
+
+
+class TestStartupRecovery(unittest.TestCase):
+    """训练队列启动恢复测试类"""
+
+    def test_recovery_only_on_explicit_startup(self):
+        """导入路由模块和子进程中都不恢复、不派发；显式启动时只恢复一次"""
+        home = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, home, ignore_errors=True)
+        root = os.path.join(os.path.dirname(__file__), '..')
+        env = {**os.environ, 'HOME': home, 'PYTHONPATH': os.path.abspath(root)}
+        output = subprocess.run([sys.executable, '-c', _STARTUP_SCRIPT], env=env, cwd=home,
+                                capture_output=True, text=True, timeout=300)
+        self.assertEqual(output.returncode, 0, output.stderr)
+        result = json.loads(output.stdout.strip().splitlines()[-1])
+        # 导入后运行中的记录保持不变
+        self.assertEqual(result['after_import'], [[1, 'running']])
+        self.assertFalse(result['child_started'])
+        self.assertEqual(result['after_child'], [[1, 'running']])
+        self.assertTrue(result['started'])
+        self.assertFalse(result['started_again'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+训练子进程测试模块
+测试子进程日志、错误上报、终止以及指标提取
+"""
+
+import unittest
+import tempfile
+import os
+import shutil
+import signal
+import sys
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from visiofirm.utils.training_worker import TrainingProcess, _epoch_loss, _extract_metrics
+
+
+class TestTrainingProcess(unittest.TestCase):
+    """训练子进程测试类"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.log_path = os.path.join(self.temp_dir, 'runs', 'task_1.log')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_error_reported_and_logged(self):
+        """子进程中的异常以消息返回，堆栈写入任务日志"""
+        process = TrainingProcess(os.path.join(self.temp_dir, 'missing.yaml'), {'data': 'missing.yaml', 'epochs': 1},
+                                  self.log_path, {'threads': 1, 'interop_threads': 1, 'workers': 0})
+        process.start()
+        events = list(process.events(poll_interval=0.5))
+        self.assertEqual([e['type'] for e in events], ['error'])
+        self.assertEqual(process.exitcode, 0)
+        with open(self.log_path, encoding='utf-8') as f:
+            self.assertIn('Traceback', f.read())
+
+    def test_stop_terminates(self):
+        """stop 直接终止子进程"""
+        process = TrainingProcess('unused.pt', {}, self.log_path)
+        process.start()
+        process.stop(timeout=10)
+        self.assertFalse(process.is_alive())
+        self.assertEqual(process.exitcode, -signal.SIGTERM)
+
+
+class TestTrainingHelpers(unittest.TestCase):
+    """训练辅助函数测试类"""
+
+    def test_epoch_loss(self):
+        self.assertEqual(_epoch_loss(SimpleNamespace(loss=1.5)), 1.5)
+        self.assertEqual(_epoch_loss(SimpleNamespace(loss=None, losses=[2.0, 0.5])), 0.5)
+        self.assertIsNone(_epoch_loss(SimpleNamespace()))
+
+    def test_extract_metrics(self):
+        box = SimpleNamespace(mp=0.8, mr=0.7)
+        metrics = _extract_metrics(SimpleNamespace(results_dict={'metrics/mAP50(B)': 0.5}, box=box))
+        self.assertEqual(metrics, {'metrics/mAP50(B)': 0.5, 'precision': 0.8, 'recall': 0.7})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+WebDataset 分片导出测试模块
+测试分片切分、样本条目和索引文件
+"""
+
+import unittest
+import os
+import sys
+import json
+import tarfile
+import zipfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from visiofirm.utils.webdataset_export import generate_webdataset_export, INDEX_FILE
+from tests.test_export_utils import ExportTestCase
+
+
+class TestWebDatasetExport(ExportTestCase):
+    """WebDataset 导出测试类"""
+
+    def test_samples_and_index(self):
+        """每个样本包含图像、标签和元数据，索引记录样本数"""
+        out_dir = os.path.join(self.temp_dir, 'wds')
+        generate_webdataset_export(self.project, self.splits, self.setup_type, 'export_project', '',
+                                   output=out_dir, archive_format='dir')
+        with open(os.path.join(out_dir, INDEX_FILE)) as f:
+            index = json.load(f)
+        self.assertEqual(index['names'], ['cat', 'dog'])
+        self.assertEqual(index['splits']['train']['samples'], 2)
+        shard = index['splits']['train']['shards'][0]
+        self.assertEqual(shard['path'], 'train/shard-000000.tar')
+
+        shard_path = os.path.join(out_dir, shard['path'])
+        self.assertEqual(shard['size'], os.path.getsize(shard_path))
+        with tarfile.open(shard_path) as tf:
+            names = tf.getnames()
+            self.assertEqual(names[:3], ['00000000.jpg', '00000000.txt', '00000000.json'])
+            label = tf.extractfile('00000000.txt').read().decode()
+            metadata = json.loads(tf.extractfile('00000000.json').read())
+        self.assertEqual(len(label.splitlines()), 2)
+        self.assertEqual(metadata['file_name'], 'img_0.jpg')
+        with open(self.image_paths[0], 'rb') as f:
+            with tarfile.open(shard_path) as tf:
+                self.assertEqual(tf.extractfile('00000000.jpg').read(), f.read())
+
+    def test_shard_rollover(self):
+        """超过分片大小时切换到新分片，每个分片至少一个样本"""
+        buffer = generate_webdataset_export(self.project, {'train': self.image_paths}, self.setup_type,
+                                            'export_project', '', shard_size_mb=0.001)
+        with zipfile.ZipFile(buffer) as zf:
+            index = json.loads(zf.read(INDEX_FILE))
+            shards = index['splits']['train']['shards']
+            self.assertEqual(len(shards), 3)
+            self.assertEqual([s['samples'] for s in shards], [1, 1, 1])
+            self.assertEqual(zf.getinfo(shards[1]['path']).compress_type, zipfile.ZIP_STORED)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+权重存储测试模块
+使用本地HTTP服务测试下载、断点续传、校验以及离线模式
+"""
+
+import unittest
+import tempfile
+import os
+import shutil
+import sys
+import json
+import hashlib
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from visiofirm.utils.weight_store import WeightStore
+
+PAYLOAD = os.urandom(256 * 1024 + 123)
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """支持 Range 请求的最小HTTP服务"""
+    requests_seen = []
+
+    def do_GET(self):
+        range_header = self.headers.get('Range')
+        RangeHandler.requests_seen.append(range_header)
+        if range_header:
+            start = int(range_header.split('=')[1].split('-')[0])
+            if start >= len(PAYLOAD):
+                self.send_response(416)
+                self.end_headers()
+                return
+            body = PAYLOAD[start:]
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{len(PAYLOAD) - 1}/{len(PAYLOAD)}')
+        else:
+            body = PAYLOAD
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestWeightStore(unittest.TestCase):
+    """权重存储测试类"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = HTTPServer(('127.0.0.1', 0), RangeHandler)
+        cls.url = f"http://127.0.0.1:{cls.server.server_port}/model.pt"
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.store = WeightStore(root=self.temp_dir, offline=False, chunk_size=4096)
+        self.sha256 = hashlib.sha256(PAYLOAD).hexdigest()
+        RangeHandler.requests_seen = []
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_download_records_manifest(self):
+        """下载完成后文件完整且清单记录校验和"""
+        path = self.store.fetch(self.url, 'model.pt', sha256=self.sha256)
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), PAYLOAD)
+        with open(os.path.join(self.temp_dir, 'manifest.json')) as f:
+            manifest = json.load(f)
+        self.assertEqual(manifest['model.pt']['sha256'], self.sha256)
+        self.assertFalse(os.path.exists(path + '.part'))
+
+        # 再次获取不会重新下载
+        self.store.fetch(self.url, 'model.pt')
+        self.assertEqual(len(RangeHandler.requests_seen), 1)
+
+    def test_resume_partial_download(self):
+        """已有 .part 文件时使用 Range 续传"""
+        part_path = os.path.join(self.temp_dir, 'model.pt.part')
+        with open(part_path, 'wb') as f:
+            f.write(PAYLOAD[:100000])
+        path = self.store.fetch(self.url, 'model.pt', sha256=self.sha256)
+        self.assertEqual(RangeHandler.requests_seen, ['bytes=100000-'])
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), PAYLOAD)
+
+    def test_checksum_mismatch(self):
+        """校验和不一致时报错且不留下权重文件"""
+        with self.assertRaises(ValueError):
+            self.store.fetch(self.url, 'model.pt', sha256='0' * 64)
+        self.assertFalse(os.path.exists(os.path.join(self.temp_dir, 'model.pt')))
+        self.assertFalse(os.path.exists(os.path.join(self.temp_dir, 'model.pt.part')))
+
+    def test_concurrent_fetch_downloads_once(self):
+        """多个线程同时获取同一文件只下载一次"""
+        errors = []
+
+        def worker():
+            try:
+                WeightStore(root=self.temp_dir, offline=False).fetch(self.url, 'model.pt')
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(timeout=30)
+        self.assertEqual(errors, [])
+        self.assertEqual(len(RangeHandler.requests_seen), 1)
+
+    def test_pinned_digest_from_pins_file(self):
+        """pins.json 中固定的摘要在调用方未传入 sha256 时也会校验"""
+        with open(os.path.join(self.temp_dir, 'pins.json'), 'w') as f:
+            json.dump({'model.pt': '0' * 64}, f)
+        with self.assertRaises(ValueError):
+            self.store.fetch(self.url, 'model.pt')
+        self.assertFalse(os.path.exists(os.path.join(self.temp_dir, 'model.pt')))
+
+        with open(os.path.join(self.temp_dir, 'pins.json'), 'w') as f:
+            json.dump({'model.pt': self.sha256}, f)
+        self.store.fetch(self.url, 'model.pt')
+        self.assertEqual(self.store.load_manifest()['model.pt']['trust'], 'pinned')
+
+    def test_unpinned_download_is_first_use(self):
+        """未固定摘要的文件在清单中标记为首次下载信任"""
+        self.store.fetch(self.url, 'model.pt')
+        self.assertEqual(self.store.load_manifest()['model.pt']['trust'], 'first_use')
+
+    def test_same_size_modification_detected(self):
+        """文件被改动但大小不变时重新计算哈希并重新下载"""
+        path = self.store.fetch(self.url, 'model.pt', sha256=self.sha256)
+        with open(path, 'r+b') as f:
+            f.write(b'\x00' * 16)
+        os.utime(path, ns=(0, 12345))
+        self.store.fetch(self.url, 'model.pt', sha256=self.sha256)
+        self.assertEqual(len(RangeHandler.requests_seen), 2)
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), PAYLOAD)
+
+        # 未传入期望值时以首次记录的摘要为准
+        with open(path, 'r+b') as f:
+            f.write(b'\x00' * 16)
+        os.utime(path, ns=(0, 67890))
+        self.store.fetch(self.url, 'model.pt')
+        self.assertEqual(len(RangeHandler.requests_seen), 3)
+
+    def test_offline_mode(self):
+        """离线模式只使用预先放置的文件"""
+        offline_store = WeightStore(root=self.temp_dir, offline=True)
+        with self.assertRaises(FileNotFoundError):
+            offline_store.fetch(self.url, 'model.pt')
+
+        with open(os.path.join(self.temp_dir, 'model.pt'), 'wb') as f:
+            f.write(PAYLOAD)
+        path = offline_store.fetch(self.url, 'model.pt', sha256=self.sha256)
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(RangeHandler.requests_seen, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -20,10 +20,62 @@ def get_db_path():
 PROJECTS_FOLDER = get_cache_folder()
 VALID_IMAGE_EXTENSIONS = {'.webp', '.jpg', '.jpeg', '.JPG', '.JPEG', '.png', '.avif'}
 WEIGHTS_FOLDER = os.path.join(get_cache_folder(), 'weights')
+# 已知权重文件的 SHA-256（文件名 -> 十六进制摘要），下载和使用前都按此校验；
+# 也可写在 WEIGHTS_FOLDER/pins.json 中。未固定的文件按首次下载信任（trust-on-first-use）：
+# 只能发现之后的损坏或替换，发现不了首次下载本身的截断或篡改
+WEIGHT_SHA256_PINS = {}
 
 # 数据集管理配置
 DATASETS_FOLDER = os.path.join(PROJECTS_FOLDER, 'datasets')
 DATASET_DOWNLOAD_TEMP = os.path.join(DATASETS_FOLDER, 'temp')
 MAX_DATASET_SIZE = 50 * 1024 * 1024 * 1024  # 50GB
 DOWNLOAD_TIMEOUT = 3600  # 1小时超时
-CONCURRENT_DOWNLOADS = 2  # 最大并发下载数
\ No newline at end of file
+CONCURRENT_DOWNLOADS = 2  # 最大并发下载数
+
+# 预标注配置
+PREANNOTATION_POOL_SIZE = 2  # 常驻内存的检测模型数量
+ONDEMAND_LATENCY_TARGET_MS = 1500  # 单图按需预标注的目标延迟
+
+# 推理服务配置（独立进程 + 微批处理）
+INFERENCE_SERVER_ENABLED = os.environ.get('VISIOFIRM_INFERENCE_SERVER', '0') == '1'
+INFERENCE_MAX_BATCH_SIZE = 8  # 单个微批次的最大图像数
+INFERENCE_MAX_WAIT_MS = 20  # 凑批次的最长等待时间
+
+# 导出任务配置（后台生成，产物保存在 EXPORTS_FOLDER）
+EXPORTS_FOLDER = os.path.join(PROJECTS_FOLDER, 'exports')
+EXPORT_JOB_WORKERS = 2  # 同时运行的导出任务数
+EXPORT_RETENTION_HOURS = 24  # 导出产物保留时间
+WEBDATASET_SHARD_SIZE_MB = 512  # WebDataset 导出的单个 tar 分片大小
+PREANNOTATION_MASK_FORMAT = 'polygon'  # 预标注掩码存储格式：'polygon'（简化轮廓）或 'rle'（无损 COCO RLE）
+
+# 训练任务队列（达到并发上限时排队而不是拒绝）
+TRAINING_QUEUE_DB = os.path.join(PROJECTS_FOLDER, 'training_queue.db')
+TRAINING_PROCESS_NICE = 5  # 训练子进程的 nice 增量，降低对 Web 进程的影响
+TRAINING_MEMORY_LIMIT_GB = 0  # 训练子进程地址空间上限（0 为不限制，GPU 训练时不要设置）
+
+# 训练指标流（SSE 推送 + 批量写库）
+METRICS_BUFFER_SIZE = 2000  # 每个训练任务在内存中保留的最近指标事件数
+METRICS_FLUSH_ROWS = 10  # 累积多少条每轮指标后写入数据库
+METRICS_FLUSH_SECONDS = 30  # 距上次写入超过该秒数时写入数据库
+METRICS_BATCH_INTERVAL = 2.0  # 训练进程上报批次指标的最小间隔（秒）
+METRICS_KEEPALIVE_SECONDS = 15  # SSE 无新事件时发送心跳的间隔
+METRICS_STREAM_SECONDS = 300  # 单个 SSE 连接的最长保持时间，到期后浏览器自动重连续传
+
+# 后台资源采样
+RESOURCE_SAMPLE_INTERVAL = 2.0  # 采样间隔（秒）
+RESOURCE_HISTORY_SIZE = 900  # 环形缓冲区保留的采样数（默认约30分钟）
+RESOURCE_TREND_SECONDS = 120  # 优化建议参考的趋势窗口（秒）
+RESOURCE_PROJECTION_MINUTES = 10  # 按趋势预测资源耗尽的时间范围（分钟）
+
+# 训练数据集缓存（cache='auto' 时由 PerformanceManager 选择 ram / disk / 不缓存）
+DATASET_CACHE_SAFETY_MARGIN = 0.5  # 缓存估算的额外余量（mosaic 等增强的缓冲区）
+DATASET_CACHE_RAM_HEADROOM_GB = 2.0  # 内存缓存后至少保留的可用内存
+DATASET_CACHE_DISK_HEADROOM_GB = 5.0  # 磁盘缓存后至少保留的磁盘空间
+TRAINING_RESIZE_IMAGES = False  # 训练数据集默认使用原图；任务配置 resize_images=True 时改用按 imgsz 缩小的副本（缓存在项目 cache/resized_images 中）
+
+# 批量大小与数据加载进程数探测（batch_size='auto' 且在 CPU 上训练时使用）
+BATCH_FINDER_CACHE = os.path.join(PROJECTS_FOLDER, 'batch_finder.json')  # 探测结果缓存，按 (模型, imgsz, 机器) 区分
+BATCH_FINDER_BATCH_SIZES = (2, 4, 8, 16, 32, 64)  # 依次尝试的批量大小
+BATCH_FINDER_STEPS = 3  # 每个批量计时的前向/反向步数（另有一步预热）
+BATCH_FINDER_MEMORY_FRACTION = 0.8  # 扣除数据集缓存预占后，可用内存中分给模型训练的比例
+BATCH_FINDER_LOADER_HEADROOM = 2.0  # 数据加载吞吐量至少为训练吞吐量的倍数（为 mosaic 等增强留余量）
@@ -41,7 +41,8 @@ class Project:
                     image_id INTEGER PRIMARY KEY AUTOINCREMENT,
                     absolute_path TEXT UNIQUE,
                     width INTEGER,
-                    height INTEGER
+                    height INTEGER,
+                    annotation_version INTEGER DEFAULT 0
                 )
             ''')
             cursor.execute('''
@@ -61,6 +62,8 @@ class Project:
                     FOREIGN KEY (class_name) REFERENCES Classes(class_name)
                 )
             ''')
+            # Preannotations.type says what segmentation holds: 'polygon' rows store a flat point list,
+            # 'mask' rows store lossless COCO RLE (converted to a polygon on acceptance), 'rect' rows store none
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS Preannotations (
                     preannotation_id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -93,6 +96,13 @@ class Project:
                 cursor.execute('''
                     ALTER TABLE ReviewedImages ADD COLUMN user_id INTEGER
                 ''')
+            # annotation_version is bumped whenever an image's annotations change (used by the export cache)
+            cursor.execute("PRAGMA table_info(Images)")
+            columns = [col[1] for col in cursor.fetchall()]
+            if 'annotation_version' not in columns:
+                cursor.execute('''
+                    ALTER TABLE Images ADD COLUMN annotation_version INTEGER DEFAULT 0
+                ''')
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_images_absolute_path ON Images(absolute_path)')
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_annotations_image_id ON Annotations(image_id)')
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_preannotations_image_id ON Preannotations(image_id)')
@@ -209,6 +219,7 @@ class Project:
 
             # Delete existing annotations for this image
             cursor.execute('DELETE FROM Annotations WHERE image_id = ?', (image_id,))
+            cursor.execute('UPDATE Images SET annotation_version = annotation_version + 1 WHERE image_id = ?', (image_id,))
             logger.info(f"Deleted existing annotations for {image_path} in project {self.name}")
 
             # Deduplicate annotations
@@ -561,7 +572,8 @@ class Project:
             cursor = conn.cursor()
             cursor.execute('''
                 SELECT DISTINCT i.image_id, i.absolute_path, i.width, i.height,
-                       LENGTH(TRIM(COALESCE(i.absolute_path, ''))) > 0 as has_path
+                       LENGTH(TRIM(COALESCE(i.absolute_path, ''))) > 0 as has_path,
+                       COALESCE(i.annotation_version, 0)
                 FROM Images i
                 INNER JOIN Annotations a ON i.image_id = a.image_id
                 ORDER BY i.image_id
@@ -574,7 +586,8 @@ class Project:
                         'path': row[1],
                         'name': os.path.basename(row[1]) if row[1] else f'image_{row[0]}',
                         'width': row[2],
-                        'height': row[3]
+                        'height': row[3],
+                        'annotation_version': row[5]
                     })
             logger.info(f"Retrieved {len(annotated_images)} annotated images for project {self.name}")
             return annotated_images
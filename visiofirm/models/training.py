@@ -85,6 +85,16 @@ class TrainingTask:
                     )
                 ''')
                 
+                # 迁移：每轮完整指标（各项损失、mAP、学习率等）以JSON保存
+                cursor.execute("PRAGMA table_info(training_logs)")
+                if 'metrics' not in [col[1] for col in cursor.fetchall()]:
+                    cursor.execute("ALTER TABLE training_logs ADD COLUMN metrics TEXT")
+
+                # 迁移：记录训练检查点（last.pt），中断后可从检查点继续训练
+                cursor.execute("PRAGMA table_info(training_tasks)")
+                if 'checkpoint_path' not in [col[1] for col in cursor.fetchall()]:
+                    cursor.execute("ALTER TABLE training_tasks ADD COLUMN checkpoint_path TEXT")
+                
                 conn.commit()
                 # 初始化成功，不输出日志避免重复信息
                 
@@ -219,6 +229,30 @@ class TrainingTask:
             logger.error(f"Failed to update task status: {e}")
             raise
 
+    def set_checkpoint(self, task_id, checkpoint_path):
+        """记录任务最新的检查点路径，传入 None 时清除（下次启动从头训练）"""
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                conn.execute('UPDATE training_tasks SET checkpoint_path = ? WHERE id = ?', (checkpoint_path, task_id))
+                conn.commit()
+        except Exception as e:
+            logger.error(f"Failed to update checkpoint path: {e}")
+            raise
+
+    def get_task_ids_by_status(self, *statuses):
+        """返回处于给定状态的任务ID"""
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    f"SELECT id FROM training_tasks WHERE status IN ({', '.join('?' * len(statuses))}) ORDER BY id",
+                    statuses
+                )
+                return [row[0] for row in cursor.fetchall()]
+        except Exception as e:
+            logger.error(f"Failed to get training tasks by status: {e}")
+            return []
+
     def get_task_details(self, task_id):
         """获取训练任务详细信息"""
         try:
@@ -243,7 +277,8 @@ class TrainingTask:
                         'completed_at': row[9],
                         'error_message': row[10],
                         'model_path': row[11],
-                        'metrics': json.loads(row[12]) if row[12] else {}
+                        'metrics': json.loads(row[12]) if row[12] else {},
+                        'checkpoint_path': row[13] if len(row) > 13 else None
                     }
                 return None
                 
@@ -323,13 +358,42 @@ class TrainingTask:
         except Exception as e:
             logger.error(f"Failed to log training progress: {e}")
 
+    def log_training_progress_batch(self, task_id, epochs):
+        """
+        批量记录每轮训练指标（一次连接、一次提交）
+
+        Args:
+            epochs: [{'epoch', 'loss', 'metrics': {...}, ...}, ...]，来自训练进程的每轮事件
+        """
+        rows = []
+        for data in epochs:
+            metrics = data.get('metrics') or {}
+            val_losses = [v for k, v in metrics.items() if k.startswith('val/') and v is not None]
+            rows.append((
+                task_id, data['epoch'], data.get('loss'),
+                metrics.get('metrics/mAP50(B)', metrics.get('metrics/mAP50(M)')),
+                sum(val_losses) if val_losses else None,
+                metrics.get('metrics/mAP50-95(B)', metrics.get('metrics/mAP50-95(M)')),
+                json.dumps(data)
+            ))
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                conn.executemany('''
+                    INSERT INTO training_logs 
+                    (task_id, epoch, loss, accuracy, val_loss, val_accuracy, metrics)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', rows)
+                conn.commit()
+        except Exception as e:
+            logger.error(f"Failed to log training progress: {e}")
+
     def get_training_logs(self, task_id):
         """获取训练日志"""
         try:
             with sqlite3.connect(self.db_path) as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
-                    SELECT epoch, loss, accuracy, val_loss, val_accuracy, timestamp
+                    SELECT epoch, loss, accuracy, val_loss, val_accuracy, timestamp, metrics
                     FROM training_logs 
                     WHERE task_id = ? 
                     ORDER BY epoch
@@ -343,7 +407,8 @@ class TrainingTask:
                         'accuracy': row[2],
                         'val_loss': row[3],
                         'val_accuracy': row[4],
-                        'timestamp': row[5]
+                        'timestamp': row[5],
+                        'metrics': json.loads(row[6]) if row[6] else {}
                     })
                 
                 return logs
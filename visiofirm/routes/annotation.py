@@ -1,18 +1,24 @@
-from flask import Blueprint, render_template, request, jsonify, send_file, current_app
+from flask import Blueprint, render_template, request, jsonify, send_file, current_app, Response
 from flask_login import login_required, current_user
 import os
 import sqlite3
-from visiofirm.config import PROJECTS_FOLDER
+from visiofirm.config import PROJECTS_FOLDER, ONDEMAND_LATENCY_TARGET_MS, WEBDATASET_SHARD_SIZE_MB
 from visiofirm.models.project import Project
 from visiofirm.models.user import get_user_by_id
-from io import BytesIO
-import zipfile
-from visiofirm.utils.export_utils import split_images, generate_coco_export, generate_yolo_export, generate_pascal_voc_export, generate_csv_export
+from visiofirm.utils.archive_writer import open_archive, ARCHIVE_FORMATS, ARCHIVE_EXTENSIONS, ARCHIVE_MIMETYPES, DIRECTORY_FORMATS
+from visiofirm.utils.export_cache import ExportCache
+from visiofirm.utils.export_jobs import export_jobs
+from visiofirm.utils.webdataset_export import generate_webdataset_export
+from visiofirm.utils.mask_utils import segmentation_polygon, parse_segmentation
+from visiofirm.utils.parquet_io import PARQUET_AVAILABLE, generate_parquet_export, import_parquet_annotations
+from visiofirm.utils.export_utils import split_images, generate_coco_export, generate_yolo_export, generate_pascal_voc_export, generate_csv_export, iter_zip_stream
 import logging
 from werkzeug.utils import secure_filename
 from visiofirm.utils.VFPreAnnotator import PreAnnotator
+from visiofirm.utils.inference_server import get_inference_client
 import json
 import threading
+import time
 
 bp = Blueprint('annotation', __name__, url_prefix='/annotation')
 # 优化日志级别，减少输出
@@ -63,7 +69,8 @@ def ai_preannotator_config():
                         model_type=model_type,
                         config_db_path=config_db_path,
                         device=device,
-                        box_threshold=box_threshold
+                        box_threshold=box_threshold,
+                        inference_client=get_inference_client()
                     )
                 elif mode == 'custom-model':
                     proc = PreAnnotator(
@@ -71,7 +78,8 @@ def ai_preannotator_config():
                         yolo_model_path=model_path,
                         config_db_path=config_db_path,
                         device=device,
-                        box_threshold=box_threshold
+                        box_threshold=box_threshold,
+                        inference_client=get_inference_client()
                     )
                 else:
                     raise ValueError("Invalid mode")
@@ -107,6 +115,135 @@ def ai_preannotator_config():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+def _preannotation_polygon(annotation_type, text):
+    """Flat polygon of a Preannotations row: 'mask' rows hold RLE, 'polygon' rows hold points."""
+    if annotation_type == 'mask':
+        return segmentation_polygon(text)
+    segmentation = parse_segmentation(text)
+    return segmentation if isinstance(segmentation, list) else []
+
+def _annotation_from_preannotation(annotation_type, text):
+    """Annotations always store polygons; RLE preannotation masks are converted on acceptance."""
+    if annotation_type == 'mask':
+        return 'polygon', json.dumps(_preannotation_polygon(annotation_type, text))
+    return annotation_type, text
+
+def _format_preannotation(row, setup_type):
+    """Convert a Preannotations row into the dict consumed by the annotation canvas."""
+    preanno = {
+        'preannotation_id': row[0],
+        'image_id': row[1],
+        # the canvas edits masks as their outer contour
+        'type': 'obbox' if setup_type == "Oriented Bounding Box" else ('polygon' if row[2] == 'mask' else row[2]),
+        'label': row[3],
+        'confidence': float(row[10]) if row[10] is not None else 0.0
+    }
+    if row[4] is not None and row[5] is not None and row[6] is not None and row[7] is not None:
+        preanno['x'] = float(row[4])
+        preanno['y'] = float(row[5])
+        preanno['width'] = float(row[6])
+        preanno['height'] = float(row[7])
+        preanno['bbox'] = [float(row[4]), float(row[5]), float(row[6]), float(row[7])]
+    if row[8] is not None:
+        preanno['rotation'] = float(row[8])
+    else:
+        preanno['rotation'] = 0.0
+    if row[9]:
+        segmentation = _preannotation_polygon(row[2], row[9])
+        if segmentation:
+            preanno['segmentation'] = [segmentation]
+            preanno['points'] = [{'x': float(segmentation[i]), 'y': float(segmentation[i+1])} for i in range(0, len(segmentation), 2)]
+            preanno['closed'] = True
+        else:
+            logger.error(f"Error parsing segmentation for preannotation_id {row[0]}")
+            preanno['segmentation'] = []
+            preanno['points'] = []
+    return preanno
+
+@bp.route('/preannotate_image', methods=['POST'])
+@login_required
+def preannotate_image():
+    """
+    Run pre-annotation synchronously for a single image (the one currently being viewed).
+    Uses warm models from the shared model pool and takes priority over background batches.
+    """
+    try:
+        data = request.get_json(silent=True) or request.form
+        project_name = data.get('project_name')
+        image_path = data.get('image_path')
+        mode = data.get('mode', 'zero-shot')
+        device = data.get('processing_unit', 'cpu')
+        box_threshold = float(data.get('box_threshold', 0.2))
+        force = str(data.get('force', 'false')).lower() in ('true', '1', 'yes')
+
+        if not project_name or not image_path:
+            return jsonify({'success': False, 'error': 'Project name and image path required'}), 400
+
+        project_path = os.path.join(PROJECTS_FOLDER, project_name)
+        config_db_path = os.path.join(project_path, 'config.db')
+        if not os.path.exists(config_db_path):
+            return jsonify({'success': False, 'error': 'Project not found'}), 404
+
+        absolute_image_path = os.path.abspath(os.path.join(project_path, 'images', os.path.normpath(image_path)))
+        with sqlite3.connect(config_db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT image_id, absolute_path FROM Images WHERE absolute_path = ?', (absolute_image_path,))
+            image_row = cursor.fetchone()
+            if not image_row:
+                cursor.execute('SELECT image_id, absolute_path FROM Images WHERE absolute_path LIKE ?', (f'%{os.path.basename(image_path)}',))
+                image_row = cursor.fetchone()
+        if not image_row:
+            return jsonify({'success': False, 'error': 'Image not found'}), 404
+        image_id, absolute_image_path = image_row
+
+        if mode == 'zero-shot':
+            model_kwargs = {'model_type': f"grounding_dino_{data.get('dino_model', 'tiny')}"}
+        elif mode == 'custom-model':
+            model_kwargs = {'model_type': 'yolo', 'yolo_model_path': data.get('model_path', 'yolov10x.pt')}
+        else:
+            return jsonify({'success': False, 'error': 'Invalid mode'}), 400
+
+        start = time.perf_counter()
+        proc = PreAnnotator(
+            config_db_path=config_db_path,
+            device=device,
+            box_threshold=box_threshold,
+            image_ids=[image_id],
+            inference_client=get_inference_client(),
+            **model_kwargs
+        )
+        inserted = proc.annotate_image(
+            image_id,
+            absolute_image_path,
+            skip_existing=not force,
+            replace_existing=force,
+            priority=True
+        )
+        setup_type = proc.setup_type
+        del proc
+        latency_ms = (time.perf_counter() - start) * 1000
+        if latency_ms > ONDEMAND_LATENCY_TARGET_MS:
+            logger.warning(f"On-demand pre-annotation for {absolute_image_path} took {latency_ms:.0f} ms (target {ONDEMAND_LATENCY_TARGET_MS} ms)")
+
+        with sqlite3.connect(config_db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT preannotation_id, image_id, type, class_name, x, y, width, height, rotation, segmentation, confidence
+                FROM Preannotations WHERE image_id = ?
+            ''', (image_id,))
+            preannotations = [_format_preannotation(row, setup_type) for row in cursor.fetchall()]
+
+        return jsonify({
+            'success': True,
+            'skipped': inserted is None,
+            'preannotations': preannotations,
+            'latency_ms': round(latency_ms, 1),
+            'within_target': latency_ms <= ONDEMAND_LATENCY_TARGET_MS
+        })
+    except Exception as e:
+        logger.error(f"On-demand pre-annotation failed: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @bp.route('/check_preannotation_status', methods=['GET'])
 @login_required
 def check_preannotation_status():
@@ -174,12 +311,14 @@ def blind_trust():
                         preannotations = cursor.fetchall()
 
                         cursor.execute('DELETE FROM Annotations WHERE image_id = ?', (image_id,))
+                        cursor.execute('UPDATE Images SET annotation_version = annotation_version + 1 WHERE image_id = ?', (image_id,))
 
                         for preanno in preannotations:
+                            annotation_type, segmentation = _annotation_from_preannotation(preanno[1], preanno[8])
                             cursor.execute('''
                                 INSERT INTO Annotations (image_id, user_id, type, class_name, x, y, width, height, rotation, segmentation)
                                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                            ''', (image_id, user_id, preanno[1], preanno[2], preanno[3], preanno[4], preanno[5], preanno[6], preanno[7], preanno[8]))
+                            ''', (image_id, user_id, annotation_type, preanno[2], preanno[3], preanno[4], preanno[5], preanno[6], preanno[7], segmentation))
                         
                         cursor.execute('DELETE FROM Preannotations WHERE image_id = ?', (image_id,))
 
@@ -356,37 +495,8 @@ def get_annotations(project_name, image_path):
                 SELECT preannotation_id, image_id, type, class_name, x, y, width, height, rotation, segmentation, confidence
                 FROM Preannotations WHERE image_id = ?
             ''', (image_id,))
-            preannotations = []
-            for row in cursor.fetchall():
-                preanno = {
-                    'preannotation_id': row[0],
-                    'image_id': row[1],
-                    'type': 'obbox' if project.get_setup_type() == "Oriented Bounding Box" else row[2],
-                    'label': row[3],
-                    'confidence': float(row[10]) if row[10] is not None else 0.0
-                }
-                if row[4] is not None and row[5] is not None and row[6] is not None and row[7] is not None:
-                    preanno['x'] = float(row[4])
-                    preanno['y'] = float(row[5])
-                    preanno['width'] = float(row[6])
-                    preanno['height'] = float(row[7])
-                    preanno['bbox'] = [float(row[4]), float(row[5]), float(row[6]), float(row[7])]
-                if row[8] is not None:
-                    preanno['rotation'] = float(row[8])
-                else:
-                    preanno['rotation'] = 0.0
-                if row[9]:
-                    try:
-                        segmentation = json.loads(row[9])
-                        if isinstance(segmentation, list):
-                            preanno['segmentation'] = [segmentation]
-                            preanno['points'] = [{'x': float(segmentation[i]), 'y': float(segmentation[i+1])} for i in range(0, len(segmentation), 2)]
-                            preanno['closed'] = True
-                    except (json.JSONDecodeError, TypeError) as e:
-                        logger.error(f"Error parsing segmentation for preannotation_id {row[0]}: {e}")
-                        preanno['segmentation'] = []
-                        preanno['points'] = []
-                preannotations.append(preanno)
+            setup_type = project.get_setup_type()
+            preannotations = [_format_preannotation(row, setup_type) for row in cursor.fetchall()]
             
             # Check if the image is reviewed
             cursor.execute('SELECT 1 FROM ReviewedImages WHERE image_id = ?', (image_id,))
@@ -465,6 +575,7 @@ def save_annotations():
             # Proceed with saving (rest of the function unchanged)
             cursor.execute('DELETE FROM Annotations WHERE image_id = ?', (image_id,))
             cursor.execute('DELETE FROM Preannotations WHERE image_id = ?', (image_id,))
+            cursor.execute('UPDATE Images SET annotation_version = annotation_version + 1 WHERE image_id = ?', (image_id,))
 
             for anno in raw_annotations:
                 anno_type = anno.get('type', 'rect')
@@ -597,31 +708,48 @@ def download_images():
     if not os.path.exists(images_path):
         return jsonify({'success': False, 'error': 'Images directory not found'}), 404
 
-    mem_zip = BytesIO()
-    with zipfile.ZipFile(mem_zip, mode='w', compression=zipfile.ZIP_DEFLATED) as zf:
-        for filename in filenames:
-            safe_filename = os.path.basename(filename)
-            file_path = os.path.join(images_path, safe_filename)
-            if os.path.exists(file_path):
-                zf.write(file_path, arcname=safe_filename)
-            else:
-                logger.warning(f"File not found: {file_path}")
+    def write_images(output):
+        with open_archive(output, 'zip') as zf:
+            for filename in filenames:
+                safe_filename = os.path.basename(filename)
+                file_path = os.path.join(images_path, safe_filename)
+                if os.path.exists(file_path):
+                    zf.write(file_path, safe_filename)
+                else:
+                    logger.warning(f"File not found: {file_path}")
 
     if save_path:
         os.makedirs(save_path, exist_ok=True)
         zip_filename = f'{project_name}_images.zip'
         zip_path = os.path.join(save_path, zip_filename)
-        with open(zip_path, 'wb') as f:
-            f.write(mem_zip.getvalue())
-        mem_zip.close()
+        write_images(zip_path)
         return jsonify({'success': True, 'saved_file': zip_path})
 
-    mem_zip.seek(0)
-    return send_file(
-        mem_zip,
-        mimetype='application/zip',
-        as_attachment=True,
-        download_name=f'{project_name}_images.zip'
+    return _zip_stream_response(write_images, f'{project_name}_images.zip')
+
+def _export_writer(format_type, project, splits, setup_type, project_name, project_description, archive_format='zip', use_cache=True, shard_size_mb=WEBDATASET_SHARD_SIZE_MB, mask_encoding='polygon'):
+    """Return a callable(output, progress_callback=None) writing the export archive, or None for unknown formats."""
+    if format_type == 'PARQUET':
+        return lambda output, progress_callback=None: generate_parquet_export(project, splits, setup_type, output=output, archive_format=archive_format, progress_callback=progress_callback)
+    if format_type not in ('COCO', 'YOLO', 'PASCAL_VOC', 'CSV', 'WEBDATASET'):
+        return None
+    cache = ExportCache.for_project(project, format_type, setup_type, project.get_classes(), project_name, mask_encoding) if use_cache else None
+    if format_type == 'COCO':
+        return lambda output, progress_callback=None: generate_coco_export(project, splits, setup_type, project_name, project_description, output=output, archive_format=archive_format, progress_callback=progress_callback, cache=cache, mask_encoding=mask_encoding)
+    if format_type == 'WEBDATASET':
+        return lambda output, progress_callback=None: generate_webdataset_export(project, splits, setup_type, project_name, project_description, output=output, archive_format=archive_format, progress_callback=progress_callback, cache=cache, shard_size_mb=shard_size_mb)
+    if format_type == 'YOLO':
+        return lambda output, progress_callback=None: generate_yolo_export(project, splits, setup_type, project_name, project_description, output=output, archive_format=archive_format, progress_callback=progress_callback, cache=cache)
+    if format_type == 'PASCAL_VOC':
+        return lambda output, progress_callback=None: generate_pascal_voc_export(project, splits, setup_type, output=output, archive_format=archive_format, progress_callback=progress_callback, cache=cache)
+    return lambda output, progress_callback=None: generate_csv_export(project, splits, setup_type, output=output, archive_format=archive_format, progress_callback=progress_callback, cache=cache)
+
+def _zip_stream_response(write_archive, download_name, archive_format='zip'):
+    """Stream a zip or tar archive to the client while it is being written."""
+    return Response(
+        iter_zip_stream(write_archive),
+        mimetype=ARCHIVE_MIMETYPES[archive_format],
+        headers={'Content-Disposition': f'attachment; filename="{download_name}"'}
     )
 
 @bp.route('/export/<project_name>', methods=['POST'])
@@ -641,6 +769,16 @@ def export_annotations(project_name):
     split_choices = data.get('split_choices', ['train'])
     split_ratios = data.get('split_ratios', {'train': 100, 'test': 0, 'val': 0})
     save_path = data.get('save_path')
+    archive_format = data.get('archive_format', 'zip')
+    run_async = bool(data.get('async', False))
+    use_cache = bool(data.get('use_cache', True))
+    mask_encoding = data.get('mask_encoding', 'polygon')
+    if mask_encoding not in ('polygon', 'rle'):
+        return jsonify({'success': False, 'error': f'Unsupported mask encoding: {mask_encoding}'}), 400
+    try:
+        shard_size_mb = float(data.get('shard_size_mb', WEBDATASET_SHARD_SIZE_MB))
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'shard_size_mb must be a number'}), 400
 
 
     # Log incoming parameters
@@ -652,15 +790,21 @@ def export_annotations(project_name):
 
     if not format_type:
         return jsonify({'success': False, 'error': 'Format not specified'}), 400
+    if archive_format not in ARCHIVE_FORMATS:
+        return jsonify({'success': False, 'error': f'Unsupported archive format: {archive_format}'}), 400
+    if archive_format in DIRECTORY_FORMATS and (run_async or not save_path):
+        return jsonify({'success': False, 'error': 'Directory export requires save_path and cannot run as a background job'}), 400
     project_path = os.path.join(PROJECTS_FOLDER, project_name)
     if not os.path.exists(project_path):
         return jsonify({'success': False, 'error': 'Project not found'}), 404
     project = Project(project_name, "", "", project_path)
     setup_type = project.get_setup_type()
-    if setup_type == "Oriented Bounding Box" and format_type not in ['CSV', 'YOLO']:
-        return jsonify({'success': False, 'error': 'Oriented Bounding Box can only be exported as CSV or YOLO'}), 400
-    elif setup_type == "Segmentation" and format_type not in ['COCO', 'YOLO']:
-        return jsonify({'success': False, 'error': 'Segmentation can only be exported as COCO or YOLO'}), 400
+    if setup_type == "Oriented Bounding Box" and format_type not in ['CSV', 'YOLO', 'PARQUET', 'WEBDATASET']:
+        return jsonify({'success': False, 'error': 'Oriented Bounding Box can only be exported as CSV, YOLO, PARQUET or WEBDATASET'}), 400
+    elif setup_type == "Segmentation" and format_type not in ['COCO', 'YOLO', 'PARQUET', 'WEBDATASET']:
+        return jsonify({'success': False, 'error': 'Segmentation can only be exported as COCO, YOLO, PARQUET or WEBDATASET'}), 400
+    if format_type == 'PARQUET' and not PARQUET_AVAILABLE:
+        return jsonify({'success': False, 'error': 'PARQUET export requires pyarrow to be installed'}), 400
 
     with sqlite3.connect(project.db_path) as conn:
         cursor = conn.cursor()
@@ -697,57 +841,92 @@ def export_annotations(project_name):
     except ValueError as e:
         return jsonify({'success': False, 'error': str(e)}), 400
 
+    write_export = _export_writer(format_type, project, splits, setup_type, project_name, project_description, archive_format, use_cache, shard_size_mb, mask_encoding)
+    if write_export is None:
+        return jsonify({'success': False, 'error': 'Invalid format specified'}), 400
+
     try:
-        if format_type == 'COCO':
-            export_data = generate_coco_export(
-                project,
-                splits,
-                setup_type,
-                project_name,
-                project_description
-            )
-        elif format_type == 'YOLO':
-            export_data = generate_yolo_export(
-                project,
-                splits,
-                setup_type,
-                project_name,
-                project_description
-            )
-        elif format_type == 'PASCAL_VOC':
-            export_data = generate_pascal_voc_export(
-                project,
-                splits,
-                setup_type
-            )
-        elif format_type == 'CSV':
-            export_data = generate_csv_export(
-                project,
-                splits,
-                setup_type
+        if run_async:
+            job_id = export_jobs.start(
+                write_export,
+                f'{project_name}_{format_type}{ARCHIVE_EXTENSIONS[archive_format]}',
+                project_name=project_name,
+                user_id=current_user.id
             )
-        else:
-            return jsonify({'success': False, 'error': 'Invalid format specified'}), 400
+            return jsonify({'success': True, 'job_id': job_id, 'status': 'queued'}), 202
 
         if save_path:
             os.makedirs(save_path, exist_ok=True)
-            zip_filename = f'{project_name}_{format_type}.zip'
+            zip_filename = f'{project_name}_{format_type}{ARCHIVE_EXTENSIONS[archive_format]}'
             zip_path = os.path.join(save_path, zip_filename)
-            with open(zip_path, 'wb') as f:
-                f.write(export_data.getvalue())
+            write_export(zip_path)
             return jsonify({'success': True, 'saved_file': zip_path})
 
-        return send_file(
-            export_data,
-            mimetype='application/zip',
-            as_attachment=True,
-            download_name=f'{project_name}_{format_type}.zip'
-        )
+        return _zip_stream_response(write_export, f'{project_name}_{format_type}{ARCHIVE_EXTENSIONS[archive_format]}', archive_format)
     except Exception as e:
         logger.error(f'Error during export generation: {e}')
         return jsonify({'success': False, 'error': f'Export failed: {str(e)}'}), 500
 
-    
+
+@bp.route('/import_parquet/<project_name>', methods=['POST'])
+@login_required
+def import_parquet(project_name):
+    """
+    Import annotations from an annotations.parquet file produced by the PARQUET export.
+    Rows are matched to project images by file name.
+    """
+    if not PARQUET_AVAILABLE:
+        return jsonify({'success': False, 'error': 'PARQUET import requires pyarrow to be installed'}), 400
+    project_path = os.path.join(PROJECTS_FOLDER, project_name)
+    if not os.path.exists(project_path):
+        return jsonify({'success': False, 'error': 'Project not found'}), 404
+    upload = request.files.get('file')
+    if upload is None or not upload.filename.endswith('.parquet'):
+        return jsonify({'success': False, 'error': 'A .parquet file is required'}), 400
+
+    project = Project(project_name, "", "", project_path)
+    temp_path = os.path.join(project_path, f'.import_{secure_filename(upload.filename)}')
+    try:
+        upload.save(temp_path)
+        result = import_parquet_annotations(
+            project, temp_path,
+            user_id=current_user.id,
+            replace_existing=request.form.get('replace_existing', 'true').lower() == 'true'
+        )
+        return jsonify({'success': True, **result})
+    except Exception as e:
+        logger.error(f"Error importing Parquet annotations for {project_name}: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+@bp.route('/export_status/<job_id>', methods=['GET'])
+@login_required
+def export_status(job_id):
+    """
+    Check the status and progress of a background export job.
+    """
+    job = export_jobs.get(job_id)
+    if not job:
+        return jsonify({'success': False, 'error': 'Export job not found'}), 404
+    return jsonify({'success': True, **job})
+
+@bp.route('/export_download/<job_id>', methods=['GET'])
+@login_required
+def export_download(job_id):
+    """
+    Download the artifact of a completed export job. Range requests are honoured
+    so interrupted downloads can resume.
+    """
+    job = export_jobs.get(job_id)
+    if not job:
+        return jsonify({'success': False, 'error': 'Export job not found'}), 404
+    artifact = export_jobs.artifact_path(job_id)
+    if not artifact:
+        return jsonify({'success': False, 'error': f"Export job is {job['status']}"}), 409
+    return send_file(artifact, as_attachment=True, download_name=job['filename'], conditional=True)
+
 @bp.route('/check_gpu', methods=['GET'])
 def check_gpu():
     try:
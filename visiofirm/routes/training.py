@@ -1,15 +1,19 @@
 from flask import Blueprint, render_template, request, jsonify, send_file, current_app
-from flask import Blueprint, request, jsonify, render_template, send_file
+from flask import Blueprint, request, jsonify, render_template, send_file, Response, stream_with_context
 from flask_login import login_required, current_user
 import os
 import json
 import logging
 from werkzeug.utils import secure_filename
-from visiofirm.config import PROJECTS_FOLDER
+from visiofirm.config import PROJECTS_FOLDER, METRICS_STREAM_SECONDS, METRICS_KEEPALIVE_SECONDS
 from visiofirm.models.training import TrainingTask
 from visiofirm.utils.TrainingEngine import TrainingEngine
+from visiofirm.utils.training_queue import training_queue
+from visiofirm.utils.metrics_hub import metrics_hub, FINAL_EVENT
 from visiofirm.models.project import Project
+import multiprocessing
 import threading
+import time
 import zipfile
 from io import BytesIO
 
@@ -28,6 +32,106 @@ def get_training_engine(project_name):
         training_engines[project_name] = TrainingEngine(project_name, project_path)
     return training_engines[project_name]
 
+def _batch_size(value):
+    """批量大小参数：'auto' 表示训练前按设备自动探测，其余按整数解析"""
+    if isinstance(value, str) and value.strip().lower() == 'auto':
+        return 'auto'
+    return int(value)
+
+def _launch_queued_task(project_name, task_id):
+    """队列派发回调：读取任务配置并在项目的训练引擎中启动"""
+    project_path = os.path.join(PROJECTS_FOLDER, project_name)
+    if not os.path.exists(project_path):
+        return False
+    task_details = TrainingTask(project_name, project_path).get_task_details(task_id)
+    if not task_details:
+        return False
+    # 记录了检查点的任务（中断、停止或服务重启）从检查点继续，重新开始的任务在入队前已清除检查点
+    return get_training_engine(project_name).start_training(
+        task_id,
+        task_details['model_type'],
+        task_details['dataset_split'],
+        task_details['config'],
+        resume=bool(task_details.get('checkpoint_path'))
+    )
+
+def _enqueue_training(project_name, task_id, priority=0):
+    """任务入队并尝试立即派发，返回响应数据"""
+    training_queue.enqueue(project_name, task_id, priority)
+    project_path = os.path.join(PROJECTS_FOLDER, project_name)
+    TrainingTask(project_name, project_path).update_task_status(task_id, 'queued', None)
+    training_queue.dispatch()
+    position = training_queue.position(project_name, task_id)
+    if position is None:
+        task_details = TrainingTask(project_name, project_path).get_task_details(task_id)
+        if task_details and task_details['status'] == 'failed':
+            return {'success': False, 'error': task_details.get('error_message') or '启动训练任务失败'}
+        return {'success': True, 'message': '训练任务已启动', 'task_id': task_id, 'status': 'running'}
+    return {'success': True, 'message': f'训练任务已排队，前面还有 {position - 1} 个任务',
+            'task_id': task_id, 'status': 'queued', 'queue_position': position}
+
+def _resume_training_queue():
+    """恢复上次进程遗留的排队/运行中任务，有检查点的任务从检查点继续（只应由 start_training_queue 调用）"""
+    try:
+        for project_name, task_id in training_queue.start(_launch_queued_task):
+            project_path = os.path.join(PROJECTS_FOLDER, project_name)
+            if os.path.exists(project_path) and training_queue.position(project_name, task_id) is not None:
+                TrainingTask(project_name, project_path).update_task_status(task_id, 'queued', None)
+        _requeue_orphaned_tasks()
+    except Exception as e:
+        logger.error(f"恢复训练队列失败: {e}")
+
+def _has_live_worker(project_name, task_id):
+    """本进程中该任务的训练线程仍在运行"""
+    engine = training_engines.get(project_name)
+    if engine is None or engine.current_task_id != task_id:
+        return False
+    thread = engine.training_thread
+    return thread is not None and thread.is_alive()
+
+def _requeue_orphaned_tasks():
+    """
+    数据库中仍为运行中/排队中、但不在训练队列里的任务（例如队列启用前中断的任务）重新入队
+
+    仍由本进程训练线程运行的任务不会重新入队，避免在原训练进程写入 last.pt 时从检查点再次启动。
+    """
+    if not os.path.isdir(PROJECTS_FOLDER):
+        return
+    active = {(entry['project_name'], entry['task_id']) for entry in training_queue.get_entries()}
+    for project_name in sorted(os.listdir(PROJECTS_FOLDER)):
+        project_path = os.path.join(PROJECTS_FOLDER, project_name)
+        if not os.path.exists(os.path.join(project_path, 'config.db')):
+            continue
+        training_task = TrainingTask(project_name, project_path)
+        for task_id in training_task.get_task_ids_by_status('running', 'queued'):
+            if (project_name, task_id) not in active and not _has_live_worker(project_name, task_id):
+                logger.info(f"重新排队中断的训练任务 {project_name}/{task_id}")
+                _enqueue_training(project_name, task_id)
+
+# 导入时只注册派发回调：spawn 子进程（训练子进程、推理服务）会重新导入主模块和本模块，
+# 恢复和派发必须由服务启动流程显式调用 start_training_queue
+training_queue.set_launcher(_launch_queued_task)
+
+_queue_started = False
+_queue_start_lock = threading.Lock()
+
+def start_training_queue():
+    """
+    服务启动时恢复训练队列（每个服务进程只执行一次，子进程中不执行）
+
+    Returns:
+        bool: 本次是否执行了恢复
+    """
+    global _queue_started
+    if multiprocessing.parent_process() is not None:
+        return False
+    with _queue_start_lock:
+        if _queue_started:
+            return False
+        _queue_started = True
+    _resume_training_queue()
+    return True
+
 @bp.route('/<project_name>')
 @login_required
 def training_dashboard(project_name):
@@ -85,7 +189,7 @@ def create_training_task():
         # 训练配置
         config = {
             'epochs': int(data.get('epochs', 100)),
-            'batch_size': int(data.get('batch_size', 16)),
+            'batch_size': _batch_size(data.get('batch_size', 16)),
             'learning_rate': float(data.get('learning_rate', 0.01)),
             'image_size': int(data.get('image_size', 640)),
             'device': data.get('device', 'auto'),
@@ -93,6 +197,9 @@ def create_training_task():
             'augmentation': data.get('augmentation', {}),
             'other_params': data.get('other_params', {})
         }
+        if 'resize_images' in data:
+            # 可选：训练时使用按 imgsz 缩小的图像副本
+            config['resize_images'] = bool(data['resize_images'])
         
         if not all([project_name, task_name, model_type]):
             return jsonify({'success': False, 'error': '缺少必要参数'}), 400
@@ -147,27 +254,52 @@ def start_training_task():
         if not task_details:
             return jsonify({'success': False, 'error': '训练任务不存在'}), 404
         
-        if task_details['status'] == 'running':
-            return jsonify({'success': False, 'error': '训练任务已在运行中'}), 400
-        
-        # 启动训练
-        engine = get_training_engine(project_name)
-        success = engine.start_training(
-            task_id,
-            task_details['model_type'],
-            task_details['dataset_split'],
-            task_details['config']
-        )
+        if task_details['status'] in ('running', 'queued'):
+            return jsonify({'success': False, 'error': '训练任务已在运行中或排队中'}), 400
         
-        if success:
-            return jsonify({'success': True, 'message': '训练任务已启动'})
-        else:
-            return jsonify({'success': False, 'error': '启动训练任务失败'}), 500
+        # 重新开始训练，不沿用之前的检查点
+        training_task.set_checkpoint(task_id, None)
+        # 入队，有空闲容量时立即启动
+        result = _enqueue_training(project_name, task_id, int(data.get('priority', 0)))
+        return jsonify(result), (200 if result['success'] else 500)
             
     except Exception as e:
         logger.error(f"启动训练任务失败: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@bp.route('/resume_task', methods=['POST'])
+@login_required
+def resume_training_task():
+    """从检查点继续中断或停止的训练任务（沿用原始训练配置）"""
+    try:
+        data = request.get_json()
+        project_name = data.get('project_name')
+        task_id = int(data.get('task_id'))
+        
+        if not project_name or not task_id:
+            return jsonify({'success': False, 'error': '缺少必要参数'}), 400
+        
+        project_path = os.path.join(PROJECTS_FOLDER, project_name)
+        training_task = TrainingTask(project_name, project_path)
+        task_details = training_task.get_task_details(task_id)
+        
+        if not task_details:
+            return jsonify({'success': False, 'error': '训练任务不存在'}), 404
+        
+        if task_details['status'] in ('running', 'queued', 'completed'):
+            return jsonify({'success': False, 'error': f"任务状态为 {task_details['status']}，无法继续训练"}), 400
+        
+        checkpoint = task_details.get('checkpoint_path')
+        if not checkpoint or not os.path.exists(checkpoint):
+            return jsonify({'success': False, 'error': '任务没有可用的检查点，请重新开始训练'}), 400
+        
+        result = _enqueue_training(project_name, task_id, int(data.get('priority', 0)))
+        return jsonify(result), (200 if result['success'] else 500)
+            
+    except Exception as e:
+        logger.error(f"继续训练任务失败: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @bp.route('/api/start', methods=['POST'])
 @login_required
 def api_start_training():
@@ -184,7 +316,7 @@ def api_start_training():
         
         # 获取训练配置
         epochs = int(data.get('epochs', 10))
-        batch_size = int(data.get('batch_size', 32))
+        batch_size = _batch_size(data.get('batch_size', 32))
         learning_rate = float(data.get('learning_rate', 0.001))
         model_type = data.get('model_type', 'YOLO')
         
@@ -221,26 +353,9 @@ def api_start_training():
         if not task_id:
             return jsonify({'success': False, 'error': '创建训练任务失败'}), 500
         
-        # 启动训练
-        engine = get_training_engine(project_name)
-        success = engine.start_training(
-            task_id,
-            model_type,
-            {'train': 0.7, 'val': 0.2, 'test': 0.1},
-            {
-                'epochs': epochs,
-                'batch_size': batch_size,
-                'learning_rate': learning_rate,
-                'image_size': 640,
-                'device': 'auto',
-                'optimizer': 'auto'
-            }
-        )
-        
-        if success:
-            return jsonify({'success': True, 'message': '训练任务已启动', 'task_id': task_id})
-        else:
-            return jsonify({'success': False, 'error': '启动训练任务失败'}), 500
+        # 入队，有空闲容量时立即启动
+        result = _enqueue_training(project_name, task_id, int(data.get('priority', 0)))
+        return jsonify(result), (200 if result['success'] else 500)
             
     except Exception as e:
         logger.error(f"启动训练任务失败: {e}")
@@ -261,8 +376,7 @@ def api_stop_training():
         
         # 获取训练引擎并停止训练
         engine = get_training_engine(project_name)
-        if hasattr(engine, 'stop_training'):
-            engine.stop_training = True
+        if engine.current_task_id and engine.stop_training_task(engine.current_task_id):
             return jsonify({'success': True, 'message': '训练任务已停止'})
         else:
             return jsonify({'success': False, 'error': '无法停止训练任务'}), 500
@@ -274,42 +388,123 @@ def api_stop_training():
 @bp.route('/api/status')
 @login_required
 def api_training_status():
-    """API: 获取训练状态"""
+    """API: 获取训练状态（当前或指定任务的真实进度和最新指标）"""
     try:
-        # 获取项目名称
-        project_name = request.args.get('project_name', 'test')
-        
-        # 获取训练引擎
+        project_name = request.args.get('project_name')
+        if not project_name:
+            return jsonify({'success': False, 'error': '缺少项目名称'}), 400
+
+        project_path = os.path.join(PROJECTS_FOLDER, project_name)
+        if not os.path.exists(project_path):
+            return jsonify({'success': False, 'error': '项目不存在'}), 404
+
         engine = get_training_engine(project_name)
-        
-        # 获取训练状态
-        status = 'idle'
-        progress = 0
-        message = '等待开始训练'
-        
-        if hasattr(engine, 'current_task_id') and engine.current_task_id:
-            status = 'training'
-            progress = 50  # 模拟进度
-            message = '训练进行中...'
-        
-        return jsonify({
-            'success': True,
-            'data': {
-                'status': status,
-                'progress': progress,
-                'message': message,
-                'metrics': {
-                    'accuracy': 0.85,
-                    'loss': 0.25,
-                    'epoch': 5
-                }
-            }
-        })
-        
+        training_task = TrainingTask(project_name, project_path)
+        task_id = request.args.get('task_id', type=int) or engine.current_task_id
+        if not task_id:
+            tasks = training_task.get_training_tasks()
+            task_id = tasks[0]['id'] if tasks else None
+        task_details = training_task.get_task_details(task_id) if task_id else None
+        if not task_details:
+            return jsonify({'success': True, 'data': {'status': 'idle', 'progress': 0, 'message': '等待开始训练', 'metrics': {}}})
+
+        key = (project_name, task_id)
+        epoch_event = metrics_hub.latest(key, 'epoch')
+        batch_event = metrics_hub.latest(key, 'batch')
+        latest_epoch = epoch_event['data'] if epoch_event else None
+        if latest_epoch is None:
+            # 服务重启或任务已结束后指标流不在内存中，回退到数据库中的最后一轮
+            logs = training_task.get_training_logs(task_id)
+            latest_epoch = logs[-1]['metrics'] if logs and logs[-1]['metrics'] else None
+
+        data = {
+            'task_id': task_id,
+            'status': task_details['status'],
+            'progress': task_details['progress'] or 0,
+            'message': task_details['error_message'] or '',
+            'metrics': _status_metrics(latest_epoch, batch_event['data'] if batch_event else None),
+        }
+        if task_details['status'] == 'queued':
+            data['queue_position'] = training_queue.position(project_name, task_id)
+        return jsonify({'success': True, 'data': data})
+
     except Exception as e:
         logger.error(f"获取训练状态失败: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+def _status_metrics(epoch_data, batch_data):
+    """合并最新一轮和最新批次的指标，省略缺失值"""
+    metrics = {}
+    if epoch_data:
+        values = epoch_data.get('metrics') or {}
+        metrics.update({
+            'epoch': epoch_data.get('epoch'),
+            'epochs': epoch_data.get('epochs'),
+            'loss': epoch_data.get('loss'),
+            'accuracy': values.get('metrics/mAP50(B)', values.get('metrics/mAP50(M)')),
+            'map50_95': values.get('metrics/mAP50-95(B)', values.get('metrics/mAP50-95(M)')),
+            'precision': values.get('metrics/precision(B)', values.get('metrics/precision(M)')),
+            'recall': values.get('metrics/recall(B)', values.get('metrics/recall(M)')),
+            'losses': epoch_data.get('losses'),
+            'lr': epoch_data.get('lr'),
+            'imgs_per_sec': epoch_data.get('imgs_per_sec'),
+            'eta_seconds': epoch_data.get('eta_seconds'),
+        })
+    if batch_data and (not epoch_data or batch_data.get('epoch', 0) > epoch_data.get('epoch', 0)):
+        # 当前轮尚未结束时，吞吐量和剩余时间以最新批次为准
+        metrics.update({k: batch_data.get(k) for k in ('lr', 'imgs_per_sec', 'eta_seconds')})
+        metrics.update({'batch': batch_data.get('batch'), 'batches': batch_data.get('batches')})
+    return {k: v for k, v in metrics.items() if v is not None}
+
+@bp.route('/api/metrics/stream')
+@login_required
+def api_metrics_stream():
+    """
+    API: 以 Server-Sent Events 推送训练指标
+
+    事件类型为 batch / epoch / status，id 为事件序号；断线重连时浏览器会带上
+    Last-Event-ID，从缓冲区中续传。每个连接最多保持 METRICS_STREAM_SECONDS 秒，
+    之后由 EventSource 自动重连，避免长期占用服务线程。
+    """
+    project_name = request.args.get('project_name')
+    task_id = request.args.get('task_id', type=int)
+    if not project_name or not task_id:
+        return jsonify({'success': False, 'error': '缺少项目名称或任务ID'}), 400
+    project_path = os.path.join(PROJECTS_FOLDER, project_name)
+    if not os.path.exists(project_path):
+        return jsonify({'success': False, 'error': '项目不存在'}), 404
+
+    key = (project_name, task_id)
+    try:
+        after_seq = int(request.headers.get('Last-Event-ID') or request.args.get('after', 0))
+    except ValueError:
+        after_seq = 0
+
+    def generate(after_seq):
+        yield 'retry: 3000\n\n'
+        deadline = time.monotonic() + METRICS_STREAM_SECONDS
+        while time.monotonic() < deadline:
+            events = metrics_hub.wait_for(key, after_seq, timeout=METRICS_KEEPALIVE_SECONDS)
+            for event in events:
+                after_seq = event['seq']
+                yield f"id: {event['seq']}\nevent: {event['type']}\ndata: {json.dumps(event['data'])}\n\n"
+            if events:
+                continue
+            if metrics_hub.has_stream(key):
+                if metrics_hub.is_closed(key):
+                    return
+            else:
+                # 任务还在排队或已在其他进程生命周期中结束
+                task_details = TrainingTask(project_name, project_path).get_task_details(task_id)
+                if not task_details or task_details['status'] not in ('pending', 'queued', 'running'):
+                    status = task_details['status'] if task_details else 'unknown'
+                    yield f"event: {FINAL_EVENT}\ndata: {json.dumps({'status': status})}\n\n"
+                    return
+            yield ': keepalive\n\n'
+
+    return Response(stream_with_context(generate(after_seq)), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @bp.route('/api/download_model', methods=['POST'])
 @login_required
 def api_download_model():
@@ -416,6 +611,12 @@ def stop_training_task():
         if not project_name or not task_id:
             return jsonify({'success': False, 'error': '缺少必要参数'}), 400
         
+        # 排队中的任务直接取消
+        if training_queue.cancel(project_name, task_id):
+            project_path = os.path.join(PROJECTS_FOLDER, project_name)
+            TrainingTask(project_name, project_path).update_task_status(task_id, 'cancelled', None, "排队中被用户取消")
+            return jsonify({'success': True, 'message': '排队中的训练任务已取消'})
+        
         # 停止训练
         engine = get_training_engine(project_name)
         success = engine.stop_training_task(task_id)
@@ -451,6 +652,17 @@ def get_task_status(project_name, task_id):
         logger.error(f"获取训练任务状态失败: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@bp.route('/api/queue')
+@login_required
+def api_training_queue():
+    """API: 获取排队和运行中的训练任务"""
+    try:
+        entries = training_queue.get_entries(request.args.get('project_name'))
+        return jsonify({'success': True, 'queue': entries})
+    except Exception as e:
+        logger.error(f"获取训练队列失败: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @bp.route('/tasks/<project_name>')
 @login_required
 def get_training_tasks(project_name):
@@ -766,7 +978,8 @@ def get_system_resources(project_name):
             return jsonify({'success': False, 'error': '项目不存在'}), 404
         
         engine = get_training_engine(project_name)
-        resource_usage = engine.get_resource_usage()
+        # ?history=秒数 时附带采样历史，便于前端绘制曲线
+        resource_usage = engine.get_resource_usage(request.args.get('history', type=int))
         
         return jsonify({
             'success': True,
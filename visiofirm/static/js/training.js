@@ -166,7 +166,7 @@ async function startTraining() {
         
         if (result.success) {
             showSuccess('训练已开始');
-            startProgressTracking();
+            startProgressTracking(result.task_id);
         } else {
             throw new Error(result.error || '启动训练失败');
         }
@@ -315,9 +315,104 @@ function updateProgress(progress, message) {
 }
 
 /**
- * 开始进度跟踪
+ * 开始进度跟踪：优先使用 SSE 实时推送，不支持或连接失败时回退到轮询
  */
-function startProgressTracking() {
+function startProgressTracking(taskId) {
+    if (taskId && window.EventSource) {
+        startMetricsStream(taskId);
+    } else {
+        startStatusPolling(taskId);
+    }
+}
+
+/**
+ * 订阅训练指标流
+ */
+function startMetricsStream(taskId) {
+    const templateData = getTemplateData();
+    const projectName = encodeURIComponent(templateData.projectName || 'test');
+    const source = new EventSource(`/training/api/metrics/stream?project_name=${projectName}&task_id=${taskId}`);
+    let received = false;
+
+    const handleMetrics = (event) => {
+        received = true;
+        const data = JSON.parse(event.data);
+        const metrics = data.metrics || {};
+        updateTrainingMetrics({
+            epoch: data.epoch,
+            loss: data.loss === null ? undefined : data.loss,
+            accuracy: metrics['metrics/mAP50(B)'] ?? metrics['metrics/mAP50(M)']
+        });
+        if (data.progress !== undefined) {
+            updateTrainingProgress({status: 'running', progress: data.progress, message: getStreamText(data)});
+        } else {
+            updateProgress(trainingProgress, getStreamText(data));
+        }
+    };
+
+    source.addEventListener('epoch', handleMetrics);
+    source.addEventListener('batch', handleMetrics);
+    source.addEventListener('status', (event) => {
+        received = true;
+        const data = JSON.parse(event.data);
+        if (['completed', 'failed', 'stopped', 'unknown'].includes(data.status)) {
+            source.close();
+            // 最终状态（包括最终指标和错误信息）以状态接口为准
+            fetchTrainingStatus(taskId);
+        }
+    });
+    source.onerror = () => {
+        if (trainingStatus !== 'training') {
+            source.close();
+        } else if (!received) {
+            // 连接从未成功建立，回退到轮询
+            source.close();
+            startStatusPolling(taskId);
+        }
+        // 其他情况由 EventSource 自动重连，并通过 Last-Event-ID 续传
+    };
+}
+
+/**
+ * 根据指标事件生成进度文本
+ */
+function getStreamText(data) {
+    let text = `训练进行中... 第 ${data.epoch}/${data.epochs} 轮`;
+    if (data.batch && data.batches) {
+        text += ` (${data.batch}/${data.batches})`;
+    }
+    if (data.imgs_per_sec) {
+        text += ` | ${data.imgs_per_sec} 张/秒`;
+    }
+    if (data.eta_seconds !== null && data.eta_seconds !== undefined) {
+        text += ` | 剩余约 ${Math.ceil(data.eta_seconds / 60)} 分钟`;
+    }
+    return text;
+}
+
+/**
+ * 获取一次训练状态，返回是否已结束
+ */
+async function fetchTrainingStatus(taskId) {
+    const templateData = getTemplateData();
+    let url = `/training/api/status?project_name=${encodeURIComponent(templateData.projectName || 'test')}`;
+    if (taskId) {
+        url += `&task_id=${taskId}`;
+    }
+    const response = await fetch(url);
+    const result = await response.json();
+
+    if (result.success) {
+        updateTrainingProgress(result.data);
+        return ['completed', 'failed', 'stopped'].includes(result.data.status);
+    }
+    return false;
+}
+
+/**
+ * 轮询训练状态
+ */
+function startStatusPolling(taskId) {
     const interval = setInterval(async () => {
         if (trainingStatus !== 'training') {
             clearInterval(interval);
@@ -325,17 +420,9 @@ function startProgressTracking() {
         }
         
         try {
-            const templateData = getTemplateData();
-            const response = await fetch(`/training/api/status?project_name=${templateData.projectName || 'test'}`);
-            const result = await response.json();
-            
-            if (result.success) {
-                updateTrainingProgress(result.data);
-                
-                // 如果训练完成或失败，停止轮询
-                if (result.data.status === 'completed' || result.data.status === 'failed' || result.data.status === 'stopped') {
-                    clearInterval(interval);
-                }
+            // 如果训练完成或失败，停止轮询
+            if (await fetchTrainingStatus(taskId)) {
+                clearInterval(interval);
             }
         } catch (error) {
             console.error('获取训练状态失败:', error);
@@ -381,9 +468,11 @@ function updateTrainingProgress(data) {
         if (progressFill) {
             progressFill.classList.remove('animated');
         }
-    } else if (data.status === 'error') {
+    } else if (data.status === 'error' || data.status === 'failed') {
         updateTrainingStatus('error', '训练出错');
-        showError('❌ 训练出错: ' + data.error);
+        showError('❌ 训练出错: ' + (data.error || data.message));
+    } else if (data.status === 'stopped') {
+        updateTrainingStatus('idle', '训练已停止');
     } else if (data.status === 'running') {
         // 添加进度条动画
         if (progressFill) {
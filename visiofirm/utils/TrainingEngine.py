@@ -9,9 +9,21 @@ from datetime import datetime
 from pathlib import Path
 import torch
 from ultralytics import YOLO
+from visiofirm.config import TRAINING_RESIZE_IMAGES, BATCH_FINDER_CACHE
 from visiofirm.models.training import TrainingTask
 from visiofirm.utils.performance_config import performance_manager
+from visiofirm.utils.weight_store import weight_store
+from visiofirm.utils.geometry import xywh_to_yolo, normalize_points, annotation_boxes
+from visiofirm.utils.dataset_manifest import DatasetManifest
+from visiofirm.utils.image_cache import ResizedImageCache
+from visiofirm.utils.training_queue import training_queue
+from visiofirm.utils.training_worker import TrainingProcess
+from visiofirm.utils.metrics_hub import metrics_hub
 import shutil
+from concurrent.futures import ThreadPoolExecutor
+from visiofirm.utils.archive_writer import COPY_WORKERS
+from visiofirm.utils.export_utils import iter_export_records
+from visiofirm.utils.mask_utils import segmentation_polygon
 
 # Configure logging with less verbose output
 logging.basicConfig(level=logging.WARNING)
@@ -26,6 +38,21 @@ ultralytics_logger.setLevel(logging.ERROR)
 torch_logger = logging.getLogger('torch')
 torch_logger.setLevel(logging.ERROR)
 
+# YOLO官方模型下载URL（校验和在 WEIGHT_SHA256_PINS / pins.json 中固定，weight_store.fetch 自动校验；
+# 未固定的文件按首次下载信任）
+MODEL_URLS = {
+    'yolov8n': 'https://github.com/ultralytics/assets/releases/download/v8.3.0/yolov8n.pt',
+    'yolov8s': 'https://github.com/ultralytics/assets/releases/download/v8.3.0/yolov8s.pt',
+    'yolov8m': 'https://github.com/ultralytics/assets/releases/download/v8.3.0/yolov8m.pt',
+    'yolov8l': 'https://github.com/ultralytics/assets/releases/download/v8.3.0/yolov8l.pt',
+    'yolov8x': 'https://github.com/ultralytics/assets/releases/download/v8.3.0/yolov8x.pt',
+    'yolov10n': 'https://github.com/ultralytics/assets/releases/download/v0.1.0/yolo10n.pt',
+    'yolov10s': 'https://github.com/ultralytics/assets/releases/download/v0.1.0/yolo10s.pt',
+    'yolov10m': 'https://github.com/ultralytics/assets/releases/download/v0.1.0/yolo10m.pt',
+    'yolov10l': 'https://github.com/ultralytics/assets/releases/download/v0.1.0/yolo10l.pt',
+    'yolov10x': 'https://github.com/ultralytics/assets/releases/download/v0.1.0/yolo10x.pt'
+}
+
 class TrainingEngine:
     def __init__(self, project_name, project_path):
         self.project_name = project_name
@@ -33,7 +60,9 @@ class TrainingEngine:
         self.training_task = TrainingTask(project_name, project_path)
         self.current_task_id = None
         self.training_thread = None
+        self.training_process = None
         self.stop_training = False
+        self.dataset_splits = {}
         self._project = None
 
     @property
@@ -44,8 +73,14 @@ class TrainingEngine:
             self._project = Project(self.project_name, "", "", self.project_path)
         return self._project
 
-    def prepare_dataset(self, dataset_split):
-        """准备训练数据集"""
+    def prepare_dataset(self, dataset_split, imgsz=None):
+        """
+        准备训练数据集
+
+        Args:
+            dataset_split: 训练/验证/测试划分比例
+            imgsz: 可选，提供时数据集中放入按该训练尺寸缩小的图像副本，而不是原图
+        """
         try:
             # 验证数据集分割比例
             train_ratio = dataset_split.get('train', 0.7)
@@ -56,15 +91,9 @@ class TrainingEngine:
             if abs(total_ratio - 1.0) > 0.01:
                 raise ValueError(f"数据集分割比例之和应为1.0，当前为: {total_ratio}")
             
-            # 创建数据集目录结构
+            # 创建数据集目录结构（划分子目录由清单同步时创建）
             dataset_dir = os.path.join(self.project_path, 'dataset')
             os.makedirs(dataset_dir, exist_ok=True)
-            
-            # 创建训练、验证、测试目录
-            for split in ['train', 'val', 'test']:
-                split_dir = os.path.join(dataset_dir, split)
-                os.makedirs(os.path.join(split_dir, 'images'), exist_ok=True)
-                os.makedirs(os.path.join(split_dir, 'labels'), exist_ok=True)
 
             # 获取所有已标注的图片
             annotated_images = self.project.get_annotated_images()
@@ -106,11 +135,9 @@ class TrainingEngine:
             val_images = annotated_images[train_count:train_count + val_count]
             test_images = annotated_images[train_count + val_count:] if test_count > 0 else []
 
-            # 复制图片和标注文件
-            self._copy_dataset_files(train_images, os.path.join(dataset_dir, 'train'))
-            self._copy_dataset_files(val_images, os.path.join(dataset_dir, 'val'))
-            if test_images:
-                self._copy_dataset_files(test_images, os.path.join(dataset_dir, 'test'))
+            # 按清单增量同步图片链接和标注文件
+            self.dataset_splits = {'train': train_images, 'val': val_images, 'test': test_images}
+            self._sync_dataset_files(dataset_dir, self.dataset_splits, imgsz)
 
             # 创建数据集配置文件
             self._create_dataset_yaml(dataset_dir)
@@ -122,84 +149,104 @@ class TrainingEngine:
             logger.error(f"数据集准备失败: {e}")
             raise
 
-    def _copy_dataset_files(self, images, target_dir):
-        """复制图片和标注文件到目标目录"""
-        images_dir = os.path.join(target_dir, 'images')
-        labels_dir = os.path.join(target_dir, 'labels')
-        
-        success_count = 0
-        error_count = 0
-        
-        for image_info in images:
-            try:
-                image_name = image_info['name']
-                image_path = image_info['path']
-                
-                # 检查源文件是否存在
-                if not os.path.exists(image_path):
-                    logger.warning(f"源图片文件不存在: {image_path}")
-                    error_count += 1
+    def _sync_dataset_files(self, dataset_dir, splits, imgsz=None):
+        """
+        按 manifest.json 增量物化数据集：图片以硬链接放入（跨文件系统时回退为复制），
+        只有新增、内容变化或标注版本变化的图像才重新链接或重新生成标签；
+        提供 imgsz 时链接的是缓存目录中按训练尺寸缩小的副本
+        """
+        manifest = DatasetManifest(dataset_dir)
+        image_cache = None
+        if imgsz:
+            image_cache = ResizedImageCache(os.path.join(self.project_path, 'cache', 'resized_images'), imgsz)
+        stats = manifest.sync(
+            splits, self._generate_yolo_labels, self.project.get_classes(),
+            materialize=image_cache.materialize if image_cache else None,
+            variant=f'resize:{int(imgsz)}' if image_cache else None
+        )
+        if image_cache is not None:
+            pruned = image_cache.prune({entry['sha1'] for entry in manifest.entries.values()})
+            if pruned:
+                logger.info(f"清理了 {pruned} 个过期的缩放图像缓存")
+        logger.info(f"数据集同步完成: 新链接{stats['linked']}, 重新生成标签{stats['relabeled']}, "
+                    f"删除{stats['removed']}, 未变化{stats['unchanged']}, 缺失{stats['missing']}")
+
+        for split, images in splits.items():
+            if images and stats['splits'][split] == 0:
+                raise ValueError("没有成功复制任何文件")
+        return stats
+
+    @staticmethod
+    def _render_yolo_label(record, class_map):
+        """将一张图像的标注行渲染为YOLO格式标签文本"""
+        img_width, img_height = record.width, record.height
+        rows = [row for row in record.annotations if row[4] in class_map]
+
+        # 边界框一次性批量转换为YOLO格式 (相对坐标)
+        is_rect = [row[3] in ['rect', 'bbox'] and row[5] is not None for row in rows]
+        rect_boxes = iter(xywh_to_yolo(
+            annotation_boxes([row for row, rect in zip(rows, is_rect) if rect])[:, :4],
+            img_width, img_height
+        ).tolist())
+
+        lines = []
+        for row, rect in zip(rows, is_rect):
+            if rect:
+                # 边界框格式: class_id center_x center_y width height
+                values = next(rect_boxes)
+            elif row[3] == 'polygon':
+                # 分割格式: class_id x1 y1 x2 y2 ... xn yn
+                polygon = segmentation_polygon(row[10])
+                if not polygon:
                     continue
-                
-                # 复制图片
-                target_image_path = os.path.join(images_dir, image_name)
-                shutil.copy2(image_path, target_image_path)
-                
-                # 生成YOLO格式标注文件
-                label_name = os.path.splitext(image_name)[0] + '.txt'
-                label_path = os.path.join(labels_dir, label_name)
-                self._generate_yolo_label(image_info, label_path)
-                
-                success_count += 1
-                
-            except Exception as e:
-                logger.error(f"复制文件失败 {image_info.get('name', 'unknown')}: {e}")
-                error_count += 1
-        
-        logger.info(f"文件复制完成: 成功{success_count}, 失败{error_count}")
-        
-        if success_count == 0:
-            raise ValueError("没有成功复制任何文件")
+                values = normalize_points(polygon, img_width, img_height).ravel().tolist()
+            else:
+                continue
+            lines.append(f"{class_map[row[4]]} " + " ".join(f"{v:.6f}" for v in values) + "\n")
+        return "".join(lines)
 
-    def _generate_yolo_label(self, image_info, label_path):
-        """生成YOLO格式的标注文件"""
-        try:
-            annotations = self.project.get_annotations_by_image_id(image_info['id'])
-            classes = self.project.get_classes()
-            class_map = {cls: idx for idx, cls in enumerate(classes)}
-            
+    def _generate_yolo_labels(self, items):
+        """
+        批量生成YOLO格式的标注文件
+
+        所有图像的标注由一次流式查询按顺序读出，类别映射只计算一次，
+        渲染和文件写入交给线程池，使大量图像的标签生成受限于磁盘而不是数据库查询；
+        单张图像渲染或写入失败只记录日志，缺少宽高的图像跳过（没有标签文件，下次同步时重试）。
+
+        Args:
+            items: [(image_info, label_path), ...]
+        """
+        if not items:
+            return
+        class_map = {cls: idx for idx, cls in enumerate(self.project.get_classes())}
+        label_paths = {image_info['path']: label_path for image_info, label_path in items}
+
+        def render_and_write(record, label_path):
+            # 渲染与写入都在工作线程中完成，单张图像出错只计入失败，不中断整个数据集准备
+            if not record.width or not record.height:
+                logger.warning(f"图像 {record.path} 缺少有效尺寸 ({record.width}x{record.height})，跳过标签生成")
+                return False
+            text = self._render_yolo_label(record, class_map)
             with open(label_path, 'w') as f:
-                for ann in annotations:
-                    if ann['class_name'] in class_map:
-                        class_id = class_map[ann['class_name']]
-                        
-                        # 转换坐标为YOLO格式 (相对坐标)
-                        img_width = image_info['width']
-                        img_height = image_info['height']
-                        
-                        if ann['type'] in ['rect', 'bbox'] and ann['x'] is not None:
-                            # 边界框格式: class_id center_x center_y width height
-                            x, y, w, h = ann['x'], ann['y'], ann['width'], ann['height']
-                            center_x = (x + w/2) / img_width
-                            center_y = (y + h/2) / img_height
-                            norm_w = w / img_width
-                            norm_h = h / img_height
-                            
-                            f.write(f"{class_id} {center_x:.6f} {center_y:.6f} {norm_w:.6f} {norm_h:.6f}\n")
-                        
-                        elif ann['type'] == 'polygon' and ann.get('points'):
-                            # 分割格式: class_id x1 y1 x2 y2 ... xn yn
-                            points = ann['points']
-                            normalized_points = []
-                            for point in points:
-                                norm_x = point['x'] / img_width
-                                norm_y = point['y'] / img_height
-                                normalized_points.extend([f"{norm_x:.6f}", f"{norm_y:.6f}"])
-                            
-                            f.write(f"{class_id} {' '.join(normalized_points)}\n")
-                            
-        except Exception as e:
-            logger.error(f"生成YOLO标注文件失败: {e}")
+                f.write(text)
+            return True
+
+        written = skipped = error_count = 0
+        with ThreadPoolExecutor(max_workers=COPY_WORKERS, thread_name_prefix='label-writer') as executor:
+            futures = [
+                executor.submit(render_and_write, record, label_paths[record.path])
+                for record in iter_export_records(self.project.db_path, list(label_paths))
+            ]
+            for future in futures:
+                try:
+                    if future.result():
+                        written += 1
+                    else:
+                        skipped += 1
+                except Exception as e:
+                    logger.error(f"生成YOLO标注文件失败: {e}")
+                    error_count += 1
+        logger.info(f"YOLO标注文件生成完成: 成功{written}, 跳过{skipped}, 失败{error_count}")
 
     def _create_dataset_yaml(self, dataset_dir):
         """创建数据集配置文件"""
@@ -231,8 +278,13 @@ class TrainingEngine:
             logger.error(f"创建数据集配置文件失败: {e}")
             raise
 
-    def start_training(self, task_id, model_type, dataset_split, config):
-        """开始训练任务"""
+    def start_training(self, task_id, model_type, dataset_split, config, resume=False):
+        """
+        开始训练任务
+
+        Args:
+            resume: 为 True 时从任务记录的检查点（last.pt）继续训练，而不是从头开始
+        """
         try:
             # 检查是否可以启动新任务
             can_start, message = performance_manager.can_start_task(task_id)
@@ -243,6 +295,7 @@ class TrainingEngine:
             
             self.current_task_id = task_id
             self.stop_training = False
+            self.training_process = None
             
             # 获取优化的训练配置
             optimized_config = performance_manager.get_memory_efficient_config(
@@ -263,13 +316,13 @@ class TrainingEngine:
             }
             performance_manager.register_task(task_id, task_info)
             
-            # 更新任务状态为运行中
-            self.training_task.update_task_status(task_id, 'running', 0)
+            # 更新任务状态为运行中（继续训练时保留已有进度）
+            self.training_task.update_task_status(task_id, 'running', None if resume else 0)
             
             # 在后台线程中执行训练
             self.training_thread = threading.Thread(
                 target=self._run_training,
-                args=(task_id, model_type, dataset_split, final_config)
+                args=(task_id, model_type, dataset_split, final_config, resume)
             )
             self.training_thread.start()
             
@@ -295,169 +348,217 @@ class TrainingEngine:
             logger.info("未检测到CUDA设备，使用CPU训练")
             return 'cpu'
 
-    def _run_training(self, task_id, model_type, dataset_split, config):
-        """执行训练过程"""
+    def _resumable_checkpoint(self, task_id):
+        """任务记录的检查点路径；文件已不存在时返回 None"""
+        task_details = self.training_task.get_task_details(task_id) or {}
+        checkpoint = task_details.get('checkpoint_path')
+        if checkpoint and os.path.exists(checkpoint):
+            return checkpoint
+        if checkpoint:
+            logger.warning(f"任务 {task_id} 的检查点不存在: {checkpoint}，将从头开始训练")
+        return None
+
+    def _run_training(self, task_id, model_type, dataset_split, config, resume=False):
+        """执行训练过程：在监控线程中准备数据集，再把 model.train 交给独立子进程运行"""
+        final_status = 'failed'
+        metrics_key = (self.project_name, task_id)
+        metrics_hub.open(metrics_key, persist=lambda rows: self.training_task.log_training_progress_batch(task_id, rows))
+        metrics_hub.publish(metrics_key, 'status', {'status': 'preparing'})
         try:
-            # 准备数据集
-            dataset_dir = self.prepare_dataset(dataset_split)
+            # 准备数据集（任务开启 resize_images 时放入按训练尺寸缩小的图像，减少每个epoch的解码和缩放开销）
+            imgsz = config.get('image_size', 640)
+            resize = config.get('resize_images', TRAINING_RESIZE_IMAGES)
+            dataset_dir = self.prepare_dataset(dataset_split, imgsz if resize else None)
             dataset_yaml = os.path.join(dataset_dir, 'dataset.yaml')
-            
-            # 确保模型可用
-            if model_type.startswith('yolo'):
-                model_path = self.ensure_model_available(model_type)
-                model = YOLO(model_path)
-            else:
-                raise ValueError(f"不支持的模型类型: {model_type}")
+            runs_dir = os.path.join(self.project_path, 'training_runs')
             
             # 获取最优设备
             optimal_device = self._get_optimal_device(config.get('device', 'auto'))
-            
-            # 设置训练参数
-            train_args = {
-                'data': dataset_yaml,
-                'epochs': config.get('epochs', 100),
-                'batch': config.get('batch_size', 16),
-                'imgsz': config.get('image_size', 640),
-                'lr0': config.get('learning_rate', 0.01),
-                'device': optimal_device,
-                'project': os.path.join(self.project_path, 'training_runs'),
-                'name': f"task_{task_id}",
-                'save_period': 10,  # 每10个epoch保存一次
-                'patience': 50,     # 早停耐心值
-                'verbose': True
-            }
-            
-            # 添加其他参数
-            if 'optimizer' in config and config['optimizer'] != 'auto':
-                train_args['optimizer'] = config['optimizer']
-            
-            # 自定义回调函数来监控训练进度
-            def on_train_epoch_end(trainer):
-                try:
-                    if self.stop_training:
-                        trainer.stop = True
-                        return
-                    
-                    epoch = trainer.epoch + 1  # YOLO的epoch从0开始，显示时+1
-                    total_epochs = trainer.epochs
-                    progress = int((epoch / total_epochs) * 100)
-                    
-                    # 更新进度
-                    self.training_task.update_task_status(task_id, 'running', progress)
-                    
-                    # 记录训练日志
-                    try:
-                        # 从训练器中提取损失值
-                        loss = None
-                        if hasattr(trainer, 'loss') and trainer.loss is not None:
-                            loss = float(trainer.loss.item()) if hasattr(trainer.loss, 'item') else float(trainer.loss)
-                        elif hasattr(trainer, 'losses') and trainer.losses:
-                            loss = float(trainer.losses[-1]) if trainer.losses else None
-                        elif hasattr(trainer, 'tloss') and trainer.tloss is not None:
-                            loss = float(trainer.tloss)
-                        
-                        # 记录训练进度到数据库
-                        if loss is not None:
-                            self.training_task.log_training_progress(task_id, epoch, loss)
-                            # 只在每5个epoch或最后一个epoch时输出日志
-                            if epoch % 5 == 0 or epoch == total_epochs:
-                                logger.info(f"📈 Epoch {epoch}/{total_epochs} | Loss: {loss:.4f} | Progress: {progress}%")
-                        else:
-                            # 只在每5个epoch或最后一个epoch时输出日志
-                            if epoch % 5 == 0 or epoch == total_epochs:
-                                logger.info(f"📈 Epoch {epoch}/{total_epochs} | Progress: {progress}%")
-                            
-                    except Exception as log_error:
-                        logger.warning(f"记录训练日志时出错: {log_error}")
-                        
-                except Exception as callback_error:
-                    logger.error(f"训练回调函数出错: {callback_error}")
-            
-            def on_train_end(trainer):
-                try:
-                    # 训练结束时的处理
-                    logger.info(f"✅ 训练任务 {task_id} 完成")
-                except Exception as e:
-                    logger.error(f"❌ 训练结束回调出错: {e}")
-            
-            # 添加回调
-            model.add_callback('on_train_epoch_end', on_train_epoch_end)
-            model.add_callback('on_train_end', on_train_end)
-            
-            # 开始训练
-            logger.info(f"🚀 开始训练任务 {task_id}")
-            logger.info(f"📊 模型: {model_type} | 设备: {optimal_device} | 轮数: {config.get('epochs', 100)}")
-            
-            # 临时重定向stdout来减少训练过程中的冗余输出
-            import sys
-            from io import StringIO
-            old_stdout = sys.stdout
-            sys.stdout = StringIO()
-            
-            try:
-                results = model.train(**train_args)
-            finally:
-                # 恢复stdout
-                sys.stdout = old_stdout
-            
-            if not self.stop_training:
-                # 训练完成，保存模型路径和指标
-                weights_dir = os.path.join(train_args['project'], train_args['name'], 'weights')
-                best_model_path = os.path.join(weights_dir, 'best.pt')
-                
-                # 检查模型文件是否生成
-                if not os.path.exists(best_model_path):
-                    # 如果 best.pt 不存在，尝试使用 last.pt
-                    last_model_path = os.path.join(weights_dir, 'last.pt')
-                    if os.path.exists(last_model_path):
-                        best_model_path = last_model_path
-                        logger.warning(f"⚠️ best.pt 不存在，使用 last.pt: {best_model_path}")
-                    else:
-                        logger.error(f"❌ 训练完成但没有找到模型文件: {weights_dir}")
-                        self.training_task.update_task_status(task_id, 'failed', None, "训练完成但模型文件丢失")
-                        return
-                
-                # 提取训练指标
-                metrics = {}
-                try:
-                    if hasattr(results, 'results_dict'):
-                        metrics = results.results_dict
-                    elif hasattr(results, 'maps') and results.maps:
-                        metrics = {'mAP50': float(results.maps[0])}
-                    elif hasattr(results, 'box') and hasattr(results.box, 'map50'):
-                        metrics = {
-                            'mAP50': float(results.box.map50),
-                            'mAP50-95': float(results.box.map) if hasattr(results.box, 'map') else 0.0
-                        }
-                    
-                    # 添加更多指标
-                    if hasattr(results, 'box'):
-                        if hasattr(results.box, 'mp'):
-                            metrics['precision'] = float(results.box.mp)
-                        if hasattr(results.box, 'mr'):
-                            metrics['recall'] = float(results.box.mr)
-                            
-                except Exception as metrics_error:
-                    logger.warning(f"⚠️ 提取训练指标时出错: {metrics_error}")
-                    metrics = {'note': '训练完成但指标提取失败'}
-                
-                self.training_task.update_task_status(
-                    task_id, 'completed', 100, 
-                    model_path=best_model_path, 
-                    metrics=metrics
-                )
-                
-                logger.info(f"🎯 训练任务 {task_id} 完成，模型保存在: {best_model_path}")
+
+            # 分配到的CPU线程预算由子进程在启动和每个epoch开始时应用
+            cpu_allocation = performance_manager.get_cpu_allocation(task_id)
+
+            checkpoint = self._resumable_checkpoint(task_id) if resume else None
+            if checkpoint:
+                # 检查点中保存了原始训练参数（轮数、学习率、保存目录等）和优化器状态，
+                # 只覆盖与当前机器相关的参数
+                model_path = checkpoint
+                train_args = {'resume': True, 'data': dataset_yaml, 'device': optimal_device}
             else:
+                # 确保模型可用
+                if model_type.startswith('yolo'):
+                    model_path = self.ensure_model_available(model_type)
+                else:
+                    raise ValueError(f"不支持的模型类型: {model_type}")
+                self.training_task.set_checkpoint(task_id, None)
+
+                # 设置训练参数
+                train_args = {
+                    'data': dataset_yaml,
+                    'epochs': config.get('epochs', 100),
+                    'batch': config.get('batch_size', 16),
+                    'imgsz': imgsz,
+                    'lr0': config.get('learning_rate', 0.01),
+                    'device': optimal_device,
+                    'project': runs_dir,
+                    'name': f"task_{task_id}",
+                    'save_period': 10,  # 每10个epoch保存一次
+                    'patience': 50,     # 早停耐心值
+                    'verbose': True
+                }
+                # 添加其他参数
+                if 'optimizer' in config and config['optimizer'] != 'auto':
+                    train_args['optimizer'] = config['optimizer']
+            if cpu_allocation:
+                train_args['workers'] = cpu_allocation['workers']
+            elif 'workers' in config:
+                train_args['workers'] = config['workers']
+
+            auto_batch = None
+            if not checkpoint and train_args['batch'] == 'auto':
+                if str(optimal_device).startswith('cuda'):
+                    # GPU 使用 ultralytics 自带的 AutoBatch（按显存占用比例选择）
+                    train_args['batch'] = -1
+                else:
+                    train_args['batch'] = performance_manager.get_optimal_batch_size(model_type, 'cpu')
+                    auto_batch = {'model_name': os.path.basename(model_path), 'max_workers': train_args.get('workers', 0)}
+
+            # 训练和验证集都会被缓存，按 Images 表中的尺寸估算解码后的大小
+            cache = config.get('cache', 'auto')
+            if cache == 'auto':
+                image_sizes = [(info['width'], info['height'])
+                               for split in ('train', 'val') for info in self.dataset_splits.get(split, [])]
+                cache = performance_manager.choose_cache_mode(task_id, image_sizes, imgsz, dataset_dir)
+            train_args['cache'] = cache
+
+            if auto_batch:
+                # 在子进程中按实际设备探测，预算扣除上面的缓存预占
+                train_images_dir = os.path.join(dataset_dir, 'train', 'images')
+                auto_batch.update({
+                    'cache_path': BATCH_FINDER_CACHE,
+                    'memory_budget': performance_manager.training_memory_budget(task_id),
+                    'image_paths': [os.path.join(train_images_dir, name) for name in sorted(os.listdir(train_images_dir))]
+                    if os.path.isdir(train_images_dir) else [],
+                    'fallback_batch': train_args['batch'],
+                })
+
+            if self.stop_training:
+                final_status = 'stopped'
+                self.training_task.update_task_status(task_id, 'stopped', None, "训练被用户停止")
+                return
+
+            # 启动训练子进程，输出写入任务日志文件
+            log_path = os.path.join(runs_dir, f"task_{task_id}.log")
+            self.training_process = TrainingProcess(model_path, train_args, log_path, cpu_allocation, auto_batch)
+            self.training_process.start()
+            if self.stop_training:
+                # 启动子进程期间收到了停止请求
+                self.training_process.stop()
+            
+            logger.info(f"🚀 {'从检查点继续' if checkpoint else '开始'}训练任务 {task_id}")
+            logger.info(f"📊 模型: {model_type} | 设备: {optimal_device} | 轮数: {config.get('epochs', 100)}")
+
+            applied_allocation = [cpu_allocation]
+
+            def push_cpu_budget():
+                # 其他任务启停后CPU预算会重新平衡，推送给子进程
+                allocation = performance_manager.get_cpu_allocation(task_id)
+                if allocation and allocation != applied_allocation[0]:
+                    applied_allocation[0] = allocation
+                    self.training_process.set_cpu_budget(allocation)
+
+            result = None
+            error = None
+            recorded_checkpoint = checkpoint
+            cache_loaded = False
+            metrics_hub.publish(metrics_key, 'status', {'status': 'running'})
+            for event in self.training_process.events(on_idle=push_cpu_budget):
+                if not cache_loaded and event['type'] in ('batch', 'epoch'):
+                    # 产生第一个批次之前数据集缓存已加载完成，其占用已体现在可用内存中
+                    cache_loaded = True
+                    performance_manager.mark_cache_loaded(task_id)
+                if event['type'] == 'batch_probe':
+                    logger.info(f"任务 {task_id} 自动批量: batch={event['batch']} workers={event['workers']}")
+                    metrics_hub.publish(metrics_key, 'batch_probe', self._event_data(event))
+                elif event['type'] == 'batch':
+                    metrics_hub.publish(metrics_key, 'batch', self._event_data(event))
+                elif event['type'] == 'epoch':
+                    self._record_epoch(task_id, event)
+                elif event['type'] == 'checkpoint':
+                    # last.pt 路径在一次训练中不变，只在首次出现时写库
+                    if event['path'] != recorded_checkpoint:
+                        recorded_checkpoint = event['path']
+                        self.training_task.set_checkpoint(task_id, recorded_checkpoint)
+                elif event['type'] == 'result':
+                    result = event
+                elif event['type'] == 'error':
+                    error = event['message']
+
+            if self.stop_training:
+                final_status = 'stopped'
                 self.training_task.update_task_status(task_id, 'stopped', None, "训练被用户停止")
                 logger.info(f"⏹️ 训练任务 {task_id} 被停止")
+                return
+            if result is None:
+                raise RuntimeError(error or f"训练进程异常退出 (exit code {self.training_process.exitcode})")
+
+            # 训练完成，保存模型路径和指标
+            save_dir = result['save_dir'] or os.path.join(runs_dir, f"task_{task_id}")
+            weights_dir = os.path.join(save_dir, 'weights')
+            best_model_path = os.path.join(weights_dir, 'best.pt')
+            
+            # 检查模型文件是否生成
+            if not os.path.exists(best_model_path):
+                # 如果 best.pt 不存在，尝试使用 last.pt
+                last_model_path = os.path.join(weights_dir, 'last.pt')
+                if os.path.exists(last_model_path):
+                    best_model_path = last_model_path
+                    logger.warning(f"⚠️ best.pt 不存在，使用 last.pt: {best_model_path}")
+                else:
+                    logger.error(f"❌ 训练完成但没有找到模型文件: {weights_dir}")
+                    self.training_task.update_task_status(task_id, 'failed', None, "训练完成但模型文件丢失")
+                    return
+            
+            self.training_task.update_task_status(
+                task_id, 'completed', 100, 
+                model_path=best_model_path, 
+                metrics=result['metrics']
+            )
+            final_status = 'completed'
+            logger.info(f"🎯 训练任务 {task_id} 完成，模型保存在: {best_model_path}")
                 
         except Exception as e:
             logger.error(f"❌ 训练过程出错: {e}")
             self.training_task.update_task_status(task_id, 'failed', None, str(e))
         finally:
-            # 确保任务在结束时被注销
+            # 写入剩余指标并通知订阅者任务已结束
+            metrics_hub.close(metrics_key, final_status)
+            # 确保任务在结束时被注销，并释放队列容量派发下一个任务
             performance_manager.unregister_task(task_id)
+            training_queue.finish(self.project_name, task_id, final_status)
+
+    @staticmethod
+    def _event_data(event):
+        return {k: v for k, v in event.items() if k != 'type'}
+
+    def _record_epoch(self, task_id, event):
+        """记录子进程上报的epoch指标：推送到指标流，由指标流批量写入数据库"""
+        try:
+            epoch = event['epoch']
+            total_epochs = event['epochs']
+            progress = int((epoch / total_epochs) * 100)
+            loss = event.get('loss')
+
+            # 更新进度
+            self.training_task.update_task_status(task_id, 'running', progress)
+            metrics_hub.publish((self.project_name, task_id), 'epoch', {**self._event_data(event), 'progress': progress})
+
+            # 只在每5个epoch或最后一个epoch时输出日志
+            if epoch % 5 == 0 or epoch == total_epochs:
+                loss_text = f" | Loss: {loss:.4f}" if loss is not None else ""
+                logger.info(f"📈 Epoch {epoch}/{total_epochs}{loss_text} | Progress: {progress}%")
+        except Exception as log_error:
+            logger.warning(f"记录训练日志时出错: {log_error}")
 
     def _check_and_fix_task_status(self, task_id):
         """检查并修复任务状态不一致问题"""
@@ -475,8 +576,12 @@ class TrainingEngine:
             # 状态不一致时自动修复
             if db_running and not thread_running:
                 logger.warning(f"检测到状态不一致，自动修复任务 {task_id}")
-                self.training_task.update_task_status(task_id, 'failed', None, "训练进程异常结束")
+                message = "训练进程异常结束"
+                if db_task.get('checkpoint_path'):
+                    message += "，可从检查点继续训练"
+                self.training_task.update_task_status(task_id, 'failed', None, message)
                 performance_manager.unregister_task(task_id)  # 清理性能管理器
+                training_queue.finish(self.project_name, task_id, 'failed', message)
                 return 'fixed', "状态已自动修复"
             
             return db_task['status'], None
@@ -506,6 +611,9 @@ class TrainingEngine:
             # 正常停止流程
             if self.current_task_id == task_id and self.training_thread and self.training_thread.is_alive():
                 self.stop_training = True
+                # 直接终止训练子进程，不必等到当前epoch结束
+                if self.training_process is not None:
+                    self.training_process.stop()
                 self.training_thread.join(timeout=30)  # 等待最多30秒
                 
                 # 从性能管理器中注销任务
@@ -519,6 +627,7 @@ class TrainingEngine:
                 logger.warning(f"强制修复任务 {task_id} 状态")
                 self.training_task.update_task_status(task_id, 'stopped', None, "强制停止")
                 performance_manager.unregister_task(task_id)
+                training_queue.finish(self.project_name, task_id, 'stopped')
                 return True
                 
         except Exception as e:
@@ -562,78 +671,33 @@ class TrainingEngine:
         """下载指定的预训练模型"""
         try:
             model_path = self._get_model_path(model_name)
-            
-            # 如果模型已存在，直接返回
-            if os.path.exists(model_path):
-                logger.info(f"模型 {model_name} 已存在: {model_path}")
+            filename = os.path.basename(model_path)
+
+            if model_name in MODEL_URLS:
+                # 共享权重存储负责加锁、续传和校验
+                model_path = weight_store.fetch(MODEL_URLS[model_name], filename, progress_callback=progress_callback)
+                logger.info(f"模型下载完成: {model_path}")
                 return model_path
-            
-            # 确保权重目录存在
-            os.makedirs(os.path.dirname(model_path), exist_ok=True)
-            
-            logger.info(f"开始下载模型: {model_name}")
-            
-            # 使用YOLO自动下载功能，但禁用进度条
-            import os
-            import sys
-            from io import StringIO
-            
-            # 临时重定向stdout来隐藏YOLO的下载进度
-            old_stdout = sys.stdout
-            sys.stdout = StringIO()
-            
-            try:
+
+            # 其他模型交给YOLO自动下载，同样持有文件锁避免并发写入
+            with weight_store.lock(filename):
+                if os.path.exists(model_path):
+                    logger.info(f"模型 {model_name} 已存在: {model_path}")
+                    return model_path
+                if weight_store.offline:
+                    raise FileNotFoundError(f"离线模式下缺少模型: {model_name}")
+
+                logger.info(f"开始下载模型: {model_name}")
                 model = YOLO(f"{model_name}.pt")
-                
-                # 将下载的模型移动到指定位置
-                if hasattr(model, 'ckpt_path') and os.path.exists(model.ckpt_path):
+                if hasattr(model, 'ckpt_path') and model.ckpt_path and os.path.exists(model.ckpt_path):
                     shutil.move(model.ckpt_path, model_path)
-                    logger.info(f"模型 {model_name} 下载完成: {model_path}")
+                    weight_store.register(filename)
                 else:
-                    # 如果YOLO没有自动下载，手动下载
-                    import requests
-                    
-                    # YOLO官方模型下载URL
-                    model_urls = {
-                        'yolov8n': 'https://github.com/ultralytics/assets/releases/download/v8.3.0/yolov8n.pt',
-                        'yolov8s': 'https://github.com/ultralytics/assets/releases/download/v8.3.0/yolov8s.pt',
-                        'yolov8m': 'https://github.com/ultralytics/assets/releases/download/v8.3.0/yolov8m.pt',
-                        'yolov8l': 'https://github.com/ultralytics/assets/releases/download/v8.3.0/yolov8l.pt',
-                        'yolov8x': 'https://github.com/ultralytics/assets/releases/download/v8.3.0/yolov8x.pt',
-                        'yolov10n': 'https://github.com/ultralytics/assets/releases/download/v0.1.0/yolo10n.pt',
-                        'yolov10s': 'https://github.com/ultralytics/assets/releases/download/v0.1.0/yolo10s.pt',
-                        'yolov10m': 'https://github.com/ultralytics/assets/releases/download/v0.1.0/yolo10m.pt',
-                        'yolov10l': 'https://github.com/ultralytics/assets/releases/download/v0.1.0/yolo10l.pt',
-                        'yolov10x': 'https://github.com/ultralytics/assets/releases/download/v0.1.0/yolo10x.pt'
-                    }
-                    
-                    if model_name in model_urls:
-                        url = model_urls[model_name]
-                        logger.info(f"开始下载模型 {model_name}...")
-                        response = requests.get(url, stream=True)
-                        response.raise_for_status()
-                        
-                        total_size = int(response.headers.get('content-length', 0))
-                        downloaded = 0
-                        
-                        with open(model_path, 'wb') as f:
-                            for chunk in response.iter_content(chunk_size=8192):
-                                if chunk:
-                                    f.write(chunk)
-                                    downloaded += len(chunk)
-                                    if progress_callback:
-                                        progress_callback(downloaded, total_size)
-                        
-                        logger.info(f"模型 {model_name} 下载完成 ({downloaded/1024/1024:.1f}MB)")
-                    else:
-                        raise ValueError(f"不支持的模型: {model_name}")
-            finally:
-                # 恢复stdout
-                sys.stdout = old_stdout
-            
+                    raise ValueError(f"不支持的模型: {model_name}")
+
             logger.info(f"模型下载完成: {model_path}")
             return model_path
-            
+
         except Exception as e:
             logger.error(f"下载模型失败: {e}")
             raise
@@ -746,9 +810,9 @@ class TrainingEngine:
                 'format': export_format
             }
 
-    def get_resource_usage(self):
-        """获取系统资源使用情况"""
-        return performance_manager.monitor_resources()
+    def get_resource_usage(self, history_seconds=None):
+        """获取系统资源使用情况，可附带最近 history_seconds 秒的采样历史"""
+        return performance_manager.monitor_resources(history_seconds)
 
     def get_performance_suggestions(self, model_type, current_config):
         """获取性能优化建议"""
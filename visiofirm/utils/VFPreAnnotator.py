@@ -9,10 +9,17 @@ import logging
 import networkx as nx
 import clip
 import os
-import requests
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from contextlib import contextmanager
 from groundingdino.util.inference import load_model, predict
 from groundingdino.datasets import transforms as T
-from visiofirm.config import WEIGHTS_FOLDER
+from visiofirm.config import WEIGHTS_FOLDER, PREANNOTATION_POOL_SIZE, PREANNOTATION_MASK_FORMAT, INFERENCE_MAX_BATCH_SIZE
+from visiofirm.utils.mask_utils import encode_rle, rle_bbox
+from visiofirm.utils.weight_store import weight_store
+from visiofirm.utils.performance_config import performance_manager
 from tqdm import tqdm
 
 os.makedirs(WEIGHTS_FOLDER, exist_ok=True)
@@ -22,37 +29,15 @@ logging.basicConfig(level=logging.WARNING)
 logger = logging.getLogger(__name__)
 
 def download_weight(url, filename):
-    """下载模型权重文件，显示进度条"""
-    path = os.path.join(WEIGHTS_FOLDER, filename)
-    if not os.path.exists(path):
-        print(f"正在下载模型 {filename}...")
-        
-        try:
-            # 获取文件大小
-            response = requests.head(url)
-            total_size = int(response.headers.get('content-length', 0))
-            
-            # 开始下载
-            r = requests.get(url, stream=True)
-            if r.status_code == 200:
-                with open(path, 'wb') as f:
-                    # 使用tqdm显示进度条
-                    with tqdm(total=total_size, unit='B', unit_scale=True, 
-                             desc=filename, ncols=80) as pbar:
-                        for chunk in r.iter_content(chunk_size=8192):
-                            if chunk:
-                                f.write(chunk)
-                                pbar.update(len(chunk))
-                print(f"✓ {filename} 下载完成")
-            else:
-                raise ValueError(f"下载失败: {url} (状态码: {r.status_code})")
-        except Exception as e:
-            if os.path.exists(path):
-                os.remove(path)  # 清理不完整的文件
-            raise ValueError(f"下载 {filename} 时出错: {e}")
-    else:
-        print(f"✓ {filename} 已存在，跳过下载")
-    return path
+    """下载模型权重文件，显示进度条（通过共享的权重存储，支持续传与校验）"""
+    if os.path.exists(weight_store.path_for(filename)):
+        return weight_store.fetch(url, filename)
+    with tqdm(unit='B', unit_scale=True, desc=filename, ncols=80) as pbar:
+        def update(downloaded, total):
+            pbar.total = total or None
+            pbar.n = downloaded
+            pbar.refresh()
+        return weight_store.fetch(url, filename, progress_callback=update)
 
 
 class ImageProcessor:
@@ -79,7 +64,8 @@ class ImageProcessor:
         self.sam2_autocast_dtype = sam2_autocast_dtype
         self.verbose = verbose
 
-        # Known model URLs for auto-download
+        # Known model URLs for auto-download; weight_store.fetch verifies them against
+        # WEIGHT_SHA256_PINS / pins.json, unpinned files are trust-on-first-use
         known_yolo_urls = {
             "yolov10n.pt": "https://github.com/ultralytics/assets/releases/download/v8.3.0/yolov10n.pt",
             "yolov10s.pt": "https://github.com/ultralytics/assets/releases/download/v8.3.0/yolov10s.pt",
@@ -87,7 +73,7 @@ class ImageProcessor:
             "yolov10l.pt": "https://github.com/ultralytics/assets/releases/download/v8.3.0/yolov10l.pt",
             "yolov10x.pt": "https://github.com/ultralytics/assets/releases/download/v8.3.0/yolov10x.pt",
         }
-        known_sam_urls = {
+        self.known_sam_urls = {
             "sam2.1_t.pt": "https://github.com/ultralytics/assets/releases/download/v8.3.0/sam2.1_t.pt",
         }
 
@@ -114,12 +100,19 @@ class ImageProcessor:
         else:
             raise ValueError(f"Invalid model_type: {model_type}. Choose 'yolo', 'grounding_dino_tiny', or 'grounding_dino_base'.")
 
-        # Download SAM if known
-        if self.sam2_model_path in known_sam_urls:
-            self.sam2_model_path = download_weight(known_sam_urls[self.sam2_model_path], self.sam2_model_path)
-        self.sam2_model = SAM(self.sam2_model_path)
-        if self.verbose:
-            self.sam2_model.info()
+        # SAM is only needed for segmentation, so it is loaded on first use
+        self._sam2_model = None
+
+    @property
+    def sam2_model(self):
+        if self._sam2_model is None:
+            # Download SAM if known
+            if self.sam2_model_path in self.known_sam_urls:
+                self.sam2_model_path = download_weight(self.known_sam_urls[self.sam2_model_path], self.sam2_model_path)
+            self._sam2_model = SAM(self.sam2_model_path)
+            if self.verbose:
+                self._sam2_model.info()
+        return self._sam2_model
 
     @staticmethod
     def _parse_classes(classes_str: str):
@@ -188,13 +181,42 @@ class ImageProcessor:
             "labels": combined_labels
         }
 
-    def _run_yolo(self, image, class_list, conf_threshold):
+    @staticmethod
+    def _yolo_class_mapping(class_list):
         clean_class_set = {c.replace("a ", "").replace("an ", "").strip().lower() for c in class_list}
         class_mapping = {}
         for user_class in class_list:
             user_class_clean = user_class.replace("a ", "").replace("an ", "").replace("photo of ", "").replace("picture of ", "").strip()
             class_mapping[user_class_clean.lower()] = user_class_clean
-        if any(keyword in self.yolo_model_path.lower() for keyword in ['yolo5', 'yolov5', 'y5', 'v5']):
+        return clean_class_set, class_mapping
+
+    def _is_yolov5(self):
+        return any(keyword in self.yolo_model_path.lower() for keyword in ['yolo5', 'yolov5', 'y5', 'v5'])
+
+    @staticmethod
+    def _parse_yolo_result(result, clean_class_set, class_mapping):
+        boxes = []
+        scores = []
+        labels = []
+        for box in result.boxes:
+            x1, y1, x2, y2 = box.xyxy[0]
+            conf = box.conf[0]
+            cls = box.cls[0]
+            class_name = result.names[int(cls)]
+            if class_name.lower() in clean_class_set:
+                user_class_name = class_mapping.get(class_name.lower(), class_name)
+                boxes.append([x1.item(), y1.item(), x2.item(), y2.item()])
+                scores.append(conf.item())
+                labels.append(user_class_name)
+        return {
+            "boxes": np.array(boxes, dtype=np.float32),
+            "scores": np.array(scores, dtype=np.float32),
+            "labels": labels
+        }
+
+    def _run_yolo(self, image, class_list, conf_threshold):
+        clean_class_set, class_mapping = self._yolo_class_mapping(class_list)
+        if self._is_yolov5():
             results = self.yolo_model(image)
             boxes = []
             scores = []
@@ -208,26 +230,18 @@ class ImageProcessor:
                         boxes.append([x1.item(), y1.item(), x2.item(), y2.item()])
                         scores.append(conf.item())
                         labels.append(user_class_name)
-        else:
-            results = self.yolo_model.predict(image, conf=conf_threshold)
-            boxes = []
-            scores = []
-            labels = []
-            for box in results[0].boxes:
-                x1, y1, x2, y2 = box.xyxy[0]
-                conf = box.conf[0]
-                cls = box.cls[0]
-                class_name = results[0].names[int(cls)]
-                if class_name.lower() in clean_class_set:
-                    user_class_name = class_mapping.get(class_name.lower(), class_name)
-                    boxes.append([x1.item(), y1.item(), x2.item(), y2.item()])
-                    scores.append(conf.item())
-                    labels.append(user_class_name)
-        return {
-            "boxes": np.array(boxes, dtype=np.float32),
-            "scores": np.array(scores, dtype=np.float32),
-            "labels": labels
-        }
+            return {
+                "boxes": np.array(boxes, dtype=np.float32),
+                "scores": np.array(scores, dtype=np.float32),
+                "labels": labels
+            }
+        results = self.yolo_model.predict(image, conf=conf_threshold)
+        return self._parse_yolo_result(results[0], clean_class_set, class_mapping)
+
+    def _run_yolo_batch(self, images, class_list, conf_threshold):
+        clean_class_set, class_mapping = self._yolo_class_mapping(class_list)
+        results = self.yolo_model.predict(images, conf=conf_threshold, verbose=self.verbose)
+        return [self._parse_yolo_result(r, clean_class_set, class_mapping) for r in results]
 
     def _run_sam2(self, image: Image.Image, boxes: np.ndarray) -> np.ndarray:
         if boxes.size == 0:
@@ -248,6 +262,25 @@ class ImageProcessor:
        
         return masks
 
+    def _finalize_result(self, image, result, mode, detect_seconds=0.0):
+        if isinstance(result["boxes"], torch.Tensor):
+            result["boxes"] = result["boxes"].cpu().numpy()
+        if isinstance(result["scores"], torch.Tensor):
+            result["scores"] = result["scores"].cpu().numpy()
+        boxes = result["boxes"]
+        scores = result["scores"]
+        labels = result["labels"]
+        timings = {"detect": detect_seconds}
+        if mode == "BoundingBox":
+            return {"boxes": boxes, "scores": scores, "labels": labels, "timings": timings}
+        elif mode == "Segmentation":
+            start = time.perf_counter()
+            masks = self._run_sam2(image, boxes)
+            timings["sam"] = time.perf_counter() - start
+            return {"boxes": boxes, "scores": scores, "labels": labels, "masks": masks, "timings": timings}
+        else:
+            raise ValueError(f"Invalid mode: {mode}. Choose 'BoundingBox' or 'Segmentation'.")
+
     def process_image(
         self,
         image: Image.Image,
@@ -261,29 +294,152 @@ class ImageProcessor:
         prompts, clean_labels = self._parse_classes(classes_str)
         if not prompts:
             raise ValueError("No valid class prompts found.")
+        start = time.perf_counter()
         if self.model_type in ["grounding_dino_tiny", "grounding_dino_base"]:
             result = self._run_grounding_dino(image, prompts, box_threshold, text_threshold)
         else:
             result = self._run_yolo(image, prompts, box_threshold)
-        if isinstance(result["boxes"], torch.Tensor):
-            result["boxes"] = result["boxes"].cpu().numpy()
-        if isinstance(result["scores"], torch.Tensor):
-            result["scores"] = result["scores"].cpu().numpy()
-        boxes = result["boxes"]
-        scores = result["scores"]
-        labels = result["labels"]
-        if mode == "BoundingBox":
-            return {"boxes": boxes, "scores": scores, "labels": labels}
-        elif mode == "Segmentation":
-            masks = self._run_sam2(image, boxes)
-            return {"boxes": boxes, "scores": scores, "labels": labels, "masks": masks}
-        else:
-            raise ValueError(f"Invalid mode: {mode}. Choose 'BoundingBox' or 'Segmentation'.")
+        return self._finalize_result(image, result, mode, time.perf_counter() - start)
+
+    def process_batch(
+        self,
+        images: list,
+        classes_str: str,
+        mode: str = "BoundingBox",
+        box_threshold: float = None,
+        text_threshold: float = None
+    ) -> list:
+        """Process several images sharing the same prompts; returns one result dict per image.
+
+        Ultralytics YOLO runs the whole list in a single forward pass. Grounding DINO
+        and torch.hub YOLOv5 models fall back to per-image inference.
+        """
+        if len(images) == 1 or self.model_type != "yolo" or self._is_yolov5():
+            return [
+                self.process_image(image, classes_str, mode, box_threshold, text_threshold)
+                for image in images
+            ]
+        box_threshold = box_threshold or self.box_threshold
+        prompts, clean_labels = self._parse_classes(classes_str)
+        if not prompts:
+            raise ValueError("No valid class prompts found.")
+        start = time.perf_counter()
+        results = self._run_yolo_batch(images, prompts, box_threshold)
+        detect_seconds = (time.perf_counter() - start) / len(images)
+        return [self._finalize_result(image, result, mode, detect_seconds) for image, result in zip(images, results)]
 
     def __call__(self, *args, **kwargs):
         return self.process_image(*args, **kwargs)
 
 
+class _PriorityGate:
+    """Serializes model access, letting priority (on-demand) callers cut in line."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._busy = False
+        self._waiting_priority = 0
+
+    @contextmanager
+    def acquire(self, priority=False):
+        with self._cond:
+            if priority:
+                self._waiting_priority += 1
+            try:
+                while self._busy or (not priority and self._waiting_priority > 0):
+                    self._cond.wait()
+            finally:
+                if priority:
+                    self._waiting_priority -= 1
+            self._busy = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._busy = False
+                self._cond.notify_all()
+
+
+class ModelPool:
+    """Keeps detection and CLIP models warm across pre-annotation runs.
+
+    Loading YOLO/Grounding DINO takes seconds, which is far too slow for
+    on-demand suggestions, so processors are cached by configuration and
+    evicted least-recently-used once more than ``max_models`` are resident.
+    All inference through the pool goes through a single gate so that
+    on-demand requests run before the next image of a background batch.
+
+    ``_lock`` only guards the caches; models are loaded outside it so a
+    cold load never delays a hit on a model that is already warm. Callers
+    asking for a model that is still loading wait on its future instead of
+    loading it a second time.
+    """
+
+    def __init__(self, max_models: int = PREANNOTATION_POOL_SIZE):
+        self.max_models = max(1, max_models)
+        self.gate = _PriorityGate()
+        self._lock = threading.Lock()
+        self._processors = OrderedDict()
+        self._clip_models = {}
+        self._loading = {}
+
+    def _get_or_load(self, cache, key, load):
+        with self._lock:
+            if key in cache:
+                if cache is self._processors:
+                    cache.move_to_end(key)
+                return cache[key]
+            future = self._loading.get(key)
+            owner = future is None
+            if owner:
+                future = self._loading[key] = Future()
+        if not owner:
+            return future.result()
+
+        try:
+            value = load()
+        except BaseException as e:
+            with self._lock:
+                del self._loading[key]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            del self._loading[key]
+            cache[key] = value
+            evicted = False
+            if cache is self._processors:
+                while len(cache) > self.max_models:
+                    evicted_key, _ = cache.popitem(last=False)
+                    evicted = True
+                    logger.info(f"Evicted pre-annotation model {evicted_key} from pool")
+        future.set_result(value)
+        if evicted and torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        return value
+
+    def get_processor(self, model_type, yolo_model_path, sam2_model_path, device, **kwargs):
+        key = (model_type.lower(), yolo_model_path, sam2_model_path, device)
+        return self._get_or_load(self._processors, key, lambda: ImageProcessor(
+            model_type=model_type,
+            yolo_model_path=yolo_model_path,
+            sam2_model_path=sam2_model_path,
+            device=device,
+            **kwargs
+        ))
+
+    def get_clip(self, device):
+        return self._get_or_load(self._clip_models, ("clip", device),
+                                 lambda: clip.load("ViT-B/32", device=device))
+
+    def clear(self):
+        with self._lock:
+            self._processors.clear()
+            self._clip_models.clear()
+
+
+model_pool = ModelPool()
+
+
 class PreAnnotator:
     def __init__(
         self,
@@ -294,17 +450,27 @@ class PreAnnotator:
         config_db_path: str = "config.db",
         box_threshold: float = 0.2,
         verbose: bool = False,
+        image_ids=None,
+        pool: ModelPool = None,
+        inference_client=None,
+        mask_format: str = PREANNOTATION_MASK_FORMAT,
     ):
         # Validate model type
         valid_models = ["yolo", "grounding_dino_tiny", "grounding_dino_base"]
         if model_type not in valid_models:
             raise ValueError(f"Invalid model_type: {model_type}. Choose from {valid_models}.")
+        if mask_format not in ("polygon", "rle"):
+            raise ValueError(f"Invalid mask_format: {mask_format}. Choose from ['polygon', 'rle'].")
        
         self.model_type = model_type
         self.device = device
         self.config_db_path = config_db_path
         self.box_threshold = box_threshold
         self.verbose = verbose
+        self.pool = pool or model_pool
+        self.inference_client = inference_client
+        # 'rle' keeps SAM masks lossless instead of simplifying them to polygons
+        self.mask_format = mask_format
         # Database connection
         self.conn = sqlite3.connect(self.config_db_path)
         cursor = self.conn.cursor()
@@ -326,27 +492,61 @@ class PreAnnotator:
             logger.warning("No classes found in Classes table. May lead to empty detections.")
         self.classes_str = ", ".join(self.classes)
        
-        # Load images
-        cursor.execute("SELECT image_id, absolute_path FROM Images")
+        # Load images (optionally restricted to a subset, e.g. the image being viewed)
+        if image_ids is None:
+            cursor.execute("SELECT image_id, absolute_path FROM Images")
+        else:
+            image_ids = list(image_ids)
+            placeholders = ", ".join("?" for _ in image_ids)
+            cursor.execute(f"SELECT image_id, absolute_path FROM Images WHERE image_id IN ({placeholders})", image_ids)
         self.images = cursor.fetchall()
         if not self.images:
             raise ValueError("No images found in Images table.")
        
-        # Initialize image processor
-        self.image_processor = ImageProcessor(
-            model_type=self.model_type,
-            yolo_model_path=yolo_model_path,
-            sam2_model_path=sam2_model_path,
-            device=self.device,
-            box_threshold=self.box_threshold,
-            verbose=self.verbose
-        )
-        # Load CLIP model for YOLO
-        if self.model_type == "yolo":
-            self.clip_model, self.clip_preprocess = clip.load("ViT-B/32", device=self.device)
+        self.processor_config = {
+            "model_type": self.model_type,
+            "yolo_model_path": yolo_model_path,
+            "sam2_model_path": sam2_model_path,
+            "device": self.device,
+            "verbose": self.verbose,
+        }
+        # Get a warm image processor from the pool, unless inference runs in the inference server process
+        if self.inference_client is None:
+            self.image_processor = self.pool.get_processor(box_threshold=self.box_threshold, **self.processor_config)
         else:
-            self.clip_model = None
-            self.clip_preprocess = None
+            self.image_processor = None
+        # CLIP (YOLO label disambiguation only) is loaded on first use
+        self._clip = None
+        # Cumulative wall time per pipeline stage, in seconds
+        self.stage_timings = defaultdict(float)
+
+    @contextmanager
+    def _timed(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stage_timings[stage] += time.perf_counter() - start
+
+    def get_stage_timings(self):
+        """Return cumulative seconds spent in decode/detect/cluster/clip/sam/contour/db_insert."""
+        return dict(self.stage_timings)
+
+    @property
+    def clip_model(self):
+        if self.model_type != "yolo":
+            return None
+        if self._clip is None:
+            self._clip = self.pool.get_clip(self.device)
+        return self._clip[0]
+
+    @property
+    def clip_preprocess(self):
+        if self.model_type != "yolo":
+            return None
+        if self._clip is None:
+            self._clip = self.pool.get_clip(self.device)
+        return self._clip[1]
 
     def _simplify_contour(self, contour, epsilon_factor=0.002):
         min_points_for_simplification = 15
@@ -381,169 +581,294 @@ class PreAnnotator:
     def get_best_label(self, cropped_image, candidate_labels):
         if self.clip_model is None or self.clip_preprocess is None:
             raise ValueError("CLIP model is not loaded; required for label verification.")
-        image_input = self.clip_preprocess(cropped_image).unsqueeze(0).to(self.device)
-        text_inputs = clip.tokenize(candidate_labels).to(self.device)
-        with torch.no_grad():
-            image_features = self.clip_model.encode_image(image_input)
-            text_features = self.clip_model.encode_text(text_inputs)
-            similarities = (image_features @ text_features.T).softmax(dim=-1)
+        with self._timed("clip"):
+            image_input = self.clip_preprocess(cropped_image).unsqueeze(0).to(self.device)
+            text_inputs = clip.tokenize(candidate_labels).to(self.device)
+            with torch.no_grad():
+                image_features = self.clip_model.encode_image(image_input)
+                text_features = self.clip_model.encode_text(text_inputs)
+                similarities = (image_features @ text_features.T).softmax(dim=-1)
         best_label_idx = similarities.argmax().item()
         return candidate_labels[best_label_idx]
 
-    def run_inferences(self):
+    def get_mode(self):
         # Map setup type to mode
         setup_to_mode = {
             "Bounding Box": "BoundingBox",
             "Segmentation": "Segmentation",
             "Oriented Bounding Box": "BoundingBox"
         }
-        mode = setup_to_mode.get(self.setup_type, "BoundingBox")
-        cursor = self.conn.cursor()
-        for image_id, image_path in self.images:
-            try:
-                # Skip if already annotated
-                cursor.execute("""
-                    SELECT EXISTS(
-                        SELECT 1 FROM Preannotations WHERE image_id = ?
-                    ) OR EXISTS(
-                        SELECT 1 FROM Annotations WHERE image_id = ?
+        return setup_to_mode.get(self.setup_type, "BoundingBox")
+
+    def _cluster_annotations(self, annotations, image=None, image_path=None):
+        # image may be None when inference ran remotely; it is only decoded if a CLIP crop is needed
+        # Cluster overlapping annotations
+        G = nx.Graph()
+        for i in range(len(annotations)):
+            for j in range(i + 1, len(annotations)):
+                if self.compute_iou(annotations[i]["box"], annotations[j]["box"]) > 0.9:
+                    G.add_edge(i, j)
+        clusters = list(nx.connected_components(G))
+        # Include singletons
+        all_indices = set(range(len(annotations)))
+        cluster_indices = set.union(*clusters) if clusters else set()
+        singletons = all_indices - cluster_indices
+        clusters.extend([{i} for i in singletons])
+        # Process clusters
+        kept_annotations = []
+        for cluster in clusters:
+            cluster_annotations = [annotations[i] for i in cluster]
+            if len(cluster) == 1:
+                kept_annotations.append(cluster_annotations[0])
+            else:
+                unique_labels = list(set(anno["label"] for anno in cluster_annotations))
+                if len(unique_labels) == 1:
+                    best_anno = max(cluster_annotations, key=lambda x: x["score"])
+                else:
+                    if image is None:
+                        with self._timed("decode"):
+                            image = Image.open(image_path).convert("RGB")
+                    cluster_boxes = [anno["box"] for anno in cluster_annotations]
+                    x1 = max(0, min(b[0] for b in cluster_boxes))
+                    y1 = max(0, min(b[1] for b in cluster_boxes))
+                    x2 = min(image.width, max(b[2] for b in cluster_boxes))
+                    y2 = min(image.height, max(b[3] for b in cluster_boxes))
+                    cropped_image = image.crop((x1, y1, x2, y2))
+                    best_label = self.get_best_label(cropped_image, unique_labels)
+                    candidates = [anno for anno in cluster_annotations if anno["label"] == best_label]
+                    best_anno = max(candidates, key=lambda x: x["score"])
+                kept_annotations.append(best_anno)
+        return kept_annotations
+
+    def _mask_to_polygon(self, mask):
+        mask_uint8 = (mask > 0).astype(np.uint8)
+        # Adaptive hole filling
+        max_iterations = 10
+        kernel_size = 5
+        mask_filled = mask_uint8.copy()
+        for _ in range(max_iterations):
+            kernel = np.ones((kernel_size, kernel_size), np.uint8)
+            mask_filled_new = cv2.morphologyEx(mask_filled, cv2.MORPH_CLOSE, kernel)
+            contours, hierarchy = cv2.findContours(
+                mask_filled_new,
+                cv2.RETR_CCOMP,
+                cv2.CHAIN_APPROX_SIMPLE
+            )
+            has_large_holes = False
+            if hierarchy is not None:
+                for i in range(len(contours)):
+                    if hierarchy[0][i][3] != -1:
+                        area = cv2.contourArea(contours[i])
+                        if area > 100:
+                            has_large_holes = True
+                            break
+            if not has_large_holes:
+                mask_filled = mask_filled_new
+                break
+            mask_filled = mask_filled_new
+            kernel_size += 2
+        contours, _ = cv2.findContours(mask_filled, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        if not contours:
+            return None
+        largest_contour = max(contours, key=cv2.contourArea)
+        return self._simplify_contour(largest_contour)
+
+    def _insert_annotations(self, cursor, image_id, image_path, kept_annotations, mode):
+        inserted_count = 0
+        for anno in kept_annotations:
+            if mode == "BoundingBox":
+                x, y, w, h = anno["box"][0], anno["box"][1], anno["box"][2] - anno["box"][0], anno["box"][3] - anno["box"][1]
+                if w > 0 and h > 0:
+                    cursor.execute(
+                        "INSERT INTO Preannotations (image_id, type, class_name, x, y, width, height, rotation, segmentation, confidence) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (image_id, 'rect', anno["label"], float(x), float(y), float(w), float(h), 0.0, None, float(anno["score"]))
                     )
-                """, (image_id, image_id))
-                if cursor.fetchone()[0]:
-                    logger.info(f"Skipping image {image_path} (image_id: {image_id}) as it already has preannotations or annotations.")
-                    continue
-                logger.info(f"Processing image: {image_path} (image_id: {image_id})")
+                    inserted_count += 1
+                else:
+                    logger.warning(f"Skipped invalid bounding box for {anno['label']} in {image_path}: w={w}, h={h}")
+            elif mode == "Segmentation" and self.mask_format == "rle":
+                rle = anno.get("rle")
+                x, y, w, h = rle_bbox(rle) if rle else (0, 0, 0, 0)
+                if w > 0:
+                    # 'mask' rows hold COCO RLE in segmentation; 'polygon' rows hold a flat point list
+                    cursor.execute(
+                        "INSERT INTO Preannotations (image_id, type, class_name, x, y, width, height, rotation, segmentation, confidence) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (image_id, 'mask', anno["label"], float(x), float(y), float(w), float(h), 0.0, json.dumps(rle), float(anno["score"]))
+                    )
+                    inserted_count += 1
+                else:
+                    logger.debug(f"Skipped empty mask for {anno['label']} in {image_path}")
+            elif mode == "Segmentation":
+                if anno["mask"].any():
+                    simplified = anno.get("polygon")
+                    if simplified:
+                        segmentation = json.dumps(simplified)
+                        cursor.execute(
+                            "INSERT INTO Preannotations (image_id, type, class_name, x, y, width, height, rotation, segmentation, confidence) "
+                            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                            (image_id, 'polygon', anno["label"], None, None, None, None, 0.0, segmentation, float(anno["score"]))
+                        )
+                        inserted_count += 1
+                    else:
+                        logger.debug(f"Skipped empty or invalid contour for {anno['label']} in {image_path}")
+                else:
+                    logger.debug(f"Skipped empty mask for {anno['label']} in {image_path}")
+        return inserted_count
+
+    def _already_annotated(self, cursor, image_id):
+        cursor.execute("""
+            SELECT EXISTS(
+                SELECT 1 FROM Preannotations WHERE image_id = ?
+            ) OR EXISTS(
+                SELECT 1 FROM Annotations WHERE image_id = ?
+            )
+        """, (image_id, image_id))
+        return bool(cursor.fetchone()[0])
+
+    def annotate_image(self, image_id, image_path, mode=None, skip_existing=True, replace_existing=False, priority=False):
+        """Run detection (and SAM for segmentation) on one image and store the results as preannotations.
+
+        Returns the number of inserted preannotations, or None if the image was skipped.
+        """
+        mode = mode or self.get_mode()
+        cursor = self.conn.cursor()
+        if skip_existing and self._already_annotated(cursor, image_id):
+            logger.info(f"Skipping image {image_path} (image_id: {image_id}) as it already has preannotations or annotations.")
+            return None
+        logger.info(f"Processing image: {image_path} (image_id: {image_id})")
+
+        # Process image; on-demand callers take priority over background batches
+        if self.inference_client is not None:
+            # The inference server decodes the image itself
+            image = None
+            results = self.inference_client.process_image(
+                image_path,
+                self.classes_str,
+                self.processor_config,
+                mode=mode,
+                box_threshold=self.box_threshold,
+                priority=priority
+            )
+        else:
+            with self._timed("decode"):
                 image = Image.open(image_path).convert("RGB")
-               
-                # Process image
+            with self.pool.gate.acquire(priority=priority):
                 results = self.image_processor.process_image(
                     image=image,
                     classes_str=self.classes_str,
                     mode=mode,
                     box_threshold=self.box_threshold
                 )
-                num_detections = len(results["scores"])
-                logger.info(f"Detected {num_detections} objects for image {image_path}")
-                # Map labels to original class names
-                class_lower_to_original = {cls.lower(): cls for cls in self.classes}
-                mapped_labels = []
-                for label in results["labels"]:
-                    label_lower = label.lower()
-                    mapped_labels.append(class_lower_to_original.get(label_lower, label))
-                    if label_lower not in class_lower_to_original:
-                        logger.warning(f"No matching class found for label '{label}' in {image_path}; using original label")
-                results["labels"] = mapped_labels
-                # Post-process annotations
-                if mode in ["BoundingBox", "Segmentation"]:
-                    boxes = results["boxes"]
-                    scores = results["scores"]
-                    labels = results["labels"]
-                    masks = results.get("masks", [None] * len(boxes))
-                    annotations = [
-                        {"box": boxes[i], "score": scores[i], "label": labels[i], "mask": masks[i]}
-                        for i in range(len(boxes))
-                    ]
-                    if self.model_type == "yolo":
-                        # Cluster overlapping annotations
-                        G = nx.Graph()
-                        for i in range(len(annotations)):
-                            for j in range(i + 1, len(annotations)):
-                                if self.compute_iou(annotations[i]["box"], annotations[j]["box"]) > 0.9:
-                                    G.add_edge(i, j)
-                        clusters = list(nx.connected_components(G))
-                        # Include singletons
-                        all_indices = set(range(len(annotations)))
-                        cluster_indices = set.union(*clusters) if clusters else set()
-                        singletons = all_indices - cluster_indices
-                        clusters.extend([{i} for i in singletons])
-                        # Process clusters
-                        kept_annotations = []
-                        for cluster in clusters:
-                            cluster_annotations = [annotations[i] for i in cluster]
-                            if len(cluster) == 1:
-                                kept_annotations.append(cluster_annotations[0])
-                            else:
-                                unique_labels = list(set(anno["label"] for anno in cluster_annotations))
-                                if len(unique_labels) == 1:
-                                    best_anno = max(cluster_annotations, key=lambda x: x["score"])
-                                else:
-                                    cluster_boxes = [anno["box"] for anno in cluster_annotations]
-                                    x1 = max(0, min(b[0] for b in cluster_boxes))
-                                    y1 = max(0, min(b[1] for b in cluster_boxes))
-                                    x2 = min(image.width, max(b[2] for b in cluster_boxes))
-                                    y2 = min(image.height, max(b[3] for b in cluster_boxes))
-                                    cropped_image = image.crop((x1, y1, x2, y2))
-                                    best_label = self.get_best_label(cropped_image, unique_labels)
-                                    candidates = [anno for anno in cluster_annotations if anno["label"] == best_label]
-                                    best_anno = max(candidates, key=lambda x: x["score"])
-                                kept_annotations.append(best_anno)
+        return self._store_results(image_id, image_path, results, mode, image=image, replace_existing=replace_existing)
+
+    def _store_results(self, image_id, image_path, results, mode, image=None, replace_existing=False):
+        """Post-process one image's detections and insert them as preannotations."""
+        cursor = self.conn.cursor()
+        for stage, seconds in results.pop("timings", {}).items():
+            self.stage_timings[stage] += seconds
+        num_detections = len(results["scores"])
+        logger.info(f"Detected {num_detections} objects for image {image_path}")
+        # Map labels to original class names
+        class_lower_to_original = {cls.lower(): cls for cls in self.classes}
+        mapped_labels = []
+        for label in results["labels"]:
+            label_lower = label.lower()
+            mapped_labels.append(class_lower_to_original.get(label_lower, label))
+            if label_lower not in class_lower_to_original:
+                logger.warning(f"No matching class found for label '{label}' in {image_path}; using original label")
+        results["labels"] = mapped_labels
+        # Post-process annotations
+        boxes = results["boxes"]
+        scores = results["scores"]
+        labels = results["labels"]
+        masks = results.get("masks", [None] * len(boxes))
+        annotations = [
+            {"box": boxes[i], "score": scores[i], "label": labels[i], "mask": masks[i]}
+            for i in range(len(boxes))
+        ]
+        if self.model_type == "yolo":
+            nested_before = self.stage_timings["clip"] + self.stage_timings["decode"]
+            with self._timed("cluster"):
+                kept_annotations = self._cluster_annotations(annotations, image, image_path)
+            # CLIP disambiguation (and a deferred decode) are reported as their own stages
+            self.stage_timings["cluster"] -= self.stage_timings["clip"] + self.stage_timings["decode"] - nested_before
+        else:
+            kept_annotations = annotations
+        if mode == "Segmentation":
+            with self._timed("contour"):
+                for anno in kept_annotations:
+                    if self.mask_format == "rle":
+                        anno["rle"] = encode_rle(anno["mask"])
                     else:
-                        kept_annotations = annotations
-                    # Insert annotations into database
-                    inserted_count = 0
-                    for anno in kept_annotations:
-                        if mode == "BoundingBox":
-                            x, y, w, h = anno["box"][0], anno["box"][1], anno["box"][2] - anno["box"][0], anno["box"][3] - anno["box"][1]
-                            if w > 0 and h > 0:
-                                cursor.execute(
-                                    "INSERT INTO Preannotations (image_id, type, class_name, x, y, width, height, rotation, segmentation, confidence) "
-                                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
-                                    (image_id, 'rect', anno["label"], float(x), float(y), float(w), float(h), 0.0, None, float(anno["score"]))
-                                )
-                                inserted_count += 1
-                            else:
-                                logger.warning(f"Skipped invalid bounding box for {anno['label']} in {image_path}: w={w}, h={h}")
-                        elif mode == "Segmentation":
-                            if anno["mask"].any():
-                                mask_uint8 = (anno["mask"] > 0).astype(np.uint8)
-                                # Adaptive hole filling
-                                max_iterations = 10
-                                kernel_size = 5
-                                mask_filled = mask_uint8.copy()
-                                for _ in range(max_iterations):
-                                    kernel = np.ones((kernel_size, kernel_size), np.uint8)
-                                    mask_filled_new = cv2.morphologyEx(mask_filled, cv2.MORPH_CLOSE, kernel)
-                                    contours, hierarchy = cv2.findContours(
-                                        mask_filled_new,
-                                        cv2.RETR_CCOMP,
-                                        cv2.CHAIN_APPROX_SIMPLE
-                                    )
-                                    has_large_holes = False
-                                    if hierarchy is not None:
-                                        for i in range(len(contours)):
-                                            if hierarchy[0][i][3] != -1:
-                                                area = cv2.contourArea(contours[i])
-                                                if area > 100:
-                                                    has_large_holes = True
-                                                    break
-                                    if not has_large_holes:
-                                        mask_filled = mask_filled_new
-                                        break
-                                    mask_filled = mask_filled_new
-                                    kernel_size += 2
-                                contours, _ = cv2.findContours(mask_filled, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-                                if contours:
-                                    largest_contour = max(contours, key=cv2.contourArea)
-                                    simplified = self._simplify_contour(largest_contour)
-                                    if simplified:
-                                        segmentation = json.dumps(simplified)
-                                        cursor.execute(
-                                            "INSERT INTO Preannotations (image_id, type, class_name, x, y, width, height, rotation, segmentation, confidence) "
-                                            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
-                                            (image_id, 'polygon', anno["label"], None, None, None, None, 0.0, segmentation, float(anno["score"]))
-                                        )
-                                        inserted_count += 1
-                                    else:
-                                        logger.debug(f"Skipped invalid simplified contour for {anno['label']} in {image_path}")
-                                else:
-                                    logger.debug(f"Skipped empty contours for {anno['label']} in {image_path}")
-                            else:
-                                logger.debug(f"Skipped empty mask for {anno['label']} in {image_path}")
-                    self.conn.commit()
-                    logger.info(f"Inserted {inserted_count} unique annotations for image {image_path}")
-            except Exception as e:
-                logger.error(f"Error processing image {image_path}: {str(e)}")
-                continue
+                        anno["polygon"] = self._mask_to_polygon(anno["mask"]) if anno["mask"].any() else None
+        # Insert annotations into database
+        with self._timed("db_insert"):
+            if replace_existing:
+                cursor.execute("DELETE FROM Preannotations WHERE image_id = ?", (image_id,))
+            inserted_count = self._insert_annotations(cursor, image_id, image_path, kept_annotations, mode)
+            self.conn.commit()
+        logger.info(f"Inserted {inserted_count} unique annotations for image {image_path}")
+        return inserted_count
+
+    def run_inferences(self):
+        mode = self.get_mode()
+        # Share CPU cores with concurrent training jobs instead of oversubscribing them
+        job_id = f"preannotation:{self.config_db_path}:{id(self)}"
+        # Local inference shares this process's torch thread pool; remote inference runs in the server process
+        performance_manager.allocate_cpu(job_id, kind="preannotation", in_process=self.inference_client is None)
+        try:
+            if self.inference_client is not None:
+                self._run_remote_inferences(mode)
+                return
+            for image_id, image_path in self.images:
+                try:
+                    self.annotate_image(image_id, image_path, mode=mode)
+                except Exception as e:
+                    logger.error(f"Error processing image {image_path}: {str(e)}")
+                    continue
+        finally:
+            performance_manager.release_cpu(job_id)
+
+    def _run_remote_inferences(self, mode):
+        """Keep a window of images in flight so the inference server can form full micro-batches.
+
+        Two batches' worth of requests are outstanding: one being processed and one queued behind it.
+        Results are stored as they finish, in this thread, since the sqlite connection is not shared.
+        """
+        window = max(1, INFERENCE_MAX_BATCH_SIZE * 2)
+        cursor = self.conn.cursor()
+        pending = iter(self.images)
+        in_flight = {}
+        while True:
+            while len(in_flight) < window:
+                item = next(pending, None)
+                if item is None:
+                    break
+                image_id, image_path = item
+                if self._already_annotated(cursor, image_id):
+                    logger.info(f"Skipping image {image_path} (image_id: {image_id}) as it already has preannotations or annotations.")
+                    continue
+                try:
+                    future = self.inference_client.submit(
+                        image_path, self.classes_str, self.processor_config, mode=mode, box_threshold=self.box_threshold
+                    )
+                except Exception as e:
+                    logger.error(f"Error submitting image {image_path}: {str(e)}")
+                    continue
+                in_flight[future] = item
+            if not in_flight:
+                return
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                image_id, image_path = in_flight.pop(future)
+                try:
+                    self._store_results(image_id, image_path, future.result(), mode)
+                except Exception as e:
+                    logger.error(f"Error processing image {image_path}: {str(e)}")
 
     def __del__(self):
-        self.conn.close()
\ No newline at end of file
+        conn = getattr(self, "conn", None)
+        if conn is not None:
+            conn.close()
@@ -0,0 +1,191 @@
+"""
+导出归档写入器
+根据条目类型选择压缩方式，支持 zip、tar、普通目录以及硬链接目录四种输出
+"""
+
+import errno
+import logging
+import os
+import io
+import shutil
+import tarfile
+import time
+import zipfile
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_FORMATS = ('zip', 'tar', 'dir', 'link')
+
+# 直接落盘为目录布局的格式
+DIRECTORY_FORMATS = ('dir', 'link')
+
+ARCHIVE_EXTENSIONS = {'zip': '.zip', 'tar': '.tar', 'dir': '', 'link': ''}
+
+ARCHIVE_MIMETYPES = {'zip': 'application/zip', 'tar': 'application/x-tar'}
+
+# 已压缩的图像/容器格式，再次 deflate 只会浪费 CPU
+STORED_EXTENSIONS = {
+    '.jpg', '.jpeg', '.png', '.webp', '.avif', '.gif', '.heic', '.heif',
+    '.jp2', '.jxl', '.zip', '.tar', '.gz', '.tgz', '.bz2', '.xz', '.zst', '.7z',
+    '.mp4', '.mkv', '.webm', '.parquet'
+}
+
+COPY_WORKERS = min(8, (os.cpu_count() or 1) + 4)
+
+# Linux FICLONE ioctl，btrfs/XFS 等支持写时复制的文件系统上可共享数据块
+_FICLONE = 0x40049409
+
+# 硬链接失败时应回退而不是报错的错误码（跨文件系统、不支持、链接数上限）
+_LINK_FALLBACK_ERRNOS = {errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP, errno.EOPNOTSUPP}
+
+
+def compression_for(arcname):
+    """返回条目应使用的压缩方式：已压缩格式直接存储，其余 deflate"""
+    ext = os.path.splitext(arcname)[1].lower()
+    return zipfile.ZIP_STORED if ext in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+
+
+def _to_bytes(data):
+    return data.encode('utf-8') if isinstance(data, str) else data
+
+
+def _reflink(src, dst):
+    if fcntl is None:
+        raise OSError(errno.ENOTSUP, 'reflink not supported on this platform')
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+        except OSError:
+            fdst.close()
+            os.unlink(dst)
+            raise
+
+
+def link_or_copy(src, dst):
+    """
+    以最廉价的方式把 src 放到 dst：硬链接 → reflink → 复制
+
+    Returns:
+        str: 实际使用的方式，'link'、'reflink' 或 'copy'
+    """
+    if os.path.lexists(dst):
+        os.unlink(dst)
+    try:
+        os.link(src, dst)
+        return 'link'
+    except OSError as e:
+        if e.errno not in _LINK_FALLBACK_ERRNOS:
+            raise
+    try:
+        _reflink(src, dst)
+        return 'reflink'
+    except OSError:
+        pass
+    shutil.copy2(src, dst)
+    return 'copy'
+
+
+class ZipArchiveWriter:
+    """zip 输出：图像存储不压缩，文本条目 deflate"""
+
+    def __init__(self, output, compresslevel=6):
+        self._zip = zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED, compresslevel=compresslevel)
+
+    def write(self, path, arcname):
+        self._zip.write(path, arcname, compress_type=compression_for(arcname))
+
+    def writestr(self, arcname, data):
+        self._zip.writestr(arcname, data, compress_type=compression_for(arcname))
+
+    def close(self):
+        self._zip.close()
+
+
+class TarArchiveWriter:
+    """未压缩的 tar 输出，不可寻址的输出对象使用流模式"""
+
+    def __init__(self, output):
+        if isinstance(output, (str, os.PathLike)):
+            self._tar = tarfile.open(output, mode='w')
+        else:
+            self._tar = tarfile.open(fileobj=output, mode='w|')
+
+    def write(self, path, arcname):
+        self._tar.add(path, arcname=arcname, recursive=False)
+
+    def writestr(self, arcname, data):
+        data = _to_bytes(data)
+        info = tarfile.TarInfo(arcname)
+        info.size = len(data)
+        info.mtime = int(time.time())
+        self._tar.addfile(info, io.BytesIO(data))
+
+    def close(self):
+        self._tar.close()
+
+
+class DirectoryArchiveWriter:
+    """
+    写入普通目录，图像复制由线程池并行完成
+
+    link=True 时图像以硬链接放入目录（跨文件系统时回退到 reflink 或复制），
+    只有标签文件真正写入数据。注意硬链接与源图像共享内容，原地修改会互相影响。
+    """
+
+    def __init__(self, output, max_workers=COPY_WORKERS, link=False):
+        if not isinstance(output, (str, os.PathLike)):
+            raise ValueError("Directory export requires an output path")
+        self.root = os.fspath(output)
+        os.makedirs(self.root, exist_ok=True)
+        self.link = link
+        self._place = link_or_copy if link else shutil.copy2
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='export-copy')
+        self._futures = []
+
+    def _target(self, arcname):
+        target = os.path.normpath(os.path.join(self.root, arcname))
+        if os.path.commonpath([self.root, target]) != os.path.normpath(self.root):
+            raise ValueError(f"Entry escapes export directory: {arcname}")
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        return target
+
+    def write(self, path, arcname):
+        self._futures.append(self._executor.submit(self._place, path, self._target(arcname)))
+
+    def writestr(self, arcname, data):
+        with open(self._target(arcname), 'wb') as f:
+            f.write(_to_bytes(data))
+
+    def close(self):
+        try:
+            methods = [future.result() for future in self._futures]
+            if self.link and methods:
+                logger.info(f"Linked {methods.count('link')}, reflinked {methods.count('reflink')}, "
+                            f"copied {methods.count('copy')} files into {self.root}")
+        finally:
+            self._futures = []
+            self._executor.shutdown(wait=True)
+
+
+@contextmanager
+def open_archive(output, archive_format='zip'):
+    """按格式打开归档写入器，退出时关闭（目录输出会等待复制线程结束）"""
+    if archive_format == 'zip':
+        writer = ZipArchiveWriter(output)
+    elif archive_format == 'tar':
+        writer = TarArchiveWriter(output)
+    elif archive_format in DIRECTORY_FORMATS:
+        writer = DirectoryArchiveWriter(output, link=archive_format == 'link')
+    else:
+        raise ValueError(f"Unsupported archive format: {archive_format}")
+    try:
+        yield writer
+    finally:
+        writer.close()
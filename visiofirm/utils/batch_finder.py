@@ -0,0 +1,324 @@
+"""
+批量大小与数据加载进程数探测模块
+在实际设备上以递增的批量大小运行几次前向/反向传播，测量吞吐量和峰值内存，
+再测量不同 worker 数下的图像解码吞吐量，在任务内存预算内选出最佳组合；
+结果按 (模型, imgsz, 机器) 缓存，同一环境下不重复探测。
+"""
+
+import gc
+import json
+import logging
+import os
+import platform
+import threading
+import time
+
+import cv2
+import numpy as np
+import psutil
+import torch
+
+from visiofirm.config import (BATCH_FINDER_CACHE, BATCH_FINDER_BATCH_SIZES, BATCH_FINDER_STEPS,
+                              BATCH_FINDER_LOADER_HEADROOM)
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 ** 2
+
+# 吞吐量相差不超过该比例时选择更大的批量（梯度估计更稳定）
+THROUGHPUT_TOLERANCE = 0.05
+
+
+def machine_key(device):
+    """标识探测结果适用的环境：CPU 线程数、内存、设备型号和 torch 版本都会影响结果"""
+    parts = [platform.machine(), f'{torch.get_num_threads()}threads',
+             f'{round(psutil.virtual_memory().total / 1024 ** 3)}GB', f'torch{torch.__version__}']
+    if str(device).startswith('cuda') and torch.cuda.is_available():
+        parts.append(torch.cuda.get_device_name(torch.device(device)))
+    else:
+        parts.append(platform.processor() or 'cpu')
+    return '|'.join(parts)
+
+
+class _PeakRss:
+    """在后台线程中采样当前进程的 RSS，记录峰值"""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.process = psutil.Process(os.getpid())
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self.process.memory_info().rss)
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = self.process.memory_info().rss
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.process.memory_info().rss)
+
+
+def _pseudo_loss(outputs):
+    """把模型训练模式下的输出（张量、列表或字典）归约为标量，用于反向传播"""
+    if isinstance(outputs, torch.Tensor):
+        return outputs.float().mean()
+    if isinstance(outputs, dict):
+        outputs = list(outputs.values())
+    if isinstance(outputs, (list, tuple)):
+        losses = [_pseudo_loss(o) for o in outputs]
+        losses = [loss for loss in losses if loss is not None]
+        return sum(losses) if losses else None
+    return None
+
+
+def probe_batch_sizes(model, imgsz, device, memory_budget, batch_sizes=BATCH_FINDER_BATCH_SIZES, steps=BATCH_FINDER_STEPS):
+    """
+    以递增的批量大小测量训练吞吐量和峰值内存
+
+    按上一档的内存增量线性外推，预计超出预算的批量不再尝试；内存不足时停止。
+
+    Args:
+        model: torch.nn.Module（例如 YOLO(...).model）
+        memory_budget: 训练可用的内存字节数（CPU 为进程 RSS 增量，CUDA 为显存峰值）
+    Returns:
+        list: [{'batch', 'imgs_per_sec', 'peak_mb', 'fits'}, ...]
+    """
+    device = torch.device(device)
+    cuda = device.type == 'cuda'
+    model = model.to(device).train()
+    for param in model.parameters():
+        param.requires_grad_(True)
+    optimizer = torch.optim.SGD(model.parameters(), lr=1e-6, momentum=0.9)
+
+    # CPU 上释放的内存通常仍留在进程中被下一档复用，因此以探测前的 RSS 为基准，
+    # 峰值增量包含了到当前批量为止所需的全部工作内存
+    rss_baseline = psutil.Process(os.getpid()).memory_info().rss
+    results = []
+    for batch in batch_sizes:
+        if results:
+            previous = results[-1]
+            projected = previous['peak_mb'] * MB * batch / previous['batch']
+            if projected > memory_budget:
+                break
+        gc.collect()
+        if cuda:
+            torch.cuda.empty_cache()
+            torch.cuda.reset_peak_memory_stats(device)
+            baseline = torch.cuda.memory_allocated(device)
+        else:
+            baseline = rss_baseline
+
+        try:
+            images = torch.rand(batch, 3, imgsz, imgsz, device=device)
+            with _PeakRss() as rss:
+                elapsed = 0.0
+                for step in range(steps + 1):
+                    start = time.perf_counter()
+                    loss = _pseudo_loss(model(images))
+                    loss.backward()
+                    optimizer.step()
+                    optimizer.zero_grad(set_to_none=True)
+                    if cuda:
+                        torch.cuda.synchronize(device)
+                    if step:  # 第一步为预热
+                        elapsed += time.perf_counter() - start
+            peak = (torch.cuda.max_memory_allocated(device) if cuda else rss.peak) - baseline
+        except (RuntimeError, MemoryError) as e:
+            # CUDA OOM 和 CPU 分配失败都视为超出预算
+            logger.info(f"批量 {batch} 探测失败: {e}")
+            break
+        finally:
+            images = loss = None
+
+        result = {
+            'batch': batch,
+            'imgs_per_sec': round(batch * steps / elapsed, 2) if elapsed > 0 else 0.0,
+            'peak_mb': round(max(peak, 0) / MB, 1),
+        }
+        result['fits'] = result['peak_mb'] * MB <= memory_budget
+        results.append(result)
+        logger.info(f"批量探测: {result}")
+        if not result['fits']:
+            break
+    optimizer.zero_grad(set_to_none=True)
+    return results
+
+
+def choose_batch(results, memory_budget):
+    """在预算内选择吞吐量最高的批量；吞吐量接近时取更大的批量"""
+    fitting = [r for r in results if r['peak_mb'] * MB <= memory_budget]
+    if not fitting:
+        return None
+    best = max(r['imgs_per_sec'] for r in fitting)
+    return max((r for r in fitting if r['imgs_per_sec'] >= best * (1 - THROUGHPUT_TOLERANCE)), key=lambda r: r['batch'])
+
+
+class _DecodeDataset(torch.utils.data.Dataset):
+    """按训练尺寸解码并缩放图像，近似数据加载进程的工作量"""
+
+    def __init__(self, image_paths, imgsz, length):
+        self.image_paths = image_paths
+        self.imgsz = imgsz
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        image = cv2.imread(self.image_paths[index % len(self.image_paths)])
+        if image is None:
+            image = np.zeros((self.imgsz, self.imgsz, 3), dtype=np.uint8)
+        height, width = image.shape[:2]
+        ratio = self.imgsz / max(height, width)
+        if ratio != 1:
+            image = cv2.resize(image, (max(1, round(width * ratio)), max(1, round(height * ratio))),
+                               interpolation=cv2.INTER_LINEAR)
+        canvas = np.full((self.imgsz, self.imgsz, 3), 114, dtype=np.uint8)
+        canvas[:image.shape[0], :image.shape[1]] = image
+        return torch.from_numpy(canvas).permute(2, 0, 1)
+
+
+def worker_candidates(max_workers):
+    return sorted({0, 1, 2, 4, 8, max_workers} & set(range(max_workers + 1)))
+
+
+def probe_workers(image_paths, imgsz, batch, max_workers, batches=4):
+    """
+    测量不同 worker 数下的数据加载吞吐量
+
+    Returns:
+        list: [{'workers', 'imgs_per_sec'}, ...]
+    """
+    results = []
+    if not image_paths:
+        return results
+    for workers in worker_candidates(max_workers):
+        dataset = _DecodeDataset(image_paths, imgsz, batch * (batches + 1))
+        loader = torch.utils.data.DataLoader(dataset, batch_size=batch, num_workers=workers)
+        iterator = iter(loader)
+        next(iterator)  # 第一批包含启动 worker 进程的开销
+        start = time.perf_counter()
+        count = sum(len(images) for images in iterator)
+        elapsed = time.perf_counter() - start
+        del iterator, loader
+        results.append({'workers': workers, 'imgs_per_sec': round(count / elapsed, 2) if elapsed > 0 else 0.0})
+        logger.info(f"数据加载探测: {results[-1]}")
+    return results
+
+
+def choose_workers(results, train_imgs_per_sec, max_workers):
+    """
+    选择能跟上训练速度的最少 worker 数
+
+    实际训练还包含 mosaic 等增强，要求加载吞吐量达到训练吞吐量的 BATCH_FINDER_LOADER_HEADROOM 倍；
+    都达不到时取吞吐量最高的 worker 数。
+    """
+    results = [r for r in results if r['workers'] <= max_workers]
+    if not results:
+        return min(max_workers, 2)
+    target = train_imgs_per_sec * BATCH_FINDER_LOADER_HEADROOM
+    for result in sorted(results, key=lambda r: r['workers']):
+        if result['imgs_per_sec'] >= target:
+            return result['workers']
+    return max(results, key=lambda r: r['imgs_per_sec'])['workers']
+
+
+class BatchFinder:
+    """
+    批量大小和 worker 数探测器，结果缓存在 JSON 文件中
+
+    Args:
+        cache_path: 缓存文件路径，默认 BATCH_FINDER_CACHE
+    """
+
+    def __init__(self, cache_path=BATCH_FINDER_CACHE):
+        self.cache_path = cache_path
+
+    def _load(self):
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self, key, entry):
+        # 多个训练进程可能同时写入，先读取最新内容再原子替换
+        data = self._load()
+        data[key] = entry
+        os.makedirs(os.path.dirname(self.cache_path) or '.', exist_ok=True)
+        temp_path = f'{self.cache_path}.{os.getpid()}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2)
+        os.replace(temp_path, self.cache_path)
+
+    @staticmethod
+    def cache_key(model_name, imgsz, device):
+        return f'{model_name}|{imgsz}|{machine_key(device)}'
+
+    @staticmethod
+    def _probe(model, imgsz, device, memory_budget):
+        # 记录探测时的预算，之后预算变大时据此判断是否需要重新探测
+        return {'batches': probe_batch_sizes(model, imgsz, device, memory_budget), 'workers': None,
+                'budget': memory_budget}
+
+    @staticmethod
+    def _needs_larger_probe(entry, memory_budget):
+        """缓存的探测在最大批量之前停止，且当前预算大于探测时的预算（旧缓存没有记录预算时同样视为更大）"""
+        batches = entry['batches']
+        truncated = not batches or batches[-1]['batch'] < max(BATCH_FINDER_BATCH_SIZES) or not batches[-1]['fits']
+        budget = entry.get('budget')
+        return truncated and (budget is None or memory_budget > budget)
+
+    def find(self, model, model_name, imgsz, device, memory_budget, image_paths, max_workers):
+        """
+        返回预算内的最佳配置
+
+        缓存中已有该 (模型, imgsz, 机器) 的探测结果时直接按当前预算重新选择，不再运行模型；
+        缓存的探测因预算较小而提前停止、当前预算更大时重新探测，以便尝试更大的批量。
+
+        Args:
+            model: torch.nn.Module，仅在需要探测时使用
+            model_name: 缓存键中的模型名（如 yolov8n.pt）
+            memory_budget: 训练可用的内存字节数
+            image_paths: 训练图像，用于测量数据加载吞吐量
+            max_workers: CPU 预算允许的最大 worker 数
+        Returns:
+            dict: {'batch', 'workers', 'imgs_per_sec', 'peak_mb', 'cached'}，没有可用批量时返回 None
+        """
+        key = self.cache_key(model_name, imgsz, device)
+        entry = self._load().get(key)
+        cached = entry is not None and not self._needs_larger_probe(entry, memory_budget)
+        if not cached:
+            entry = self._probe(model, imgsz, device, memory_budget)
+        chosen = choose_batch(entry['batches'], memory_budget)
+        if chosen is None:
+            # 缓存来自更宽松的预算时可能缺少小批量的结果
+            if cached:
+                entry = self._probe(model, imgsz, device, memory_budget)
+                cached = False
+                chosen = choose_batch(entry['batches'], memory_budget)
+            if chosen is None:
+                return None
+
+        if entry['workers'] is None or entry.get('max_workers', max_workers) < max_workers:
+            entry['workers'] = probe_workers(image_paths, imgsz, chosen['batch'], max_workers)
+            entry['max_workers'] = max_workers
+            cached = False
+        if not cached:
+            self._save(key, entry)
+
+        return {
+            'batch': chosen['batch'],
+            'workers': choose_workers(entry['workers'], chosen['imgs_per_sec'], max_workers),
+            'imgs_per_sec': chosen['imgs_per_sec'],
+            'peak_mb': chosen['peak_mb'],
+            'cached': cached,
+        }
@@ -0,0 +1,213 @@
+"""
+训练数据集增量物化模块
+在 dataset/manifest.json 中记录每张图像的内容哈希、标注版本和所属划分，
+再次准备数据集时只对变化部分做增删、重新链接或重新生成标签。
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+from visiofirm.utils.archive_writer import COPY_WORKERS, link_or_copy
+from visiofirm.utils.export_cache import cache_signature
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = 'manifest.json'
+MANIFEST_VERSION = 1
+
+DATASET_SPLITS = ('train', 'val', 'test')
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """文件内容的 sha1"""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class DatasetManifest:
+    """
+    数据集目录的物化清单
+
+    条目键为 '{split}/{image_name}'，值记录源路径、stat 签名、内容哈希、标注版本和图像变体
+    （例如缩放尺寸）。stat 签名未变时不读取文件内容，只有 size/mtime 变化时才重新计算哈希。
+
+    Args:
+        dataset_dir: 数据集目录，包含 {split}/images 与 {split}/labels
+    """
+
+    def __init__(self, dataset_dir):
+        self.dataset_dir = dataset_dir
+        self.path = os.path.join(dataset_dir, MANIFEST_FILE)
+        self.entries = {}
+        self.labels_key = None
+        self.loaded = self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return False
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable dataset manifest {self.path}: {e}")
+            return False
+        if data.get('version') != MANIFEST_VERSION:
+            return False
+        self.entries = data.get('entries', {})
+        self.labels_key = data.get('labels_key')
+        return True
+
+    def save(self):
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': MANIFEST_VERSION, 'labels_key': self.labels_key, 'entries': self.entries}, f)
+        os.replace(temp_path, self.path)
+
+    def _paths(self, split, name):
+        image_path = os.path.join(self.dataset_dir, split, 'images', name)
+        label_path = os.path.join(self.dataset_dir, split, 'labels', os.path.splitext(name)[0] + '.txt')
+        return image_path, label_path
+
+    @staticmethod
+    def _drop_image_cache(image_path):
+        """删除 ultralytics cache='disk' 写在图片旁的 .npy，否则图片变化后仍会读到旧缓存"""
+        cache_path = os.path.splitext(image_path)[0] + '.npy'
+        if os.path.lexists(cache_path):
+            os.unlink(cache_path)
+
+    def _remove(self, key):
+        split, name = key.split('/', 1)
+        image_path, label_path = self._paths(split, name)
+        for path in (image_path, label_path):
+            if os.path.lexists(path):
+                os.unlink(path)
+        self._drop_image_cache(image_path)
+        del self.entries[key]
+
+    def _reset(self):
+        """没有可用清单时清空划分目录，避免旧的复制结果残留在其他划分中"""
+        for split in DATASET_SPLITS:
+            shutil.rmtree(os.path.join(self.dataset_dir, split), ignore_errors=True)
+        self.entries = {}
+
+    def _image_current(self, entry, source, stat, image_path, variant):
+        """返回 (是否无需重新链接, 已计算的内容哈希或 None)"""
+        if entry is None or entry['source'] != source or not os.path.exists(image_path):
+            return False, None
+        if entry.get('variant') != variant:
+            return False, entry['sha1'] if (entry['size'], entry['mtime_ns']) == (stat.st_size, stat.st_mtime_ns) else None
+        if (entry['size'], entry['mtime_ns']) == (stat.st_size, stat.st_mtime_ns):
+            return True, None
+        digest = file_digest(source)
+        if digest != entry['sha1']:
+            return False, digest
+        # 内容未变（例如只被 touch），只更新 stat 签名
+        entry['size'], entry['mtime_ns'] = stat.st_size, stat.st_mtime_ns
+        return True, digest
+
+    def _link_images(self, to_link, materialize):
+        """放入需要更新的图像；自定义物化（如缩放）较慢，交给线程池并行执行"""
+        def place(item):
+            key, entry, image_path = item
+            if os.path.lexists(image_path):
+                os.unlink(image_path)
+            self._drop_image_cache(image_path)
+            if materialize is None:
+                link_or_copy(entry['source'], image_path)
+            else:
+                materialize(entry['source'], image_path, entry['sha1'])
+            return key, entry
+
+        if materialize is None or len(to_link) < 2:
+            for key, entry in map(place, to_link):
+                self.entries[key] = entry
+            return
+        with ThreadPoolExecutor(max_workers=COPY_WORKERS, thread_name_prefix='dataset-images') as executor:
+            for key, entry in executor.map(place, to_link):
+                self.entries[key] = entry
+
+    def sync(self, splits, write_labels, *labels_key_parts, materialize=None, variant=None):
+        """
+        将数据集目录同步到给定的划分
+
+        Args:
+            splits: {split: [image_info, ...]}，image_info 来自 Project.get_annotated_images()
+            write_labels: callable([(image_info, label_path), ...])，批量生成需要更新的标签文件
+            labels_key_parts: 影响所有标签内容的参数（如类别列表），变化时全部标签重新生成
+            materialize: 可选，callable(source, image_path, sha1)，代替直接链接原图（例如链接缩放副本）
+            variant: materialize 的参数标识，变化时所有图像重新物化
+        Returns:
+            dict: 各划分的图像数以及 linked/relabeled/removed/unchanged/missing 计数
+        """
+        if not self.loaded:
+            self._reset()
+        labels_key = cache_signature(*labels_key_parts)
+        relabel_all = labels_key != self.labels_key
+        stats = {'linked': 0, 'relabeled': 0, 'removed': 0, 'unchanged': 0, 'missing': 0,
+                 'splits': {split: 0 for split in splits}}
+
+        for split in DATASET_SPLITS:
+            os.makedirs(os.path.join(self.dataset_dir, split, 'images'), exist_ok=True)
+            os.makedirs(os.path.join(self.dataset_dir, split, 'labels'), exist_ok=True)
+
+        desired = {f"{split}/{info['name']}": (split, info) for split, images in splits.items() for info in images}
+        for key in [key for key in self.entries if key not in desired]:
+            self._remove(key)
+            stats['removed'] += 1
+
+        pending = []
+        to_link = []
+        try:
+            for key, (split, info) in desired.items():
+                source = info['path']
+                image_path, label_path = self._paths(split, info['name'])
+                try:
+                    stat = os.stat(source)
+                except OSError:
+                    logger.warning(f"源图片文件不存在: {source}")
+                    if key in self.entries:
+                        self._remove(key)
+                    stats['missing'] += 1
+                    continue
+
+                entry = self.entries.get(key)
+                image_current, digest = self._image_current(entry, source, stat, image_path, variant)
+                if not image_current:
+                    sha1 = digest or file_digest(source)
+                    # 内容未变（只是变体变化）时沿用已生成的标签
+                    same_content = entry is not None and entry['source'] == source and entry['sha1'] == sha1
+                    entry = {'source': source, 'image_id': info['id'], 'size': stat.st_size,
+                             'mtime_ns': stat.st_mtime_ns, 'sha1': sha1,
+                             'annotation_version': entry['annotation_version'] if same_content else None,
+                             'variant': variant}
+                    to_link.append((key, entry, image_path))
+
+                version = info.get('annotation_version', 0)
+                if relabel_all or entry['annotation_version'] != version or not os.path.exists(label_path):
+                    pending.append((entry, info, label_path))
+                elif image_current:
+                    stats['unchanged'] += 1
+                stats['splits'][split] += 1
+
+            self._link_images(to_link, materialize)
+            stats['linked'] = len(to_link)
+
+            write_labels([(info, label_path) for _, info, label_path in pending])
+            for entry, info, _ in pending:
+                entry['annotation_version'] = info.get('annotation_version', 0)
+                entry['image_id'] = info['id']
+            stats['relabeled'] = len(pending)
+            self.labels_key = labels_key
+        finally:
+            # 中途失败时保留旧的 labels_key，未处理的标签下次会重新生成
+            self.save()
+
+        logger.info(f"Dataset sync for {self.dataset_dir}: {stats}")
+        return stats
@@ -0,0 +1,101 @@
+"""
+增量导出缓存模块
+按图像缓存已生成的标签片段（YOLO 标签文本、COCO 标注 JSON、VOC XML、CSV 行），
+以 Images.annotation_version 作为版本号，只有标注变化过的图像才重新生成。
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+from contextlib import closing
+
+CACHE_DB_NAME = 'export_cache.db'
+
+# 单条 SQL 中的参数数量上限（SQLite 默认 999）
+_LOOKUP_BATCH = 500
+
+
+def cache_signature(*parts):
+    """根据导出格式、标注类型、类别列表等生成签名，任一变化都会使缓存失效"""
+    return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+class ExportCache:
+    """
+    单个项目、单种导出格式的片段缓存
+
+    Args:
+        path: 缓存数据库路径，通常为项目目录下的 export_cache.db
+        format_key: 导出格式，如 'YOLO'
+        signature: cache_signature() 的结果
+    """
+
+    def __init__(self, path, format_key, signature):
+        self.path = path
+        self.format_key = format_key
+        self.signature = signature
+        self.hits = 0
+        self.misses = 0
+        self._pending = []
+        with closing(sqlite3.connect(self.path)) as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS ExportFragments (
+                    format TEXT NOT NULL,
+                    image_id INTEGER NOT NULL,
+                    version INTEGER NOT NULL,
+                    signature TEXT NOT NULL,
+                    fragment TEXT NOT NULL,
+                    PRIMARY KEY (format, image_id)
+                )
+            ''')
+            conn.commit()
+
+    @classmethod
+    def for_project(cls, project, format_key, *signature_parts):
+        """在项目目录下打开缓存"""
+        path = os.path.join(os.path.dirname(project.db_path), CACHE_DB_NAME)
+        return cls(path, format_key, cache_signature(format_key, *signature_parts))
+
+    def lookup(self, entries):
+        """
+        批量查找缓存
+
+        Args:
+            entries: [(image_id, version), ...]
+        Returns:
+            dict: image_id -> fragment，仅包含版本和签名都匹配的条目
+        """
+        versions = dict(entries)
+        found = {}
+        ids = list(versions)
+        with closing(sqlite3.connect(self.path)) as conn:
+            for start in range(0, len(ids), _LOOKUP_BATCH):
+                batch = ids[start:start + _LOOKUP_BATCH]
+                rows = conn.execute(
+                    f'''SELECT image_id, version, fragment FROM ExportFragments
+                        WHERE format = ? AND signature = ? AND image_id IN ({",".join("?" * len(batch))})''',
+                    [self.format_key, self.signature] + batch
+                )
+                for image_id, version, fragment in rows:
+                    if versions.get(image_id) == version:
+                        found[image_id] = fragment
+        self.hits += len(found)
+        self.misses += len(ids) - len(found)
+        return found
+
+    def store(self, image_id, version, fragment):
+        """记录新生成的片段，flush() 时统一写入"""
+        self._pending.append((self.format_key, image_id, version, self.signature, fragment))
+
+    def flush(self):
+        """在一个事务中写入所有待保存片段"""
+        if not self._pending:
+            return
+        with closing(sqlite3.connect(self.path)) as conn:
+            conn.executemany('''
+                INSERT OR REPLACE INTO ExportFragments (format, image_id, version, signature, fragment)
+                VALUES (?, ?, ?, ?, ?)
+            ''', self._pending)
+            conn.commit()
+        self._pending = []
@@ -0,0 +1,157 @@
+"""
+后台导出任务模块
+导出在线程池中运行，归档写入 EXPORTS_FOLDER 下的任务目录，
+任务状态与进度持久化为 job.json，服务重启后仍可查询和下载已完成的产物。
+"""
+
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from visiofirm.config import EXPORTS_FOLDER, EXPORT_JOB_WORKERS, EXPORT_RETENTION_HOURS
+
+logger = logging.getLogger(__name__)
+
+JOB_FILE = 'job.json'
+
+
+class ExportJobManager:
+    """
+    导出任务管理器
+
+    Args:
+        root: 产物目录，默认 EXPORTS_FOLDER
+        max_workers: 并发导出任务数
+        retention_hours: 已结束任务的保留时间，超时后删除目录
+    """
+
+    def __init__(self, root=EXPORTS_FOLDER, max_workers=EXPORT_JOB_WORKERS, retention_hours=EXPORT_RETENTION_HOURS):
+        self.root = root
+        self.retention_seconds = retention_hours * 3600
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='export-job')
+        self._jobs = {}
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    def _job_dir(self, job_id):
+        return os.path.join(self.root, job_id)
+
+    def _save(self, job):
+        """原子写入任务元数据"""
+        path = os.path.join(self._job_dir(job['job_id']), JOB_FILE)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(job, f)
+        os.replace(tmp_path, path)
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            job = self._jobs[job_id]
+            job.update(fields)
+            snapshot = dict(job)
+        self._save(snapshot)
+
+    def start(self, write_archive, filename, project_name=None, user_id=None):
+        """
+        提交导出任务
+
+        Args:
+            write_archive: callable(output_path, progress_callback)，将归档写到指定路径
+            filename: 下载时使用的文件名
+        Returns:
+            str: 任务ID
+        """
+        self.cleanup_expired()
+        job_id = uuid.uuid4().hex
+        os.makedirs(self._job_dir(job_id))
+        job = {
+            'job_id': job_id,
+            'project_name': project_name,
+            'user_id': user_id,
+            'filename': os.path.basename(filename),
+            'status': 'queued',
+            'progress': 0,
+            'error': None,
+            'size': None,
+            'created_at': time.time(),
+            'finished_at': None
+        }
+        with self._lock:
+            self._jobs[job_id] = job
+        self._save(job)
+        self._executor.submit(self._run, job_id, write_archive)
+        return job_id
+
+    def _run(self, job_id, write_archive):
+        job = self.get(job_id)
+        artifact = os.path.join(self._job_dir(job_id), job['filename'])
+        partial = artifact + '.part'
+        last_saved = [0.0]
+
+        def progress_callback(done, total):
+            progress = round(done * 100 / total, 1) if total else 100
+            with self._lock:
+                self._jobs[job_id]['progress'] = progress
+            # 进度更新频繁，元数据最多每秒落盘一次
+            now = time.time()
+            if now - last_saved[0] >= 1:
+                last_saved[0] = now
+                self._update(job_id)
+
+        self._update(job_id, status='running')
+        try:
+            write_archive(partial, progress_callback)
+            os.replace(partial, artifact)
+            self._update(job_id, status='completed', progress=100, size=os.path.getsize(artifact), finished_at=time.time())
+            logger.info(f"Export job {job_id} completed: {artifact}")
+        except Exception as e:
+            logger.error(f"Export job {job_id} failed: {e}")
+            if os.path.exists(partial):
+                os.remove(partial)
+            self._update(job_id, status='failed', error=str(e), finished_at=time.time())
+
+    def get(self, job_id):
+        """返回任务元数据副本，不存在时返回 None"""
+        if not job_id or os.path.basename(job_id) != job_id:
+            return None
+        with self._lock:
+            if job_id in self._jobs:
+                return dict(self._jobs[job_id])
+        path = os.path.join(self._job_dir(job_id), JOB_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding='utf-8') as f:
+            job = json.load(f)
+        if job['status'] in ('queued', 'running'):
+            # 上一次进程退出时未完成的任务
+            job.update(status='failed', error='Export interrupted by server restart')
+        return job
+
+    def artifact_path(self, job_id):
+        """已完成任务的产物路径，未完成时返回 None"""
+        job = self.get(job_id)
+        if not job or job['status'] != 'completed':
+            return None
+        path = os.path.join(self._job_dir(job_id), job['filename'])
+        return path if os.path.exists(path) else None
+
+    def cleanup_expired(self):
+        """删除超过保留时间的已结束任务"""
+        now = time.time()
+        for job_id in os.listdir(self.root):
+            job = self.get(job_id)
+            if job is None or (job['status'] in ('queued', 'running') and job_id in self._jobs):
+                continue
+            finished_at = job.get('finished_at') or job.get('created_at', now)
+            if now - finished_at > self.retention_seconds:
+                shutil.rmtree(self._job_dir(job_id), ignore_errors=True)
+                with self._lock:
+                    self._jobs.pop(job_id, None)
+
+
+export_jobs = ExportJobManager()
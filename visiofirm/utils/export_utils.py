@@ -1,12 +1,28 @@
 from io import BytesIO
-import zipfile
 import json
 import yaml
-import math
 import sqlite3
 import os
 from datetime import datetime
 import random
+import queue
+import threading
+import logging
+import numpy as np
+from collections import namedtuple
+from contextlib import closing
+from itertools import groupby
+
+from visiofirm.utils.archive_writer import open_archive
+from visiofirm.utils.mask_utils import segmentation_polygon, polygon_to_mask, encode_rle, rle_area
+from visiofirm.utils.geometry import (
+    annotation_boxes, obb_to_corners, polygon_bbox, polygon_extent, polygon_area,
+    normalize_points, xywh_to_yolo, format_values
+)
+
+logger = logging.getLogger(__name__)
+
+STREAM_CHUNK_SIZE = 64 * 1024
 
 def split_images(images, split_choices, split_ratios):
     """Split images into train/test/val sets based on specified ratios."""
@@ -35,81 +51,241 @@ def split_images(images, split_choices, split_ratios):
    
     return splits
 
-def generate_coco_export(project, splits, setup_type, project_name, project_description):
-    """Generate COCO format export with proper folder structure."""
+ExportRecord = namedtuple('ExportRecord', ['path', 'image_id', 'width', 'height', 'annotations', 'version', 'fragment'])
+
+def iter_export_records(db_path, image_paths, cache=None):
+    """Yield an ExportRecord per image, in the order of `image_paths`.
+
+    Images and their annotations are fetched with ordered queries over one
+    connection instead of two queries per image. Annotation rows keep the column
+    layout of `SELECT * FROM Annotations`; images missing from the database are skipped.
+    With an ExportCache, images whose cached fragment matches their annotation_version
+    come back with `fragment` set and their annotations are not read at all.
+    """
+    with closing(sqlite3.connect(db_path)) as conn:
+        cursor = conn.cursor()
+        cursor.execute('CREATE TEMP TABLE IF NOT EXISTS export_order (seq INTEGER PRIMARY KEY, absolute_path TEXT)')
+        cursor.execute('DELETE FROM export_order')
+        cursor.executemany('INSERT INTO export_order (seq, absolute_path) VALUES (?, ?)', enumerate(image_paths))
+        cursor.execute('''
+            SELECT o.seq, o.absolute_path, i.image_id, i.width, i.height, i.annotation_version
+            FROM export_order o
+            JOIN Images i ON i.absolute_path = o.absolute_path
+            ORDER BY o.seq
+        ''')
+        images = cursor.fetchall()
+        fragments = cache.lookup([(row[2], row[5]) for row in images]) if cache else {}
+        if fragments:
+            cursor.executemany('DELETE FROM export_order WHERE seq = ?', [(row[0],) for row in images if row[2] in fragments])
+        cursor.execute('''
+            SELECT o.seq, a.*
+            FROM export_order o
+            JOIN Images i ON i.absolute_path = o.absolute_path
+            JOIN Annotations a ON a.image_id = i.image_id
+            ORDER BY o.seq, a.annotation_id
+        ''')
+        groups = groupby(cursor, key=lambda row: row[0])
+        group = next(groups, None)
+        for seq, path, image_id, width, height, version in images:
+            if image_id in fragments:
+                yield ExportRecord(path, image_id, width, height, [], version, fragments[image_id])
+                continue
+            annotations = []
+            if group is not None and group[0] == seq:
+                annotations = [row[1:] for row in group[1]]
+                group = next(groups, None)
+            yield ExportRecord(path, image_id, width, height, annotations, version, None)
+
+class ProgressTracker:
+    """Count exported images across all splits and report (done, total) to a callback."""
+
+    def __init__(self, splits, callback):
+        self.total = sum(len(images) for images in splits.values())
+        self.done = 0
+        self.callback = callback
+
+    def track(self, records):
+        for record in records:
+            yield record
+            self.done += 1
+            if self.callback:
+                self.callback(self.done, self.total)
+
+def render_fragment(record, cache, render):
+    """Return the cached fragment of `record`, or render it and remember it in `cache`."""
+    if record.fragment is not None:
+        return record.fragment
+    fragment = render(record)
+    if cache is not None:
+        cache.store(record.image_id, record.version, fragment)
+    return fragment
+
+def _coco_annotations(record, setup_type, category_dict, mask_encoding='polygon'):
+    """Render the COCO annotations of one image as JSON, without annotation ids.
+
+    With mask_encoding='rle', segmentation polygons are rasterized and written as
+    compressed COCO RLE, and 'area' is the mask pixel count.
+    """
+    annotations = []
+    corners = obb_to_corners(annotation_boxes(record.annotations)) if setup_type == "Oriented Bounding Box" else None
+    for i, row in enumerate(record.annotations):
+        anno = {
+            'image_id': record.image_id,
+            'category_id': category_dict.get(row[4], 0),
+            'iscrowd': 0,
+            'area': 0
+        }
+
+        if setup_type == "Bounding Box":
+            anno['bbox'] = [row[5], row[6], row[7], row[8]]
+            anno['area'] = row[7] * row[8]
+        elif setup_type == "Segmentation":
+            segmentation = segmentation_polygon(row[10])
+            anno['segmentation'] = [segmentation]
+            if segmentation:
+                anno['bbox'] = polygon_bbox(segmentation).tolist()
+                anno['area'] = polygon_area(segmentation)
+                if mask_encoding == 'rle':
+                    rle = encode_rle(polygon_to_mask(segmentation, record.width, record.height))
+                    anno['segmentation'] = rle
+                    anno['area'] = rle_area(rle)
+        elif setup_type == "Oriented Bounding Box":
+            anno['segmentation'] = [corners[i].ravel().tolist()]
+            anno['bbox'] = polygon_bbox(corners[i]).tolist()
+            anno['area'] = polygon_area(corners[i])
+
+        annotations.append(anno)
+    return json.dumps(annotations)
+
+def yolo_label(record, setup_type, category_dict):
+    """Render the YOLO label file of one image."""
+    img_width, img_height = record.width, record.height
+    rows = [row for row in record.annotations if row[4] in category_dict]
+    lines = []
+    if setup_type == "Bounding Box":
+        boxes = xywh_to_yolo(annotation_boxes(rows)[:, :4], img_width, img_height)
+        for row, box in zip(rows, boxes):
+            lines.append(f"{category_dict[row[4]]} {format_values(box)}")
+    elif setup_type == "Oriented Bounding Box":
+        corners = obb_to_corners(annotation_boxes(rows)) / np.array([img_width, img_height])
+        for row, points in zip(rows, corners):
+            lines.append(f"{category_dict[row[4]]} {format_values(points)}")
+    elif setup_type == "Segmentation":
+        for row in rows:
+            segmentation = segmentation_polygon(row[10])
+            if segmentation:
+                points = normalize_points(segmentation, img_width, img_height)
+                lines.append(f"{category_dict[row[4]]} {format_values(points)}")
+    return "\n".join(lines)
+
+def _voc_xml(record, folder_name, setup_type):
+    """Render the Pascal VOC annotation XML of one image."""
+    img_path = record.path
+    img_width, img_height = record.width, record.height
+    objects = []
+    corners = obb_to_corners(annotation_boxes(record.annotations)) if setup_type == "Oriented Bounding Box" else None
+    for i, row in enumerate(record.annotations):
+        class_name = row[4]
+        if setup_type == "Bounding Box":
+            xmin = row[5]
+            ymin = row[6]
+            xmax = row[5] + row[7]
+            ymax = row[6] + row[8]
+        elif setup_type == "Oriented Bounding Box":
+            xmin, ymin, xmax, ymax = polygon_extent(corners[i])
+        elif setup_type == "Segmentation":
+            segmentation = segmentation_polygon(row[10])
+            if segmentation:
+                xmin, ymin, xmax, ymax = polygon_extent(segmentation)
+            else:
+                continue
+        objects.append({
+            'name': class_name,
+            'bndbox': {'xmin': xmin, 'ymin': ymin, 'xmax': xmax, 'ymax': ymax}
+        })
+    xml_content = f"""<annotation>
+    <folder>{folder_name}</folder>
+    <filename>{os.path.basename(img_path)}</filename>
+    <size>
+        <width>{img_width}</width>
+        <height>{img_height}</height>
+        <depth>3</depth>
+    </size>
+"""
+    for obj in objects:
+        xml_content += f""" <object>
+        <name>{obj['name']}</name>
+        <bndbox>
+            <xmin>{obj['bndbox']['xmin']}</xmin>
+            <ymin>{obj['bndbox']['ymin']}</ymin>
+            <xmax>{obj['bndbox']['xmax']}</xmax>
+            <ymax>{obj['bndbox']['ymax']}</ymax>
+        </bndbox>
+    </object>
+"""
+    xml_content += "</annotation>"
+    return xml_content
+
+def _csv_rows(record, setup_type):
+    """Render the CSV rows of one image."""
+    image_name = os.path.basename(record.path)
+    csv_lines = []
+    for row in record.annotations:
+        class_name = row[4]
+        if setup_type == "Bounding Box":
+            x, y, width, height = row[5], row[6], row[7], row[8]
+            csv_lines.append(f"{image_name},{class_name},{x},{y},{width},{height}")
+        elif setup_type == "Oriented Bounding Box":
+            x, y, dx, dy, angle = annotation_boxes([row])[0].tolist()
+            xc, yc = x + dx / 2, y + dy / 2
+            csv_lines.append(f"{image_name},{class_name},{xc},{yc},{dx},{dy},{angle}")
+        elif setup_type == "Segmentation":
+            segmentation = segmentation_polygon(row[10])
+            if segmentation:
+                x, y, width, height = polygon_bbox(segmentation).tolist()
+                csv_lines.append(f"{image_name},{class_name},{x},{y},{width},{height}")
+    return "\n".join(csv_lines)
+
+def generate_coco_export(project, splits, setup_type, project_name, project_description, output=None, archive_format='zip', progress_callback=None, cache=None, mask_encoding='polygon'):
+    """Generate COCO format export with proper folder structure.
+
+    Writes the archive to `output` (a path or writable file object) when given,
+    otherwise returns an in-memory BytesIO. `archive_format` is 'zip', 'tar',
+    'dir' (a plain directory at the `output` path) or 'link' (a directory with
+    hardlinked images). `progress_callback(done, total)`
+    is called after each exported image. Per-image fragments are reused from and
+    saved to `cache` (an ExportCache) when given. `mask_encoding` is 'polygon' or
+    'rle' for segmentation projects.
+    """
     categories = project.get_classes()
     category_dict = {name: idx + 1 for idx, name in enumerate(categories)}
    
-    zip_buffer = BytesIO()
-    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+    progress = ProgressTracker(splits, progress_callback)
+    zip_buffer = BytesIO() if output is None else output
+    with open_archive(zip_buffer, archive_format) as zip_file:
         # Create COCO folder structure
         for split_name, split_images in splits.items():
             images_list = []
             annotations_list = []
             annotation_id = 1
            
-            for img_path in split_images:
-                with sqlite3.connect(project.db_path) as conn:
-                    cursor = conn.cursor()
-                    cursor.execute('SELECT image_id, width, height FROM Images WHERE absolute_path = ?', (img_path,))
-                    image_id, width, height = cursor.fetchone()
+            for record in progress.track(iter_export_records(project.db_path, split_images, cache)):
+                img_path = record.path
                    
-                    # Add image to zip in images/{split_name} folder
-                    with open(img_path, 'rb') as f:
-                        zip_file.writestr(f'images/{split_name}/{os.path.basename(img_path)}', f.read())
+                # Add image to zip in images/{split_name} folder
+                zip_file.write(img_path, f'images/{split_name}/{os.path.basename(img_path)}')
                    
-                    images_list.append({
-                        'id': image_id,
-                        'file_name': os.path.basename(img_path),
-                        'width': width,
-                        'height': height
-                    })
-                    # Process annotations
-                    cursor.execute('SELECT * FROM Annotations WHERE image_id = ?', (image_id,))
-                    for row in cursor.fetchall():
-                        anno = {
-                            'id': annotation_id,
-                            'image_id': image_id,
-                            'category_id': category_dict.get(row[4], 0),
-                            'iscrowd': 0,
-                            'area': 0
-                        }
-                       
-                        if setup_type == "Bounding Box":
-                            anno['bbox'] = [row[5], row[6], row[7], row[8]]
-                            anno['area'] = row[7] * row[8]
-                        elif setup_type == "Segmentation":
-                            segmentation = json.loads(row[10]) if row[10] else []
-                            anno['segmentation'] = [segmentation]
-                            if segmentation:
-                                xs = segmentation[0::2]
-                                ys = segmentation[1::2]
-                                min_x, min_y = min(xs), min(ys)
-                                max_x, max_y = max(xs), max(ys)
-                                anno['bbox'] = [min_x, min_y, max_x - min_x, max_y - min_y]
-                                anno['area'] = (max_x - min_x) * (max_y - min_y)
-                        elif setup_type == "Oriented Bounding Box":
-                            center_x = row[5] + (row[7] / 2) if row[7] else 0
-                            center_y = row[6] + (row[8] / 2) if row[8] else 0
-                            angle = row[9] * math.pi / 180 if row[9] else 0
-                            w = row[7] if row[7] else 0
-                            h = row[8] if row[8] else 0
-                            points = [(-w/2, -h/2), (w/2, -h/2), (w/2, h/2), (-w/2, h/2)]
-                            rotated_points = []
-                            for p in points:
-                                x = p[0] * math.cos(angle) - p[1] * math.sin(angle) + center_x
-                                y = p[0] * math.sin(angle) + p[1] * math.cos(angle) + center_y
-                                rotated_points.extend([x, y])
-                            anno['segmentation'] = [rotated_points]
-                            xs = rotated_points[0::2]
-                            ys = rotated_points[1::2]
-                            min_x, min_y = min(xs), min(ys)
-                            max_x, max_y = max(xs), max(ys)
-                            anno['bbox'] = [min_x, min_y, max_x - min_x, max_y - min_y]
-                            anno['area'] = (max_x - min_x) * (max_y - min_y)
-                       
-                        annotations_list.append(anno)
-                        annotation_id += 1
+                images_list.append({
+                    'id': record.image_id,
+                    'file_name': os.path.basename(img_path),
+                    'width': record.width,
+                    'height': record.height
+                })
+                # Process annotations
+                fragment = render_fragment(record, cache, lambda r: _coco_annotations(r, setup_type, category_dict, mask_encoding))
+                for anno in json.loads(fragment):
+                    annotations_list.append({'id': annotation_id, **anno})
+                    annotation_id += 1
             # Create COCO JSON for this split
             coco_data = {
                 'info': {
@@ -132,69 +308,39 @@ def generate_coco_export(project, splits, setup_type, project_name, project_desc
            
             zip_file.writestr(f'annotations/instances_{split_name}.json', json.dumps(coco_data, indent=2))
    
-    zip_buffer.seek(0)
+    if cache is not None:
+        cache.flush()
+    if output is None:
+        zip_buffer.seek(0)
     return zip_buffer
 
-def generate_yolo_export(project, splits, setup_type, project_name, project_description):
-    """Generate YOLO format export with proper folder structure."""
+def generate_yolo_export(project, splits, setup_type, project_name, project_description, output=None, archive_format='zip', progress_callback=None, cache=None):
+    """Generate YOLO format export with proper folder structure.
+
+    Writes the archive to `output` (a path or writable file object) when given,
+    otherwise returns an in-memory BytesIO. `archive_format` is 'zip', 'tar',
+    'dir' (a plain directory at the `output` path) or 'link' (a directory with
+    hardlinked images). `progress_callback(done, total)`
+    is called after each exported image. Per-image fragments are reused from and
+    saved to `cache` (an ExportCache) when given.
+    """
     categories = project.get_classes()
     category_dict = {name: idx for idx, name in enumerate(categories)}
    
-    zip_buffer = BytesIO()
-    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+    progress = ProgressTracker(splits, progress_callback)
+    zip_buffer = BytesIO() if output is None else output
+    with open_archive(zip_buffer, archive_format) as zip_file:
         # Create YOLO folder structure
         for split_name, split_images in splits.items():
-            for img_path in split_images:
+            for record in progress.track(iter_export_records(project.db_path, split_images, cache)):
+                img_path = record.path
                 # Add image to zip in {split_name}/images folder
-                with open(img_path, 'rb') as f:
-                    zip_file.writestr(f'{split_name}/images/{os.path.basename(img_path)}', f.read())
+                zip_file.write(img_path, f'{split_name}/images/{os.path.basename(img_path)}')
                
-                # Process annotations
-                with sqlite3.connect(project.db_path) as conn:
-                    cursor = conn.cursor()
-                    cursor.execute('SELECT image_id, width, height FROM Images WHERE absolute_path = ?', (img_path,))
-                    image_id, img_width, img_height = cursor.fetchone()
-                    cursor.execute('SELECT * FROM Annotations WHERE image_id = ?', (image_id,))
-                    lines = []
-                    for row in cursor.fetchall():
-                        class_id = category_dict.get(row[4], -1)
-                        if class_id == -1:
-                            continue
-                           
-                        if setup_type == "Bounding Box":
-                            x_center = (row[5] + row[7] / 2) / img_width
-                            y_center = (row[6] + row[8] / 2) / img_height
-                            width = row[7] / img_width
-                            height = row[8] / img_height
-                            lines.append(f"{class_id} {x_center} {y_center} {width} {height}")
-                        elif setup_type == "Oriented Bounding Box":
-                            center_x = row[5] + (row[7] / 2) if row[7] else 0
-                            center_y = row[6] + (row[8] / 2) if row[8] else 0
-                            angle = row[9] * math.pi / 180 if row[9] else 0
-                            w = row[7] if row[7] else 0
-                            h = row[8] if row[8] else 0
-                            points = [(-w/2, -h/2), (w/2, -h/2), (w/2, h/2), (-w/2, h/2)]
-                            rotated_points = []
-                            for p in points:
-                                x = p[0] * math.cos(angle) - p[1] * math.sin(angle) + center_x
-                                y = p[0] * math.sin(angle) + p[1] * math.cos(angle) + center_y
-                                rotated_points.append((x / img_width, y / img_height))
-                            line = f"{class_id} " + " ".join(f"{p[0]} {p[1]}" for p in rotated_points)
-                            lines.append(line)
-                        elif setup_type == "Segmentation":
-                            segmentation = json.loads(row[10]) if row[10] else []
-                            if segmentation:
-                                normalized_points = []
-                                for i in range(0, len(segmentation), 2):
-                                    x = segmentation[i] / img_width
-                                    y = segmentation[i + 1] / img_height
-                                    normalized_points.extend([x, y])
-                                line = f"{class_id} " + " ".join(map(str, normalized_points))
-                                lines.append(line)
-                   
-                    # Add label to zip in {split_name}/labels folder
-                    txt_filename = os.path.splitext(os.path.basename(img_path))[0] + '.txt'
-                    zip_file.writestr(f'{split_name}/labels/{txt_filename}', "\n".join(lines))
+                # Add label to zip in {split_name}/labels folder
+                label = render_fragment(record, cache, lambda r: yolo_label(r, setup_type, category_dict))
+                txt_filename = os.path.splitext(os.path.basename(img_path))[0] + '.txt'
+                zip_file.writestr(f'{split_name}/labels/{txt_filename}', label)
         # Create data.yaml
         yaml_data = {
             'names': categories,
@@ -213,140 +359,155 @@ def generate_yolo_export(project, splits, setup_type, project_name, project_desc
         }
         zip_file.writestr('data.yaml', yaml.dump(yaml_data, default_flow_style=False))
    
-    zip_buffer.seek(0)
+    if cache is not None:
+        cache.flush()
+    if output is None:
+        zip_buffer.seek(0)
     return zip_buffer
 
-def generate_pascal_voc_export(project, splits, setup_type):
-    """Generate Pascal VOC format export with proper folder structure."""
-    zip_buffer = BytesIO()
-    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+def generate_pascal_voc_export(project, splits, setup_type, output=None, archive_format='zip', progress_callback=None, cache=None):
+    """Generate Pascal VOC format export with proper folder structure.
+
+    Writes the archive to `output` (a path or writable file object) when given,
+    otherwise returns an in-memory BytesIO. `archive_format` is 'zip', 'tar',
+    'dir' (a plain directory at the `output` path) or 'link' (a directory with
+    hardlinked images). `progress_callback(done, total)`
+    is called after each exported image. Per-image fragments are reused from and
+    saved to `cache` (an ExportCache) when given.
+    """
+    progress = ProgressTracker(splits, progress_callback)
+    zip_buffer = BytesIO() if output is None else output
+    with open_archive(zip_buffer, archive_format) as zip_file:
         for split_name, split_images in splits.items():
             # Create ImageSets/Main directory
             image_set_lines = []
            
-            for img_path in split_images:
+            for record in progress.track(iter_export_records(project.db_path, split_images, cache)):
+                img_path = record.path
                 basename = os.path.splitext(os.path.basename(img_path))[0]
                 image_set_lines.append(basename)
                
                 # Add image to JPEGImages
-                with open(img_path, 'rb') as f:
-                    zip_file.writestr(f'VOC2007/JPEGImages/{os.path.basename(img_path)}', f.read())
+                zip_file.write(img_path, f'VOC2007/JPEGImages/{os.path.basename(img_path)}')
                
                 # Create annotation XML
-                with sqlite3.connect(project.db_path) as conn:
-                    cursor = conn.cursor()
-                    cursor.execute('SELECT image_id, width, height FROM Images WHERE absolute_path = ?', (img_path,))
-                    image_id, img_width, img_height = cursor.fetchone()
-                    cursor.execute('SELECT * FROM Annotations WHERE image_id = ?', (image_id,))
-                    objects = []
-                    for row in cursor.fetchall():
-                        class_name = row[4]
-                        if setup_type == "Bounding Box":
-                            xmin = row[5]
-                            ymin = row[6]
-                            xmax = row[5] + row[7]
-                            ymax = row[6] + row[8]
-                        elif setup_type == "Oriented Bounding Box":
-                            center_x = row[5] + (row[7] / 2) if row[7] else 0
-                            center_y = row[6] + (row[8] / 2) if row[8] else 0
-                            angle = row[9] * math.pi / 180 if row[9] else 0
-                            w = row[7] if row[7] else 0
-                            h = row[8] if row[8] else 0
-                            points = [(-w/2, -h/2), (w/2, -h/2), (w/2, h/2), (-w/2, h/2)]
-                            rotated_points = []
-                            for p in points:
-                                x = p[0] * math.cos(angle) - p[1] * math.sin(angle) + center_x
-                                y = p[0] * math.sin(angle) + p[1] * math.cos(angle) + center_y
-                                rotated_points.append((x, y))
-                            xs = [p[0] for p in rotated_points]
-                            ys = [p[1] for p in rotated_points]
-                            xmin, ymin = min(xs), min(ys)
-                            xmax, ymax = max(xs), max(ys)
-                        elif setup_type == "Segmentation":
-                            segmentation = json.loads(row[10]) if row[10] else []
-                            if segmentation:
-                                xs = segmentation[0::2]
-                                ys = segmentation[1::2]
-                                xmin, ymin = min(xs), min(ys)
-                                xmax, ymax = max(xs), max(ys)
-                            else:
-                                continue
-                        objects.append({
-                            'name': class_name,
-                            'bndbox': {'xmin': xmin, 'ymin': ymin, 'xmax': xmax, 'ymax': ymax}
-                        })
-                    xml_content = f"""<annotation>
-    <folder>{project.name}</folder>
-    <filename>{os.path.basename(img_path)}</filename>
-    <size>
-        <width>{img_width}</width>
-        <height>{img_height}</height>
-        <depth>3</depth>
-    </size>
-"""
-                    for obj in objects:
-                        xml_content += f""" <object>
-        <name>{obj['name']}</name>
-        <bndbox>
-            <xmin>{obj['bndbox']['xmin']}</xmin>
-            <ymin>{obj['bndbox']['ymin']}</ymin>
-            <xmax>{obj['bndbox']['xmax']}</xmax>
-            <ymax>{obj['bndbox']['ymax']}</ymax>
-        </bndbox>
-    </object>
-"""
-                    xml_content += "</annotation>"
-                    zip_file.writestr(f'VOC2007/Annotations/{basename}.xml', xml_content)
+                xml_content = render_fragment(record, cache, lambda r: _voc_xml(r, project.name, setup_type))
+                zip_file.writestr(f'VOC2007/Annotations/{basename}.xml', xml_content)
            
             # Write ImageSet file
             zip_file.writestr(f'VOC2007/ImageSets/Main/{split_name}.txt', "\n".join(image_set_lines))
    
-    zip_buffer.seek(0)
+    if cache is not None:
+        cache.flush()
+    if output is None:
+        zip_buffer.seek(0)
     return zip_buffer
 
-def generate_csv_export(project, splits, setup_type):
-    """Generate CSV format export with proper folder structure."""
-    zip_buffer = BytesIO()
-    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+def generate_csv_export(project, splits, setup_type, output=None, archive_format='zip', progress_callback=None, cache=None):
+    """Generate CSV format export with proper folder structure.
+
+    Writes the archive to `output` (a path or writable file object) when given,
+    otherwise returns an in-memory BytesIO. `archive_format` is 'zip', 'tar',
+    'dir' (a plain directory at the `output` path) or 'link' (a directory with
+    hardlinked images). `progress_callback(done, total)`
+    is called after each exported image. Per-image fragments are reused from and
+    saved to `cache` (an ExportCache) when given.
+    """
+    progress = ProgressTracker(splits, progress_callback)
+    zip_buffer = BytesIO() if output is None else output
+    with open_archive(zip_buffer, archive_format) as zip_file:
         for split_name, split_images in splits.items():
             csv_lines = []
             header = "image_name,class_name,x,y,width,height" if setup_type != "Oriented Bounding Box" else "image_name,class_name,xc,yc,dx,dy,angle"
             csv_lines.append(header)
-            for img_path in split_images:
-                with sqlite3.connect(project.db_path) as conn:
-                    cursor = conn.cursor()
-                    cursor.execute('SELECT image_id FROM Images WHERE absolute_path = ?', (img_path,))
-                    image_id = cursor.fetchone()[0]
-                    cursor.execute('SELECT * FROM Annotations WHERE image_id = ?', (image_id,))
-                    for row in cursor.fetchall():
-                        class_name = row[4]
-                        if setup_type == "Bounding Box":
-                            x, y, width, height = row[5], row[6], row[7], row[8]
-                            csv_lines.append(f"{os.path.basename(img_path)},{class_name},{x},{y},{width},{height}")
-                        elif setup_type == "Oriented Bounding Box":
-                            xc = row[5] + (row[7] / 2) if row[7] else 0
-                            yc = row[6] + (row[8] / 2) if row[8] else 0
-                            dx = row[7] if row[7] else 0
-                            dy = row[8] if row[8] else 0
-                            angle = row[9] if row[9] else 0
-                            csv_lines.append(f"{os.path.basename(img_path)},{class_name},{xc},{yc},{dx},{dy},{angle}")
-                        elif setup_type == "Segmentation":
-                            segmentation = json.loads(row[10]) if row[10] else []
-                            if segmentation:
-                                xs = segmentation[0::2]
-                                ys = segmentation[1::2]
-                                x = min(xs)
-                                y = min(ys)
-                                width = max(xs) - x
-                                height = max(ys) - y
-                                csv_lines.append(f"{os.path.basename(img_path)},{class_name},{x},{y},{width},{height}")
+            for record in progress.track(iter_export_records(project.db_path, split_images, cache)):
+                img_path = record.path
+                rows = render_fragment(record, cache, lambda r: _csv_rows(r, setup_type))
+                if rows:
+                    csv_lines.append(rows)
                
                 # Add image to split folder
-                with open(img_path, 'rb') as f:
-                    zip_file.writestr(f'{split_name}/{os.path.basename(img_path)}', f.read())
+                zip_file.write(img_path, f'{split_name}/{os.path.basename(img_path)}')
            
             # Write CSV file to annotation folder
             zip_file.writestr(f'annotation/{split_name}.csv', "\n".join(csv_lines))
    
-    zip_buffer.seek(0)
-    return zip_buffer
\ No newline at end of file
+    if cache is not None:
+        cache.flush()
+    if output is None:
+        zip_buffer.seek(0)
+    return zip_buffer
+
+class _StreamCancelled(Exception):
+    pass
+
+
+class _QueueWriter:
+    """Write-only, unseekable file object that hands fixed-size chunks to a bounded queue."""
+
+    def __init__(self, chunks, cancelled):
+        self._chunks = chunks
+        self._cancelled = cancelled
+        self._buffer = bytearray()
+
+    def write(self, data):
+        self._buffer += data
+        if len(self._buffer) >= STREAM_CHUNK_SIZE:
+            self.flush()
+        return len(data)
+
+    def flush(self):
+        if self._buffer:
+            self.put(bytes(self._buffer))
+            self._buffer.clear()
+
+    def put(self, item):
+        # Blocks while the consumer is behind, which keeps memory bounded
+        while True:
+            if self._cancelled.is_set():
+                raise _StreamCancelled()
+            try:
+                self._chunks.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+
+def iter_zip_stream(write_archive, max_pending_chunks=16):
+    """Run `write_archive(fileobj)` in a worker thread and yield the bytes it writes.
+
+    zipfile and streaming tarfile support unseekable outputs, so exporters can write straight into an
+    HTTP response with at most `max_pending_chunks` * STREAM_CHUNK_SIZE bytes buffered.
+    Closing the generator (client disconnect) stops the worker.
+    """
+    chunks = queue.Queue(maxsize=max_pending_chunks)
+    cancelled = threading.Event()
+    done = object()
+
+    def worker():
+        writer = _QueueWriter(chunks, cancelled)
+        try:
+            write_archive(writer)
+            writer.flush()
+            writer.put(done)
+        except _StreamCancelled:
+            pass
+        except Exception as e:
+            logger.error(f"Streaming export failed: {e}")
+            try:
+                writer.put(e)
+            except _StreamCancelled:
+                pass
+
+    thread = threading.Thread(target=worker, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = chunks.get()
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        cancelled.set()
@@ -0,0 +1,134 @@
+"""
+标注几何计算模块
+旋转框角点、多边形外接框/面积以及坐标归一化的向量化实现，供导出和训练标签生成共用
+"""
+
+import numpy as np
+
+
+def as_points(points):
+    """将点集统一为 (N, 2) 数组
+
+    支持扁平列表 [x1, y1, x2, y2, ...]、[{'x':..,'y':..}, ...] 以及 (N, 2) 序列。
+    """
+    if points is None or len(points) == 0:
+        return np.zeros((0, 2), dtype=np.float64)
+    if isinstance(points[0], dict):
+        return np.array([(p['x'], p['y']) for p in points], dtype=np.float64)
+    array = np.asarray(points, dtype=np.float64)
+    if array.ndim == 1:
+        array = array[:len(array) // 2 * 2].reshape(-1, 2)
+    return array
+
+
+def obb_to_corners(boxes):
+    """旋转框转四个角点
+
+    boxes: (N, 5) 或 (5,)，每行为 x, y, width, height, rotation（左上角坐标，角度制，绕中心旋转）
+    返回 (N, 4, 2)，角点顺序为左上、右上、右下、左下（旋转前）
+    """
+    boxes = np.atleast_2d(np.asarray(boxes, dtype=np.float64))
+    x, y, w, h, rotation = boxes.T
+    cx = x + w / 2
+    cy = y + h / 2
+    angle = np.deg2rad(rotation)
+    cos, sin = np.cos(angle), np.sin(angle)
+    dx = np.stack([-w / 2, w / 2, w / 2, -w / 2], axis=1)
+    dy = np.stack([-h / 2, -h / 2, h / 2, h / 2], axis=1)
+    xs = dx * cos[:, None] - dy * sin[:, None] + cx[:, None]
+    ys = dx * sin[:, None] + dy * cos[:, None] + cy[:, None]
+    return np.stack([xs, ys], axis=2)
+
+
+def corners_to_obb(corners):
+    """四个角点转旋转框，obb_to_corners 的逆运算
+
+    corners: (N, 4, 2) 或 (4, 2)，返回 (N, 5)：x, y, width, height, rotation
+    """
+    corners = np.asarray(corners, dtype=np.float64).reshape(-1, 4, 2)
+    center = corners.mean(axis=1)
+    top = corners[:, 1] - corners[:, 0]
+    side = corners[:, 2] - corners[:, 1]
+    w = np.hypot(top[:, 0], top[:, 1])
+    h = np.hypot(side[:, 0], side[:, 1])
+    rotation = np.rad2deg(np.arctan2(top[:, 1], top[:, 0]))
+    return np.stack([center[:, 0] - w / 2, center[:, 1] - h / 2, w, h, rotation], axis=1)
+
+
+def annotation_boxes(rows):
+    """将 Annotations 行的 x, y, width, height, rotation（第 5-9 列）堆叠为 (N, 5) 数组，NULL 记为 0"""
+    return np.array([[value or 0 for value in row[5:10]] for row in rows], dtype=np.float64).reshape(-1, 5)
+
+
+def polygon_bbox(points):
+    """多边形外接框 [x, y, width, height]"""
+    points = as_points(points)
+    if len(points) == 0:
+        return np.zeros(4)
+    mins = points.min(axis=0)
+    maxs = points.max(axis=0)
+    return np.concatenate([mins, maxs - mins])
+
+
+def polygon_extent(points):
+    """多边形坐标范围 (xmin, ymin, xmax, ymax)"""
+    points = as_points(points)
+    if len(points) == 0:
+        return 0.0, 0.0, 0.0, 0.0
+    xmin, ymin = points.min(axis=0).tolist()
+    xmax, ymax = points.max(axis=0).tolist()
+    return xmin, ymin, xmax, ymax
+
+
+def polygons_bbox(polygons):
+    """(N, K, 2) 的多边形批量外接框，返回 (N, 4)"""
+    polygons = np.asarray(polygons, dtype=np.float64)
+    if polygons.size == 0:
+        return np.zeros((0, 4))
+    mins = polygons.min(axis=1)
+    maxs = polygons.max(axis=1)
+    return np.concatenate([mins, maxs - mins], axis=1)
+
+
+def polygon_area(points):
+    """鞋带公式计算多边形真实面积"""
+    points = as_points(points)
+    if len(points) < 3:
+        return 0.0
+    x, y = points[:, 0], points[:, 1]
+    return float(abs(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1))) / 2)
+
+
+def normalize_points(points, width, height):
+    """像素坐标归一化到 [0, 1]，返回 (N, 2)"""
+    return as_points(points) / np.array([width, height], dtype=np.float64)
+
+
+def denormalize_points(points, width, height):
+    """归一化坐标还原为像素坐标，返回 (N, 2)"""
+    return as_points(points) * np.array([width, height], dtype=np.float64)
+
+
+def xywh_to_yolo(boxes, width, height):
+    """左上角 x, y, w, h 批量转 YOLO 归一化中心格式，返回 (N, 4)"""
+    boxes = np.atleast_2d(np.asarray(boxes, dtype=np.float64))
+    if boxes.size == 0:
+        return np.zeros((0, 4))
+    scale = np.array([width, height, width, height], dtype=np.float64)
+    centers = boxes[:, :2] + boxes[:, 2:4] / 2
+    return np.concatenate([centers, boxes[:, 2:4]], axis=1) / scale
+
+
+def yolo_to_xywh(boxes, width, height):
+    """YOLO 归一化中心格式批量转左上角 x, y, w, h 像素坐标"""
+    boxes = np.atleast_2d(np.asarray(boxes, dtype=np.float64))
+    if boxes.size == 0:
+        return np.zeros((0, 4))
+    scale = np.array([width, height, width, height], dtype=np.float64)
+    boxes = boxes * scale
+    return np.concatenate([boxes[:, :2] - boxes[:, 2:4] / 2, boxes[:, 2:4]], axis=1)
+
+
+def format_values(values):
+    """数值序列转为空格分隔字符串"""
+    return " ".join(str(v) for v in np.asarray(values, dtype=np.float64).ravel().tolist())
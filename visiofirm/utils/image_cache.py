@@ -0,0 +1,105 @@
+"""
+训练图像缩放缓存模块
+把原图按训练尺寸缩小后的副本保存在项目缓存目录中（以内容哈希和 imgsz 为键），
+数据集目录中的图片链接到缩放后的副本，训练时数据加载进程不再解码和缩放超大原图。
+"""
+
+import logging
+import os
+import uuid
+
+import cv2
+
+from visiofirm.utils.archive_writer import link_or_copy
+
+logger = logging.getLogger(__name__)
+
+# cv2.imwrite 支持写出的扩展名，其余格式缓存为 jpg
+_WRITABLE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff', '.webp'}
+_WRITE_PARAMS = {
+    '.jpg': [cv2.IMWRITE_JPEG_QUALITY, 95],
+    '.jpeg': [cv2.IMWRITE_JPEG_QUALITY, 95],
+    '.png': [cv2.IMWRITE_PNG_COMPRESSION, 1],
+    '.webp': [cv2.IMWRITE_WEBP_QUALITY, 95],
+}
+
+
+def resized_shape(width, height, imgsz):
+    """长边缩放到 imgsz 后的 (width, height)，不放大"""
+    ratio = imgsz / max(width, height)
+    if ratio >= 1:
+        return width, height
+    return max(1, round(width * ratio)), max(1, round(height * ratio))
+
+
+class ResizedImageCache:
+    """
+    按 (内容哈希, imgsz) 缓存缩小后的训练图像
+
+    只缩小不填充：保持宽高比，letterbox 仍由 ultralytics 在加载时完成，
+    因此按原图尺寸归一化的 YOLO 标签无需任何调整。长边不超过 imgsz 的图像直接链接原图。
+
+    Args:
+        cache_dir: 缓存目录
+        imgsz: 训练尺寸
+    """
+
+    def __init__(self, cache_dir, imgsz):
+        self.cache_dir = cache_dir
+        self.imgsz = int(imgsz)
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def cache_path(self, source, digest):
+        ext = os.path.splitext(source)[1].lower()
+        if ext not in _WRITABLE_EXTENSIONS:
+            ext = '.jpg'
+        return os.path.join(self.cache_dir, f'{digest}_{self.imgsz}{ext}')
+
+    def materialize(self, source, dest, digest):
+        """
+        把 source 以训练尺寸放到 dest：命中缓存时直接链接，否则先生成缩放副本
+
+        Returns:
+            str: 'cached'（命中缓存）、'resized'（新生成）或 'original'（无需缩放，链接原图）
+        """
+        cache_path = self.cache_path(source, digest)
+        if os.path.exists(cache_path):
+            link_or_copy(cache_path, dest)
+            return 'cached'
+
+        image = cv2.imread(source, cv2.IMREAD_COLOR)
+        if image is None:
+            logger.warning(f"无法读取图像，使用原图: {source}")
+            link_or_copy(source, dest)
+            return 'original'
+        height, width = image.shape[:2]
+        new_width, new_height = resized_shape(width, height, self.imgsz)
+        if (new_width, new_height) == (width, height):
+            link_or_copy(source, dest)
+            return 'original'
+
+        resized = cv2.resize(image, (new_width, new_height), interpolation=cv2.INTER_AREA)
+        ext = os.path.splitext(cache_path)[1]
+        # 先写临时文件再改名，并发或中断时不会留下不完整的缓存
+        temp_path = os.path.join(self.cache_dir, f'.{uuid.uuid4().hex}{ext}')
+        if not cv2.imwrite(temp_path, resized, _WRITE_PARAMS.get(ext, [])):
+            logger.warning(f"写入缩放图像失败，使用原图: {source}")
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            link_or_copy(source, dest)
+            return 'original'
+        os.replace(temp_path, cache_path)
+        link_or_copy(cache_path, dest)
+        return 'resized'
+
+    def prune(self, keep_digests):
+        """删除不再被数据集引用的缓存文件，以及其他训练尺寸的缓存"""
+        removed = 0
+        suffix = f'_{self.imgsz}'
+        for name in os.listdir(self.cache_dir):
+            stem = os.path.splitext(name)[0]
+            digest = stem.split('_', 1)[0]
+            if name.startswith('.') or not stem.endswith(suffix) or digest not in keep_digests:
+                os.unlink(os.path.join(self.cache_dir, name))
+                removed += 1
+        return removed
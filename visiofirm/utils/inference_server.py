@@ -0,0 +1,251 @@
+"""
+推理服务进程
+在独立进程中加载检测模型，将并发的单图请求合并成微批次执行，
+供按需预标注和后台批量预标注共同使用。
+"""
+
+import atexit
+import heapq
+import itertools
+import logging
+import multiprocessing as mp
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from visiofirm.config import INFERENCE_SERVER_ENABLED, INFERENCE_MAX_BATCH_SIZE, INFERENCE_MAX_WAIT_MS
+
+logger = logging.getLogger(__name__)
+
+# 优先级数值越小越先处理
+PRIORITY_ON_DEMAND = 0
+PRIORITY_BACKGROUND = 1
+
+
+def _pool_processor_factory(config):
+    """默认处理器工厂：在服务进程内使用常驻模型池"""
+    from visiofirm.utils.VFPreAnnotator import model_pool
+    return model_pool.get_processor(**config)
+
+
+def _request_key(request):
+    """只有模型配置、类别和阈值都相同的请求才能合并到同一批次"""
+    return (
+        tuple(sorted(request['config'].items())),
+        request['classes_str'],
+        request['mode'],
+        request['box_threshold'],
+    )
+
+
+def _collect_batch(request_queue, pending, max_batch_size, max_wait_ms):
+    """
+    从请求队列收集下一个微批次
+
+    第一个请求到达后最多再等待 max_wait_ms 毫秒，或凑满 max_batch_size 个请求。
+    收到的请求先进入本地优先级堆，按 (优先级, 到达顺序) 出堆。
+
+    Returns:
+        tuple: (批次请求列表, 是否收到停止信号)
+    """
+    stop = False
+    if not pending:
+        item = request_queue.get()
+        if item is None:
+            return [], True
+        heapq.heappush(pending, (item['priority'], item['seq'], item))
+
+    deadline = time.monotonic() + max_wait_ms / 1000.0
+    while len(pending) < max_batch_size:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            item = request_queue.get(timeout=remaining)
+        except queue.Empty:
+            break
+        if item is None:
+            stop = True
+            break
+        heapq.heappush(pending, (item['priority'], item['seq'], item))
+
+    # 已经排队的请求也纳入堆中，保证后到的按需请求能插到后台请求前面
+    while not stop:
+        try:
+            item = request_queue.get_nowait()
+        except queue.Empty:
+            break
+        if item is None:
+            stop = True
+            break
+        heapq.heappush(pending, (item['priority'], item['seq'], item))
+
+    batch = [heapq.heappop(pending)[2] for _ in range(min(max_batch_size, len(pending)))]
+    return batch, stop
+
+
+def _run_batch(batch, processor_factory):
+    """按模型配置分组执行一个批次，返回结果消息列表"""
+    from PIL import Image
+
+    groups = {}
+    for request in batch:
+        groups.setdefault(_request_key(request), []).append(request)
+
+    messages = []
+    for requests in groups.values():
+        first = requests[0]
+        images = []
+        ready = []
+        for request in requests:
+            try:
+                images.append(Image.open(request['image_path']).convert("RGB"))
+                ready.append(request)
+            except Exception as e:
+                messages.append({'id': request['id'], 'error': f"Failed to load image: {e}"})
+        if not ready:
+            continue
+        try:
+            processor = processor_factory(first['config'])
+            results = processor.process_batch(
+                images,
+                first['classes_str'],
+                mode=first['mode'],
+                box_threshold=first['box_threshold']
+            )
+        except Exception as e:
+            logger.error(f"Inference batch of {len(ready)} images failed: {e}")
+            messages.extend({'id': request['id'], 'error': str(e)} for request in ready)
+            continue
+        messages.extend({'id': request['id'], 'result': result} for request, result in zip(ready, results))
+    return messages
+
+
+def serve(request_queue, result_queue, processor_factory, max_batch_size, max_wait_ms):
+    """服务进程主循环，收到 None 后处理完剩余请求再退出"""
+    pending = []
+    stop = False
+    while not stop or pending:
+        if stop:
+            batch = [heapq.heappop(pending)[2] for _ in range(min(max_batch_size, len(pending)))]
+        else:
+            batch, stop = _collect_batch(request_queue, pending, max_batch_size, max_wait_ms)
+        if not batch:
+            continue
+        for message in _run_batch(batch, processor_factory):
+            result_queue.put(message)
+
+
+class InferenceClient:
+    """
+    推理服务客户端
+
+    在 Web 进程中使用，负责启动服务进程、提交请求并把结果分发给对应的 Future。
+    """
+
+    def __init__(self, max_batch_size=INFERENCE_MAX_BATCH_SIZE, max_wait_ms=INFERENCE_MAX_WAIT_MS,
+                 processor_factory=_pool_processor_factory):
+        ctx = mp.get_context('spawn')
+        self._request_queue = ctx.Queue()
+        self._result_queue = ctx.Queue()
+        self._process = ctx.Process(
+            target=serve,
+            args=(self._request_queue, self._result_queue, processor_factory, max_batch_size, max_wait_ms),
+            daemon=True
+        )
+        self._process.start()
+        self._futures = {}
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+        self._closed = False
+        self._dispatcher = threading.Thread(target=self._dispatch_results, daemon=True)
+        self._dispatcher.start()
+
+    def _dispatch_results(self):
+        while True:
+            try:
+                message = self._result_queue.get(timeout=1)
+            except queue.Empty:
+                if not self._process.is_alive():
+                    self._fail_pending(RuntimeError("Inference server process exited"))
+                    return
+                continue
+            with self._lock:
+                future = self._futures.pop(message['id'], None)
+            if future is None:
+                continue
+            if 'error' in message:
+                future.set_exception(RuntimeError(message['error']))
+            else:
+                future.set_result(message['result'])
+
+    def _fail_pending(self, exc):
+        with self._lock:
+            futures = list(self._futures.values())
+            self._futures.clear()
+        for future in futures:
+            future.set_exception(exc)
+
+    def submit(self, image_path, classes_str, config, mode="BoundingBox", box_threshold=None, priority=False):
+        """
+        提交单张图像的推理请求
+
+        Args:
+            image_path: 图像绝对路径
+            classes_str: 逗号分隔的类别
+            config: 处理器配置 (model_type, yolo_model_path, sam2_model_path, device 等)
+            mode: BoundingBox 或 Segmentation
+            box_threshold: 置信度阈值
+            priority: 是否为按需（高优先级）请求
+
+        Returns:
+            Future: 结果为 ImageProcessor.process_image 的返回值
+        """
+        if self._closed:
+            raise RuntimeError("Inference client is shut down")
+        future = Future()
+        request_id = next(self._ids)
+        with self._lock:
+            self._futures[request_id] = future
+        self._request_queue.put({
+            'id': request_id,
+            'seq': request_id,
+            'priority': PRIORITY_ON_DEMAND if priority else PRIORITY_BACKGROUND,
+            'image_path': image_path,
+            'classes_str': classes_str,
+            'config': dict(config),
+            'mode': mode,
+            'box_threshold': box_threshold,
+        })
+        return future
+
+    def process_image(self, image_path, classes_str, config, mode="BoundingBox", box_threshold=None,
+                      priority=False, timeout=None):
+        """提交请求并阻塞等待结果"""
+        return self.submit(image_path, classes_str, config, mode, box_threshold, priority).result(timeout=timeout)
+
+    def shutdown(self, timeout=10):
+        if self._closed:
+            return
+        self._closed = True
+        self._request_queue.put(None)
+        self._process.join(timeout)
+        if self._process.is_alive():
+            self._process.terminate()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_inference_client():
+    """返回共享的推理客户端；未启用推理服务时返回 None"""
+    global _client
+    if not INFERENCE_SERVER_ENABLED:
+        return None
+    with _client_lock:
+        if _client is None:
+            _client = InferenceClient()
+            atexit.register(_client.shutdown)
+        return _client
@@ -0,0 +1,169 @@
+"""
+掩码 RLE 编解码模块
+与 COCO 兼容的行程编码（列优先），编解码均用 NumPy 向量化实现，
+并提供 pycocotools 使用的压缩 counts 字符串格式，无需依赖 pycocotools。
+"""
+
+import json
+
+import cv2
+import numpy as np
+
+from visiofirm.utils.geometry import as_points
+
+
+def encode_rle(mask, compressed=True):
+    """
+    二值掩码转 COCO RLE
+
+    Args:
+        mask: (H, W) 数组，非零为前景
+        compressed: True 时 counts 为压缩字符串，否则为整数列表
+    Returns:
+        dict: {'size': [H, W], 'counts': ...}
+    """
+    mask = np.asarray(mask)
+    height, width = mask.shape[:2]
+    flat = (mask != 0).ravel(order='F')
+    if flat.size == 0:
+        counts = []
+    else:
+        changes = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+        counts = np.diff(np.concatenate([[0], changes, [flat.size]]))
+        if flat[0]:
+            # RLE 总是从背景行程开始
+            counts = np.concatenate([[0], counts])
+        counts = counts.tolist()
+    return {'size': [height, width], 'counts': counts_to_string(counts) if compressed else counts}
+
+
+def decode_rle(rle):
+    """COCO RLE 转 (H, W) 的 uint8 掩码"""
+    height, width = rle['size']
+    counts = rle['counts']
+    if isinstance(counts, (str, bytes)):
+        counts = string_to_counts(counts)
+    counts = np.asarray(counts, dtype=np.int64)
+    values = (np.arange(len(counts)) % 2).astype(np.uint8)
+    flat = np.repeat(values, counts)
+    if flat.size != height * width:
+        raise ValueError(f"RLE covers {flat.size} pixels, expected {height * width}")
+    return flat.reshape((height, width), order='F')
+
+
+def counts_to_string(counts):
+    """行程列表压缩为 COCO counts 字符串（与 pycocotools rleToString 相同的编码）"""
+    chars = []
+    for i, x in enumerate(counts):
+        x = int(x)
+        if i > 2:
+            x -= int(counts[i - 2])
+        more = True
+        while more:
+            c = x & 0x1f
+            x >>= 5
+            more = x != -1 if c & 0x10 else x != 0
+            if more:
+                c |= 0x20
+            chars.append(chr(c + 48))
+    return ''.join(chars)
+
+
+def string_to_counts(string):
+    """COCO counts 字符串还原为行程列表"""
+    if isinstance(string, bytes):
+        string = string.decode('ascii')
+    counts = []
+    p = 0
+    while p < len(string):
+        x = 0
+        k = 0
+        more = True
+        while more:
+            c = ord(string[p]) - 48
+            x |= (c & 0x1f) << (5 * k)
+            more = bool(c & 0x20)
+            p += 1
+            k += 1
+            if not more and c & 0x10:
+                x |= -1 << (5 * k)
+        if len(counts) > 2:
+            x += counts[-2]
+        counts.append(x)
+    return counts
+
+
+def _counts(rle):
+    counts = rle['counts']
+    return string_to_counts(counts) if isinstance(counts, (str, bytes)) else list(counts)
+
+
+def rle_area(rle):
+    """前景像素数"""
+    return int(sum(_counts(rle)[1::2]))
+
+
+def rle_bbox(rle):
+    """前景外接框 [x, y, width, height]，空掩码返回全零"""
+    height, _ = rle['size']
+    counts = np.asarray(_counts(rle), dtype=np.int64)
+    if len(counts) < 2 or counts[1::2].sum() == 0:
+        return [0, 0, 0, 0]
+    ends = np.cumsum(counts)
+    starts = ends - counts
+    fg_starts = starts[1::2][counts[1::2] > 0]
+    fg_ends = ends[1::2][counts[1::2] > 0] - 1
+    # 列优先：像素索引 = x * H + y
+    xs = np.concatenate([fg_starts // height, fg_ends // height])
+    # 跨列的行程会覆盖整列
+    spans_columns = (fg_ends // height) > (fg_starts // height)
+    ys_start = np.where(spans_columns, 0, fg_starts % height)
+    ys_end = np.where(spans_columns, height - 1, fg_ends % height)
+    x0, x1 = int(xs.min()), int(xs.max())
+    y0, y1 = int(ys_start.min()), int(ys_end.max())
+    return [x0, y0, x1 - x0 + 1, y1 - y0 + 1]
+
+
+def polygon_to_mask(points, width, height):
+    """多边形栅格化为 (H, W) 的 uint8 掩码"""
+    mask = np.zeros((int(height), int(width)), dtype=np.uint8)
+    points = as_points(points)
+    if len(points) >= 3:
+        cv2.fillPoly(mask, [np.round(points).astype(np.int32)], 1)
+    return mask
+
+
+def mask_to_polygon(mask):
+    """掩码最大外轮廓转扁平多边形 [x1, y1, x2, y2, ...]，无前景时返回空列表"""
+    contours, _ = cv2.findContours(np.asarray(mask, dtype=np.uint8), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return []
+    largest = max(contours, key=cv2.contourArea)
+    return largest.reshape(-1).astype(float).tolist()
+
+
+def is_rle(segmentation):
+    return isinstance(segmentation, dict) and 'counts' in segmentation and 'size' in segmentation
+
+
+def parse_segmentation(text):
+    """解析数据库中的 segmentation 字段，返回多边形列表或 RLE 字典；无效时返回 None"""
+    if not text:
+        return None
+    try:
+        segmentation = json.loads(text)
+    except (json.JSONDecodeError, TypeError):
+        return None
+    if isinstance(segmentation, list) or is_rle(segmentation):
+        return segmentation
+    return None
+
+
+def segmentation_polygon(text):
+    """数据库 segmentation 字段统一转为扁平多边形，RLE 会解码后取最大外轮廓"""
+    segmentation = parse_segmentation(text)
+    if segmentation is None:
+        return []
+    if is_rle(segmentation):
+        return mask_to_polygon(decode_rle(segmentation))
+    return segmentation
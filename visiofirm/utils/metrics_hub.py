@@ -0,0 +1,141 @@
+"""
+训练指标中心
+训练进程上报的每批次/每轮指标先进入内存环形缓冲区，供 SSE 接口实时推送；
+每轮指标按批次写入数据库，避免每条记录都新建一次数据库连接。
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+
+from visiofirm.config import METRICS_BUFFER_SIZE, METRICS_FLUSH_ROWS, METRICS_FLUSH_SECONDS
+
+logger = logging.getLogger(__name__)
+
+FINAL_EVENT = 'status'
+
+
+class _TaskStream:
+    def __init__(self, persist, buffer_size):
+        self.events = deque(maxlen=buffer_size)
+        self.persist = persist
+        self.pending = []
+        self.last_flush = time.monotonic()
+        self.latest = {}
+        self.closed = False
+
+
+class MetricsHub:
+    """
+    按 (project_name, task_id) 分组的训练指标流
+
+    每条事件带有全局递增的 seq，订阅者用 wait_for(after_seq) 取增量，
+    断线重连时可通过 Last-Event-ID 从缓冲区中续传。
+
+    Args:
+        buffer_size: 每个任务保留的最近事件数
+        flush_rows: 累积多少条每轮记录后写入数据库
+        flush_seconds: 距上次写入超过该秒数时写入数据库
+    """
+
+    def __init__(self, buffer_size=METRICS_BUFFER_SIZE, flush_rows=METRICS_FLUSH_ROWS, flush_seconds=METRICS_FLUSH_SECONDS):
+        self.buffer_size = buffer_size
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self._streams = {}
+        self._seq = 0
+        self._cond = threading.Condition()
+
+    def open(self, key, persist=None):
+        """
+        开始一个任务的指标流
+
+        Args:
+            key: (project_name, task_id)
+            persist: 可选，callable([epoch_event, ...])，批量持久化每轮指标
+        """
+        with self._cond:
+            # 同一项目同时只运行一个任务，旧任务已结束的流不再保留
+            for old_key in [k for k, s in self._streams.items() if s.closed and k[0] == key[0]]:
+                del self._streams[old_key]
+            self._streams[key] = _TaskStream(persist, self.buffer_size)
+
+    def publish(self, key, event_type, data):
+        """发布一条事件，返回其 seq；'epoch' 事件会进入待持久化队列"""
+        with self._cond:
+            stream = self._streams.get(key)
+            if stream is None:
+                stream = self._streams[key] = _TaskStream(None, self.buffer_size)
+            self._seq += 1
+            event = {'seq': self._seq, 'type': event_type, 'time': time.time(), 'data': data}
+            stream.events.append(event)
+            stream.latest[event_type] = event
+            if event_type == 'epoch' and stream.persist is not None:
+                stream.pending.append(data)
+            due = bool(stream.pending) and (len(stream.pending) >= self.flush_rows or
+                                            time.monotonic() - stream.last_flush >= self.flush_seconds)
+            self._cond.notify_all()
+        if due:
+            self.flush(key)
+        return event['seq']
+
+    def flush(self, key):
+        """把待持久化的每轮指标一次写入数据库"""
+        with self._cond:
+            stream = self._streams.get(key)
+            if stream is None or not stream.pending:
+                return 0
+            rows, stream.pending = stream.pending, []
+            stream.last_flush = time.monotonic()
+            persist = stream.persist
+        try:
+            persist(rows)
+        except Exception as e:
+            logger.error(f"写入训练指标失败 {key}: {e}")
+        return len(rows)
+
+    def close(self, key, status, **data):
+        """任务结束：发布最终状态事件并写入剩余指标，缓冲区保留供迟到的订阅者读取"""
+        self.publish(key, FINAL_EVENT, {'status': status, **data})
+        self.flush(key)
+        with self._cond:
+            stream = self._streams.get(key)
+            if stream is not None:
+                stream.closed = True
+            self._cond.notify_all()
+
+    def latest(self, key, event_type):
+        """某类型的最新事件，没有时返回 None"""
+        with self._cond:
+            stream = self._streams.get(key)
+            return dict(stream.latest[event_type]) if stream and event_type in stream.latest else None
+
+    def has_stream(self, key):
+        with self._cond:
+            return key in self._streams
+
+    def is_closed(self, key):
+        with self._cond:
+            stream = self._streams.get(key)
+            return stream is None or stream.closed
+
+    def wait_for(self, key, after_seq=0, timeout=15.0):
+        """
+        返回 seq 大于 after_seq 的事件；没有新事件时最多阻塞 timeout 秒
+
+        Returns:
+            list: 事件列表（可能为空）
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                stream = self._streams.get(key)
+                events = [e for e in stream.events if e['seq'] > after_seq] if stream else []
+                remaining = deadline - time.monotonic()
+                if events or remaining <= 0 or (stream is not None and stream.closed):
+                    return events
+                self._cond.wait(remaining)
+
+
+metrics_hub = MetricsHub()
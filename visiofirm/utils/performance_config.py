@@ -4,13 +4,35 @@ VisioFirm训练模块性能优化配置
 """
 
 import os
+import shutil
 import psutil
 import torch
 import logging
 from threading import Lock
 
+from visiofirm.config import (RESOURCE_TREND_SECONDS, RESOURCE_PROJECTION_MINUTES, DATASET_CACHE_SAFETY_MARGIN,
+                              DATASET_CACHE_RAM_HEADROOM_GB, DATASET_CACHE_DISK_HEADROOM_GB,
+                              BATCH_FINDER_MEMORY_FRACTION)
+from visiofirm.utils.resource_sampler import resource_sampler
+
 logger = logging.getLogger(__name__)
 
+# 不同类型任务分配CPU时的默认权重
+CPU_JOB_WEIGHTS = {
+    'training': 2,
+    'preannotation': 1,
+    'inference': 1,
+}
+
+
+def _available_cpu_count():
+    """当前进程可用的CPU核数（考虑CPU亲和性限制）"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except (AttributeError, OSError):
+        return os.cpu_count() or 1
+
+
 class PerformanceManager:
     """性能管理器 - 优化资源使用和训练性能"""
     
@@ -18,6 +40,14 @@ class PerformanceManager:
         self.resource_lock = Lock()
         self.active_tasks = {}
         self.max_concurrent_tasks = self._calculate_max_concurrent_tasks()
+        # CPU预算：各任务按权重分享可用核数
+        self.cpu_budget = _available_cpu_count()
+        self.cpu_allocations = {}
+        # 各任务数据集缓存预占的内存/磁盘
+        self.cache_reservations = {}
+        # torch 线程池是进程级的：本进程内运行的任务共用一个线程池，任务全部结束后恢复默认值
+        self._default_threads = torch.get_num_threads()
+        self._interop_threads_set = False
         
     def _calculate_max_concurrent_tasks(self):
         """根据系统资源计算最大并发任务数"""
@@ -69,6 +99,7 @@ class PerformanceManager:
                 'batch_size': task_info.get('batch_size', 16)
             }
             logger.info(f"已注册任务 {task_id}，当前活跃任务数: {len(self.active_tasks)}")
+        self.allocate_cpu(task_id, kind='training')
 
     def unregister_task(self, task_id):
         """注销任务"""
@@ -76,6 +107,89 @@ class PerformanceManager:
             if task_id in self.active_tasks:
                 del self.active_tasks[task_id]
                 logger.info(f"已注销任务 {task_id}，当前活跃任务数: {len(self.active_tasks)}")
+            self.cache_reservations.pop(task_id, None)
+        self.release_cpu(task_id)
+
+    def allocate_cpu(self, job_id, kind='training', weight=None, in_process=False):
+        """
+        为任务分配CPU预算，并对所有任务重新平衡
+
+        Args:
+            job_id: 任务标识
+            kind: 任务类型 (training / preannotation / inference)
+            weight: 分配权重，默认按任务类型取 CPU_JOB_WEIGHTS
+            in_process: 任务是否在当前进程内计算（例如 Web 进程中的预标注）；
+                这类任务的份额合并后设置为本进程的 torch 线程数。在子进程中运行的任务
+                （训练、推理服务）由子进程自己应用分配
+
+        Returns:
+            dict: 该任务的分配 (threads, interop_threads, workers)
+        """
+        with self.resource_lock:
+            self.cpu_allocations[job_id] = {
+                'kind': kind,
+                'weight': weight or CPU_JOB_WEIGHTS.get(kind, 1),
+                'in_process': in_process,
+            }
+            self._rebalance_cpu()
+            self._apply_process_threads()
+            return dict(self.cpu_allocations[job_id])
+
+    def release_cpu(self, job_id):
+        """释放任务的CPU预算，剩余任务重新平衡"""
+        with self.resource_lock:
+            if self.cpu_allocations.pop(job_id, None) is not None:
+                self._rebalance_cpu()
+                self._apply_process_threads()
+
+    def _rebalance_cpu(self):
+        """按权重把CPU核数分给所有任务（调用方需持有 resource_lock）"""
+        total_weight = sum(a['weight'] for a in self.cpu_allocations.values())
+        for job_id, allocation in self.cpu_allocations.items():
+            share = max(1, int(self.cpu_budget * allocation['weight'] / total_weight))
+            if allocation['kind'] == 'training':
+                # 训练任务的一部分核数留给数据加载进程
+                workers = min(8, share // 3)
+                threads = max(1, share - workers)
+            else:
+                workers = 0
+                threads = share
+            allocation.update({
+                'threads': threads,
+                'interop_threads': max(1, min(4, threads // 2)),
+                'workers': workers,
+            })
+        if self.cpu_allocations:
+            logger.info("CPU预算重新分配: " + ", ".join(
+                f"{job_id}={a['threads']}线程/{a['workers']}workers" for job_id, a in self.cpu_allocations.items()
+            ))
+
+    def get_cpu_allocation(self, job_id):
+        """获取任务当前的CPU分配，未分配时返回 None"""
+        with self.resource_lock:
+            allocation = self.cpu_allocations.get(job_id)
+            return dict(allocation) if allocation else None
+
+    def _apply_process_threads(self):
+        """
+        按本进程内任务的份额之和设置 torch 线程数（调用方需持有 resource_lock）
+
+        torch.set_num_threads 作用于整个进程，而不是调用线程：同一进程中的并发任务
+        和请求线程共用一个 intra-op 线程池，因此只在分配变化时按合计值设置一次，
+        不在各任务中逐次覆盖。没有本进程任务时恢复默认线程数。
+        interop 线程数只能在进程首次并行计算前设置一次。
+        """
+        local = [a for a in self.cpu_allocations.values() if a.get('in_process')]
+        threads = min(self.cpu_budget, sum(a['threads'] for a in local)) if local else self._default_threads
+        if torch.get_num_threads() != threads:
+            torch.set_num_threads(threads)
+        if local and not self._interop_threads_set:
+            self._interop_threads_set = True
+            try:
+                torch.set_num_interop_threads(max(1, min(4, threads // 2)))
+            except RuntimeError:
+                # 进程中已经有并行任务运行过，interop 线程数不能再修改
+                pass
 
     def get_optimal_batch_size(self, model_type, device):
         """根据模型类型和设备获取最优批量大小"""
@@ -107,6 +221,95 @@ class PerformanceManager:
         
         return base_batch
 
+    def _default_workers(self):
+        """按一个新训练任务加入后的CPU预算估算数据加载进程数"""
+        with self.resource_lock:
+            weights = [a['weight'] for a in self.cpu_allocations.values()] + [CPU_JOB_WEIGHTS['training']]
+        share = max(1, int(self.cpu_budget * CPU_JOB_WEIGHTS['training'] / sum(weights)))
+        return min(8, share // 3)
+
+    @staticmethod
+    def estimate_cache_bytes(image_sizes, imgsz):
+        """
+        估算 ultralytics 缓存解码后图像所需的字节数
+
+        缓存的是长边缩放到 imgsz 后的 uint8 BGR 图像；尺寸未知的图像按 imgsz x imgsz 计。
+
+        Args:
+            image_sizes: [(width, height), ...]，来自 Images 表
+            imgsz: 训练尺寸
+        """
+        total = 0
+        for width, height in image_sizes:
+            if not width or not height:
+                total += imgsz * imgsz * 3
+                continue
+            ratio = imgsz / max(width, height)
+            total += max(1, round(width * ratio)) * max(1, round(height * ratio)) * 3
+        return total
+
+    def choose_cache_mode(self, task_id, image_sizes, imgsz, dataset_dir):
+        """
+        为训练任务选择数据集缓存方式并预占资源
+
+        先尝试内存缓存，放不下时尝试在数据集目录旁写 .npy 磁盘缓存，都不满足时不缓存。
+        其他任务尚未加载的缓存预占从可用量中扣除；已加载的缓存已体现在可用内存/磁盘中，
+        不再重复扣除（见 mark_cache_loaded）。任务注销时释放预占。
+
+        Returns:
+            'ram' / 'disk' / False，可直接作为 model.train 的 cache 参数
+        """
+        required = int(self.estimate_cache_bytes(image_sizes, imgsz) * (1 + DATASET_CACHE_SAFETY_MARGIN))
+        with self.resource_lock:
+            reserved = {'ram': 0, 'disk': 0}
+            for job_id, reservation in self.cache_reservations.items():
+                if job_id != task_id and not reservation['loaded']:
+                    reserved[reservation['mode']] += reservation['bytes']
+
+            ram_available = (psutil.virtual_memory().available - reserved['ram']
+                             - DATASET_CACHE_RAM_HEADROOM_GB * 1024 ** 3)
+            try:
+                disk_available = (shutil.disk_usage(dataset_dir).free - reserved['disk']
+                                  - DATASET_CACHE_DISK_HEADROOM_GB * 1024 ** 3)
+            except OSError:
+                disk_available = 0
+
+            if required <= ram_available:
+                mode = 'ram'
+            elif required <= disk_available:
+                mode = 'disk'
+            else:
+                mode = False
+            if mode:
+                self.cache_reservations[task_id] = {'mode': mode, 'bytes': required, 'loaded': False}
+            else:
+                self.cache_reservations.pop(task_id, None)
+
+        logger.info(f"任务 {task_id} 数据集缓存: {mode or '不缓存'} "
+                    f"(需要 {required / 1024 ** 3:.2f}GB, 可用内存 {max(0, ram_available) / 1024 ** 3:.2f}GB, "
+                    f"可用磁盘 {max(0, disk_available) / 1024 ** 3:.2f}GB)")
+        return mode
+
+    def mark_cache_loaded(self, task_id):
+        """任务的数据集缓存已加载（训练开始产生批次），其占用已体现在可用内存/磁盘中"""
+        with self.resource_lock:
+            reservation = self.cache_reservations.get(task_id)
+            if reservation:
+                reservation['loaded'] = True
+
+    def training_memory_budget(self, task_id):
+        """
+        训练任务前向/反向传播可用的内存（字节），供批量大小探测使用
+
+        从当前可用内存中扣除尚未加载的内存缓存预占（包括本任务，缓存在探测之后才加载）和保留余量；
+        其他任务已在使用的内存（包括已加载的缓存）已体现在可用内存中。
+        """
+        with self.resource_lock:
+            reserved = sum(r['bytes'] for r in self.cache_reservations.values()
+                           if r['mode'] == 'ram' and not r['loaded'])
+        available = psutil.virtual_memory().available - reserved - DATASET_CACHE_RAM_HEADROOM_GB * 1024 ** 3
+        return max(0, int(available * BATCH_FINDER_MEMORY_FRACTION))
+
     def get_memory_efficient_config(self, model_type, epochs, device='auto'):
         """获取内存优化的训练配置"""
         config = {
@@ -117,8 +320,8 @@ class PerformanceManager:
             'half': False,  # 不使用FP16（避免数值不稳定）
             
             # 内存优化
-            'cache': False,  # 不缓存图像到内存
-            'workers': min(4, os.cpu_count() // 2),  # 数据加载线程数
+            'cache': 'auto',  # 准备数据集后按数据集大小和剩余内存/磁盘选择 ram / disk / 不缓存
+            'workers': self._default_workers(),  # 数据加载进程数
             'pin_memory': True if device != 'cpu' else False,
             
             # 模型优化
@@ -167,59 +370,64 @@ class PerformanceManager:
         
         return config
 
-    def monitor_resources(self):
-        """监控系统资源使用情况"""
+    def monitor_resources(self, history_seconds=None):
+        """
+        监控系统资源使用情况（读取后台采样，不阻塞请求线程）
+
+        Args:
+            history_seconds: 可选，附带最近多少秒的采样历史
+        """
         try:
-            # CPU使用率
-            cpu_percent = psutil.cpu_percent(interval=1)
-            
-            # 内存使用
-            memory = psutil.virtual_memory()
-            memory_percent = memory.percent
-            memory_available_gb = memory.available / (1024**3)
-            
-            # GPU使用情况
-            gpu_info = []
-            if torch.cuda.is_available():
-                for i in range(torch.cuda.device_count()):
-                    try:
-                        memory_used = torch.cuda.memory_allocated(i) / (1024**3)
-                        memory_total = torch.cuda.get_device_properties(i).total_memory / (1024**3)
-                        memory_percent_gpu = (memory_used / memory_total) * 100
-                        
-                        gpu_info.append({
-                            'device': f'cuda:{i}',
-                            'name': torch.cuda.get_device_name(i),
-                            'memory_used_gb': round(memory_used, 2),
-                            'memory_total_gb': round(memory_total, 2),
-                            'memory_percent': round(memory_percent_gpu, 1)
-                        })
-                    except Exception as e:
-                        logger.warning(f"获取GPU {i} 信息失败: {e}")
-            
-            return {
-                'cpu_percent': cpu_percent,
-                'memory_percent': memory_percent,
-                'memory_available_gb': round(memory_available_gb, 2),
-                'gpu_info': gpu_info,
+            resource_sampler.start()
+            sample = resource_sampler.latest()
+            with self.resource_lock:
+                cpu_allocations = {str(job_id): dict(a) for job_id, a in self.cpu_allocations.items()}
+            usage = {
+                **sample,
                 'active_tasks': len(self.active_tasks),
-                'max_concurrent_tasks': self.max_concurrent_tasks
+                'max_concurrent_tasks': self.max_concurrent_tasks,
+                'cpu_budget': self.cpu_budget,
+                'cpu_allocations': cpu_allocations
             }
+            if history_seconds:
+                usage['history'] = resource_sampler.history(history_seconds)
+            return usage
             
         except Exception as e:
             logger.error(f"监控资源使用失败: {e}")
             return {}
 
-    def suggest_optimization(self, model_type, current_config, resource_usage):
-        """基于当前资源使用情况建议优化方案"""
+    @staticmethod
+    def _projected(trend, field, current, minutes=RESOURCE_PROJECTION_MINUTES):
+        """按最近趋势预测 minutes 分钟后的值，没有趋势数据时返回当前值"""
+        stats = trend.get(field)
+        if not stats or stats['samples'] < 3 or stats['slope'] <= 0:
+            return current
+        return current + stats['slope'] * minutes
+
+    def suggest_optimization(self, model_type, current_config, resource_usage, trend=None):
+        """
+        基于当前资源使用情况和最近趋势建议优化方案
+
+        Args:
+            trend: 可选，ResourceSampler.trend() 的结果，默认取最近 RESOURCE_TREND_SECONDS 秒
+        """
         suggestions = []
         
         try:
-            # 内存使用过高
-            if resource_usage.get('memory_percent', 0) > 85:
+            if trend is None:
+                trend = resource_sampler.trend(RESOURCE_TREND_SECONDS)
+            memory_percent = resource_usage.get('memory_percent', 0)
+            # 持续偏高才算过高，避免单次采样的尖峰
+            cpu_percent = trend['cpu_percent']['mean'] if 'cpu_percent' in trend else resource_usage.get('cpu_percent', 0)
+
+            # 内存使用过高，或按当前增长速度很快会耗尽
+            projected_memory = self._projected(trend, 'memory_percent', memory_percent)
+            if memory_percent > 85 or projected_memory > 95:
                 suggestions.append({
                     'type': 'memory',
-                    'issue': '内存使用率过高',
+                    'issue': '内存使用率过高' if memory_percent > 85 else
+                             f'内存使用率持续上升，预计 {RESOURCE_PROJECTION_MINUTES} 分钟后达到 {min(100, projected_memory):.0f}%',
                     'suggestion': '建议减少批量大小或关闭图像缓存',
                     'config_changes': {
                         'batch': max(4, current_config.get('batch', 16) // 2),
@@ -229,19 +437,29 @@ class PerformanceManager:
                 })
             
             # CPU使用过高
-            if resource_usage.get('cpu_percent', 0) > 90:
+            if cpu_percent > 90:
                 suggestions.append({
                     'type': 'cpu',
-                    'issue': 'CPU使用率过高',
+                    'issue': 'CPU使用率持续过高',
                     'suggestion': '建议减少数据加载线程数',
                     'config_changes': {
                         'workers': max(1, current_config.get('workers', 4) // 2)
                     }
                 })
+            elif self.active_tasks and 'cpu_percent' in trend and cpu_percent < 30 and trend['cpu_percent']['samples'] >= 3:
+                suggestions.append({
+                    'type': 'cpu_idle',
+                    'issue': '训练期间CPU持续空闲',
+                    'suggestion': '可以适当增加数据加载线程数',
+                    'config_changes': {
+                        'workers': min(8, current_config.get('workers', 4) * 2)
+                    }
+                })
             
             # GPU内存使用过高
             for gpu in resource_usage.get('gpu_info', []):
-                if gpu.get('memory_percent', 0) > 90:
+                projected_gpu = self._projected(trend, f"{gpu['device']}/memory_percent", gpu.get('memory_percent', 0))
+                if gpu.get('memory_percent', 0) > 90 or projected_gpu > 98:
                     suggestions.append({
                         'type': 'gpu_memory',
                         'issue': f'GPU {gpu["device"]} 内存使用率过高',
@@ -251,6 +469,18 @@ class PerformanceManager:
                             'accumulate': 2  # 梯度累积
                         }
                     })
+                utilization = trend.get(f"{gpu['device']}/utilization")
+                if self.active_tasks and utilization and utilization['mean'] < 50 and cpu_percent > 85:
+                    # GPU 等待数据：CPU 端解码和增强跟不上
+                    suggestions.append({
+                        'type': 'data_loading',
+                        'issue': f'GPU {gpu["device"]} 利用率偏低而CPU繁忙，数据加载成为瓶颈',
+                        'suggestion': '建议启用图像缓存或降低数据增强强度',
+                        'config_changes': {
+                            'cache': 'ram' if memory_percent < 60 else 'disk',
+                            'mosaic': 0.0
+                        }
+                    })
             
             # 并发任务过多
             if len(self.active_tasks) >= self.max_concurrent_tasks:
@@ -0,0 +1,227 @@
+"""
+后台资源采样模块
+由守护线程定期采集 CPU、内存、各进程常驻内存、磁盘 I/O 和 GPU 状态，写入固定长度的
+环形缓冲区；接口直接读取最近的采样和历史，不再在请求线程中阻塞等待 CPU 统计。
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+import psutil
+import torch
+
+from visiofirm.config import RESOURCE_SAMPLE_INTERVAL, RESOURCE_HISTORY_SIZE
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 ** 2
+GB = 1024 ** 3
+
+
+def _process_memory(root):
+    """当前进程及其子进程（训练/推理子进程）的常驻内存"""
+    processes = [root]
+    try:
+        processes += root.children(recursive=True)
+    except psutil.Error:
+        pass
+    result = []
+    for process in processes:
+        try:
+            with process.oneshot():
+                result.append({
+                    'pid': process.pid,
+                    'name': process.name(),
+                    'rss_mb': round(process.memory_info().rss / MB, 1),
+                })
+        except psutil.Error:
+            # 进程在采样期间退出
+            continue
+    return result
+
+
+def _gpu_memory_used(i):
+    """
+    GPU i 的已用显存字节数，不在本进程中创建 CUDA 上下文
+
+    优先通过 NVML 统计整张卡（包含训练子进程和推理服务的占用）；NVML 不可用时，
+    仅在本进程已初始化 CUDA 时调用 mem_get_info，否则退回本进程的 memory_reserved。
+    """
+    try:
+        return torch.cuda.device_memory_used(i)
+    except Exception:
+        pass
+    if torch.cuda.is_initialized():
+        free, total = torch.cuda.mem_get_info(i)
+        return total - free
+    return torch.cuda.memory_reserved(i)
+
+
+def _gpu_info():
+    """各 GPU 的显存占用；采样线程运行在 Web 进程中，不能为每张卡创建 CUDA 上下文"""
+    gpu_info = []
+    if not torch.cuda.is_available():
+        return gpu_info
+    for i in range(torch.cuda.device_count()):
+        try:
+            total = torch.cuda.get_device_properties(i).total_memory
+            used = _gpu_memory_used(i)
+            info = {
+                'device': f'cuda:{i}',
+                'name': torch.cuda.get_device_name(i),
+                'memory_used_gb': round(used / GB, 2),
+                'memory_total_gb': round(total / GB, 2),
+                'memory_percent': round(used / total * 100, 1) if total else 0.0,
+            }
+            try:
+                # 需要 pynvml，不可用时省略利用率
+                info['utilization'] = torch.cuda.utilization(i)
+            except Exception:
+                pass
+            gpu_info.append(info)
+        except Exception as e:
+            logger.warning(f"获取GPU {i} 信息失败: {e}")
+    return gpu_info
+
+
+def _slope(points):
+    """最小二乘斜率（每秒变化量），点数不足时返回 0"""
+    if len(points) < 2:
+        return 0.0
+    mean_t = sum(t for t, _ in points) / len(points)
+    mean_v = sum(v for _, v in points) / len(points)
+    denominator = sum((t - mean_t) ** 2 for t, _ in points)
+    if denominator == 0:
+        return 0.0
+    return sum((t - mean_t) * (v - mean_v) for t, v in points) / denominator
+
+
+class ResourceSampler:
+    """
+    资源采样器
+
+    Args:
+        interval: 采样间隔（秒）
+        history_size: 环形缓冲区保留的采样数
+    """
+
+    def __init__(self, interval=RESOURCE_SAMPLE_INTERVAL, history_size=RESOURCE_HISTORY_SIZE):
+        self.interval = interval
+        self.samples = deque(maxlen=history_size)
+        self._lock = threading.Lock()
+        self._sample_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._process = psutil.Process(os.getpid())
+        self._last_disk = None
+        # 首次调用只建立基准，之后每次返回距上次调用的平均使用率
+        psutil.cpu_percent(interval=None)
+
+    def start(self):
+        """启动采样线程（重复调用无副作用）"""
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            if not self.samples:
+                # 先同步采集一次，接口首次调用时即可返回数据
+                self.sample()
+            self._thread = threading.Thread(target=self._run, name='visiofirm-resource-sampler', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.sample()
+            except Exception as e:
+                logger.warning(f"资源采样失败: {e}")
+
+    def _disk_io(self, now):
+        counters = psutil.disk_io_counters()
+        if counters is None:
+            return None
+        previous, self._last_disk = self._last_disk, (now, counters)
+        if previous is None or now <= previous[0]:
+            return None
+        elapsed = now - previous[0]
+        return {
+            'read_mb_s': round((counters.read_bytes - previous[1].read_bytes) / MB / elapsed, 2),
+            'write_mb_s': round((counters.write_bytes - previous[1].write_bytes) / MB / elapsed, 2),
+        }
+
+    def sample(self):
+        """采集一次并加入缓冲区，返回该采样"""
+        with self._sample_lock:
+            return self._collect()
+
+    def _collect(self):
+        now = time.monotonic()
+        memory = psutil.virtual_memory()
+        processes = _process_memory(self._process)
+        sample = {
+            'timestamp': time.time(),
+            'cpu_percent': psutil.cpu_percent(interval=None),
+            'memory_percent': memory.percent,
+            'memory_available_gb': round(memory.available / GB, 2),
+            'rss_mb': round(sum(p['rss_mb'] for p in processes), 1),
+            'processes': processes,
+            'disk_io': self._disk_io(now),
+            'gpu_info': _gpu_info(),
+        }
+        with self._lock:
+            self.samples.append(sample)
+        return sample
+
+    def latest(self):
+        """最近一次采样；还没有采样时立即采集一次"""
+        with self._lock:
+            if self.samples:
+                return self.samples[-1]
+        return self.sample()
+
+    def history(self, seconds=None):
+        """最近 seconds 秒内的采样（按时间顺序），seconds 为 None 时返回全部"""
+        with self._lock:
+            samples = list(self.samples)
+        if seconds is None:
+            return samples
+        since = time.time() - seconds
+        return [s for s in samples if s['timestamp'] >= since]
+
+    def trend(self, seconds=60):
+        """
+        最近一段时间的资源趋势
+
+        Returns:
+            dict: {字段: {'mean', 'max', 'slope'}}，slope 为每分钟变化量；GPU 按设备给出
+        """
+        samples = self.history(seconds)
+        series = {}
+        for sample in samples:
+            for field in ('cpu_percent', 'memory_percent', 'rss_mb'):
+                series.setdefault(field, []).append((sample['timestamp'], sample[field]))
+            for gpu in sample['gpu_info']:
+                series.setdefault(f"{gpu['device']}/memory_percent", []).append((sample['timestamp'], gpu['memory_percent']))
+                if 'utilization' in gpu:
+                    series.setdefault(f"{gpu['device']}/utilization", []).append((sample['timestamp'], gpu['utilization']))
+        return {
+            field: {
+                'mean': round(sum(v for _, v in points) / len(points), 2),
+                'max': max(v for _, v in points),
+                'slope': round(_slope(points) * 60, 3),
+                'samples': len(points),
+            }
+            for field, points in series.items()
+        }
+
+
+resource_sampler = ResourceSampler()
@@ -0,0 +1,232 @@
+"""
+训练任务队列模块
+训练请求先进入 SQLite 持久化队列，按优先级（同优先级先进先出）在有空闲容量时自动派发，
+达到并发上限的请求排队等待而不是直接失败；服务重启后排队和运行中的任务会恢复。
+"""
+
+import logging
+import sqlite3
+import threading
+import time
+from contextlib import closing
+
+from visiofirm.config import TRAINING_QUEUE_DB
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATUSES = ('queued', 'running')
+
+
+class TrainingQueue:
+    """
+    持久化的训练任务队列
+
+    同一项目同时只运行一个任务（每个项目的 TrainingEngine 只有一个训练线程），
+    其余任务按优先级等待。
+
+    Args:
+        db_path: 队列数据库路径，默认 TRAINING_QUEUE_DB
+        capacity: 最大并发训练数；为 None 时使用 performance_manager.max_concurrent_tasks
+    """
+
+    def __init__(self, db_path=TRAINING_QUEUE_DB, capacity=None):
+        self.db_path = db_path
+        self.capacity = capacity
+        self._launcher = None
+        self._lock = threading.RLock()
+        with closing(sqlite3.connect(self.db_path)) as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS training_queue (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    project_name TEXT NOT NULL,
+                    task_id INTEGER NOT NULL,
+                    priority INTEGER DEFAULT 0,
+                    status TEXT DEFAULT 'queued',
+                    error_message TEXT,
+                    enqueued_at REAL,
+                    started_at REAL,
+                    finished_at REAL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_training_queue_status ON training_queue (status, priority, id)')
+            conn.commit()
+
+    def _connect(self):
+        return closing(sqlite3.connect(self.db_path, timeout=30))
+
+    def _capacity(self):
+        if self.capacity is not None:
+            return self.capacity
+        from visiofirm.utils.performance_config import performance_manager
+        return performance_manager.max_concurrent_tasks
+
+    def start(self, launcher):
+        """
+        设置派发回调，恢复上次进程遗留的任务并开始派发
+
+        Args:
+            launcher: callable(project_name, task_id) -> bool，启动训练，失败时返回 False
+        Returns:
+            list: 被重新排队的 (project_name, task_id)
+        """
+        with self._lock:
+            self._launcher = launcher
+            recovered = self.recover()
+        self.dispatch()
+        return recovered
+
+    def set_launcher(self, launcher):
+        """只设置派发回调，不恢复遗留任务也不派发（恢复应在服务启动时由 start 完成一次）"""
+        with self._lock:
+            self._launcher = launcher
+
+    def recover(self):
+        """上次进程退出时仍在运行的任务已随进程结束，放回队列原位置重新运行"""
+        with self._lock, self._connect() as conn:
+            rows = conn.execute(
+                "SELECT project_name, task_id FROM training_queue WHERE status = 'running' ORDER BY id"
+            ).fetchall()
+            conn.execute("UPDATE training_queue SET status = 'queued', started_at = NULL WHERE status = 'running'")
+            conn.commit()
+        if rows:
+            logger.info(f"恢复了 {len(rows)} 个中断的训练任务")
+        return rows
+
+    def enqueue(self, project_name, task_id, priority=0):
+        """
+        任务入队；任务已在队列中或运行中时只更新优先级
+
+        Returns:
+            int: 队列记录ID
+        """
+        with self._lock, self._connect() as conn:
+            row = conn.execute(
+                "SELECT id, status FROM training_queue WHERE project_name = ? AND task_id = ? AND status IN (?, ?)",
+                (project_name, task_id, *ACTIVE_STATUSES)
+            ).fetchone()
+            if row:
+                if row[1] == 'queued':
+                    conn.execute('UPDATE training_queue SET priority = ? WHERE id = ?', (priority, row[0]))
+                    conn.commit()
+                return row[0]
+            cursor = conn.execute(
+                'INSERT INTO training_queue (project_name, task_id, priority, status, enqueued_at) VALUES (?, ?, ?, ?, ?)',
+                (project_name, task_id, priority, 'queued', time.time())
+            )
+            conn.commit()
+            logger.info(f"训练任务 {project_name}/{task_id} 已入队，优先级 {priority}")
+            return cursor.lastrowid
+
+    def dispatch(self):
+        """
+        在有空闲容量时按优先级派发排队任务
+
+        Returns:
+            list: 本次启动的 (project_name, task_id)
+        """
+        started = []
+        with self._lock:
+            if self._launcher is None:
+                return started
+            while True:
+                with self._connect() as conn:
+                    running = conn.execute(
+                        "SELECT project_name FROM training_queue WHERE status = 'running'"
+                    ).fetchall()
+                    if len(running) >= self._capacity():
+                        break
+                    busy_projects = {row[0] for row in running}
+                    candidates = conn.execute(
+                        "SELECT id, project_name, task_id FROM training_queue WHERE status = 'queued' "
+                        "ORDER BY priority DESC, id ASC"
+                    ).fetchall()
+                    entry = next((row for row in candidates if row[1] not in busy_projects), None)
+                    if entry is None:
+                        break
+                    conn.execute("UPDATE training_queue SET status = 'running', started_at = ? WHERE id = ?",
+                                 (time.time(), entry[0]))
+                    conn.commit()
+
+                entry_id, project_name, task_id = entry
+                try:
+                    launched = self._launcher(project_name, task_id)
+                    error = None if launched else '训练任务启动失败'
+                except Exception as e:
+                    launched, error = False, str(e)
+                if launched:
+                    started.append((project_name, task_id))
+                    logger.info(f"已派发训练任务 {project_name}/{task_id}")
+                else:
+                    logger.error(f"派发训练任务 {project_name}/{task_id} 失败: {error}")
+                    self._finish_entry(entry_id, 'failed', error)
+        return started
+
+    def _finish_entry(self, entry_id, status, error_message=None):
+        with self._connect() as conn:
+            conn.execute('UPDATE training_queue SET status = ?, error_message = ?, finished_at = ? WHERE id = ?',
+                         (status, error_message, time.time(), entry_id))
+            conn.commit()
+
+    def finish(self, project_name, task_id, status='finished', error_message=None):
+        """运行中的任务结束后释放容量，并派发下一个任务"""
+        with self._lock:
+            with self._connect() as conn:
+                row = conn.execute(
+                    "SELECT id FROM training_queue WHERE project_name = ? AND task_id = ? AND status = 'running'",
+                    (project_name, task_id)
+                ).fetchone()
+            if row:
+                self._finish_entry(row[0], status, error_message)
+        if row:
+            self.dispatch()
+
+    def cancel(self, project_name, task_id):
+        """
+        取消排队中的任务
+
+        Returns:
+            bool: 任务在排队且已取消时返回 True；运行中的任务需通过 TrainingEngine 停止
+        """
+        with self._lock, self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE training_queue SET status = 'cancelled', finished_at = ? "
+                "WHERE project_name = ? AND task_id = ? AND status = 'queued'",
+                (time.time(), project_name, task_id)
+            )
+            conn.commit()
+            return cursor.rowcount > 0
+
+    def position(self, project_name, task_id):
+        """排队任务前面还有几个任务（从1开始），不在队列中时返回 None"""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT id, priority FROM training_queue WHERE project_name = ? AND task_id = ? AND status = 'queued'",
+                (project_name, task_id)
+            ).fetchone()
+            if row is None:
+                return None
+            ahead = conn.execute(
+                "SELECT COUNT(*) FROM training_queue WHERE status = 'queued' AND (priority > ? OR (priority = ? AND id < ?))",
+                (row[1], row[1], row[0])
+            ).fetchone()[0]
+        return ahead + 1
+
+    def get_entries(self, project_name=None):
+        """返回排队和运行中的任务，按派发顺序排列"""
+        query = ("SELECT id, project_name, task_id, priority, status, enqueued_at, started_at "
+                 "FROM training_queue WHERE status IN (?, ?)")
+        params = list(ACTIVE_STATUSES)
+        if project_name:
+            query += ' AND project_name = ?'
+            params.append(project_name)
+        query += " ORDER BY status = 'queued', priority DESC, id ASC"
+        with self._connect() as conn:
+            rows = conn.execute(query, params).fetchall()
+        return [
+            {'id': row[0], 'project_name': row[1], 'task_id': row[2], 'priority': row[3],
+             'status': row[4], 'enqueued_at': row[5], 'started_at': row[6]}
+            for row in rows
+        ]
+
+
+training_queue = TrainingQueue()
@@ -0,0 +1,384 @@
+"""
+训练子进程模块
+每个训练任务在独立的 spawn 子进程中运行 model.train：输出写入任务自己的日志文件，
+进度和结果以结构化消息通过队列发回 Web 进程，停止任务时直接终止子进程，
+并可对子进程设置优先级和内存上限。
+"""
+
+import copy
+import gc
+import logging
+import multiprocessing as mp
+import os
+import queue
+import sys
+import time
+import traceback
+
+from visiofirm.config import TRAINING_PROCESS_NICE, TRAINING_MEMORY_LIMIT_GB, METRICS_BATCH_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def _redirect_output(log_path):
+    """把子进程的 stdout/stderr（包括 C 扩展直接写的 fd 1/2）重定向到日志文件"""
+    os.makedirs(os.path.dirname(log_path), exist_ok=True)
+    log_file = open(log_path, 'a', buffering=1, encoding='utf-8')
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os.dup2(log_file.fileno(), 1)
+    os.dup2(log_file.fileno(), 2)
+    sys.stdout = sys.stderr = log_file
+    logging.basicConfig(stream=log_file, level=logging.INFO, force=True)
+    return log_file
+
+
+def _apply_limits(limits):
+    """设置子进程的调度优先级和地址空间上限"""
+    nice = limits.get('nice')
+    if nice and hasattr(os, 'nice'):
+        os.nice(nice)
+    memory_gb = limits.get('memory_gb')
+    if memory_gb and resource is not None:
+        # 注意：CUDA 会预留大量虚拟地址空间，GPU 训练时不应设置该上限
+        limit = int(memory_gb * 1024 ** 3)
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _apply_cpu_allocation(torch, allocation, first=False):
+    if not allocation:
+        return
+    if torch.get_num_threads() != allocation['threads']:
+        torch.set_num_threads(allocation['threads'])
+    if first:
+        try:
+            torch.set_num_interop_threads(allocation['interop_threads'])
+        except RuntimeError:
+            pass
+
+
+def _epoch_loss(trainer):
+    """从训练器中提取损失值"""
+    if getattr(trainer, 'loss', None) is not None:
+        return float(trainer.loss.item()) if hasattr(trainer.loss, 'item') else float(trainer.loss)
+    if getattr(trainer, 'losses', None):
+        return float(trainer.losses[-1])
+    if getattr(trainer, 'tloss', None) is not None:
+        tloss = trainer.tloss
+        return float(tloss.sum().item()) if hasattr(tloss, 'sum') else float(tloss)
+    return None
+
+
+def _loss_items(trainer):
+    """训练损失各分量，如 {'train/box_loss': ..., 'train/cls_loss': ...}"""
+    tloss = getattr(trainer, 'tloss', None)
+    if tloss is None or not hasattr(trainer, 'label_loss_items'):
+        return {}
+    try:
+        return {k: float(v) for k, v in trainer.label_loss_items(tloss, prefix='train').items()}
+    except Exception:
+        return {}
+
+
+def _learning_rate(trainer):
+    optimizer = getattr(trainer, 'optimizer', None)
+    if optimizer is None or not optimizer.param_groups:
+        return None
+    return float(optimizer.param_groups[0]['lr'])
+
+
+class _ThroughputMeter:
+    """统计每秒图像数和剩余时间，批次指标按最小间隔节流上报"""
+
+    def __init__(self, interval=METRICS_BATCH_INTERVAL):
+        self.interval = interval
+        self.train_start = None
+        self.epoch_start = None
+        self.batches = 0
+        self.images = 0
+        self.done_batches = 0
+        self.last_report = 0.0
+
+    def start_epoch(self):
+        now = time.monotonic()
+        self.train_start = self.train_start or now
+        self.epoch_start = now
+        self.batches = 0
+        self.images = 0
+
+    def batch(self, trainer):
+        """记录一个批次，到达上报间隔时返回批次指标，否则返回 None"""
+        if self.epoch_start is None:
+            self.start_epoch()
+        self.batches += 1
+        self.done_batches += 1
+        self.images += getattr(trainer, 'batch_size', 0) or 0
+        now = time.monotonic()
+        if now - self.last_report < self.interval:
+            return None
+        self.last_report = now
+        return {
+            'epoch': trainer.epoch + 1,
+            'epochs': trainer.epochs,
+            'batch': self.batches,
+            'batches': self._batches_per_epoch(trainer),
+            'losses': _loss_items(trainer),
+            'lr': _learning_rate(trainer),
+            **self.rates(trainer),
+        }
+
+    def _batches_per_epoch(self, trainer):
+        loader = getattr(trainer, 'train_loader', None)
+        try:
+            return len(loader) if loader is not None else None
+        except TypeError:
+            return None
+
+    def rates(self, trainer):
+        now = time.monotonic()
+        epoch_elapsed = now - self.epoch_start if self.epoch_start else 0
+        total_elapsed = now - self.train_start if self.train_start else 0
+        batches_per_epoch = self._batches_per_epoch(trainer)
+        eta = None
+        if batches_per_epoch and self.done_batches and total_elapsed > 0:
+            remaining = trainer.epochs * batches_per_epoch - (trainer.epoch * batches_per_epoch + self.batches)
+            eta = max(0.0, remaining * total_elapsed / self.done_batches)
+        return {
+            'imgs_per_sec': round(self.images / epoch_elapsed, 2) if epoch_elapsed > 0 else None,
+            'eta_seconds': round(eta, 1) if eta is not None else None,
+        }
+
+
+def _extract_metrics(results):
+    """提取训练指标，results 本身无法跨进程传递"""
+    metrics = {}
+    if hasattr(results, 'results_dict'):
+        metrics = {k: float(v) for k, v in results.results_dict.items()}
+    elif hasattr(results, 'maps') and results.maps is not None and len(results.maps):
+        metrics = {'mAP50': float(results.maps[0])}
+    elif hasattr(results, 'box') and hasattr(results.box, 'map50'):
+        metrics = {
+            'mAP50': float(results.box.map50),
+            'mAP50-95': float(results.box.map) if hasattr(results.box, 'map') else 0.0
+        }
+    if hasattr(results, 'box'):
+        if hasattr(results.box, 'mp'):
+            metrics['precision'] = float(results.box.mp)
+        if hasattr(results.box, 'mr'):
+            metrics['recall'] = float(results.box.mr)
+    return metrics
+
+
+def _auto_batch(model, train_args, options, event_queue):
+    """
+    在子进程自身的 CPU 预算下探测批量大小和 worker 数，写回 train_args
+
+    探测在模型副本上进行，不影响要训练的权重和 BN 统计量；探测失败时使用父进程给出的静态批量。
+    """
+    from visiofirm.utils.batch_finder import BatchFinder
+
+    probe_model = None
+    try:
+        probe_model = copy.deepcopy(model.model)
+        found = BatchFinder(options['cache_path']).find(
+            probe_model, options['model_name'], train_args['imgsz'], train_args['device'],
+            options['memory_budget'], options['image_paths'], options['max_workers'])
+    except Exception as e:
+        traceback.print_exc()
+        print(f"批量大小探测失败，使用默认批量: {e}")
+        found = None
+    finally:
+        del probe_model
+        gc.collect()
+
+    if found is None:
+        train_args['batch'] = options['fallback_batch']
+        event_queue.put({'type': 'batch_probe', 'batch': train_args['batch'],
+                         'workers': train_args.get('workers'), 'fallback': True})
+        return
+    train_args['batch'] = found['batch']
+    train_args['workers'] = found['workers']
+    print(f"自动批量: batch={found['batch']} workers={found['workers']} "
+          f"({found['imgs_per_sec']} img/s, 峰值 {found['peak_mb']}MB{', 缓存' if found['cached'] else ''})")
+    event_queue.put({'type': 'batch_probe', **found})
+
+
+def run_training_job(spec, event_queue, control_queue):
+    """
+    子进程入口
+
+    Args:
+        spec: {'model_path', 'train_args', 'log_path', 'cpu_allocation', 'limits', 'auto_batch'}
+        event_queue: 发往父进程的消息 ('batch_probe' / 'batch' / 'epoch' / 'checkpoint' / 'result' / 'error')
+        control_queue: 来自父进程的消息（重新平衡后的 CPU 分配）
+    """
+    _redirect_output(spec['log_path'])
+    allocation = spec.get('cpu_allocation')
+    if allocation:
+        # 必须在导入 torch 之前设置，才能限制 OpenMP/MKL 线程池
+        os.environ['OMP_NUM_THREADS'] = str(allocation['threads'])
+        os.environ['MKL_NUM_THREADS'] = str(allocation['threads'])
+    try:
+        _apply_limits(spec.get('limits') or {})
+        import torch
+        from ultralytics import YOLO
+
+        _apply_cpu_allocation(torch, allocation, first=True)
+        model = YOLO(spec['model_path'])
+        if spec.get('auto_batch'):
+            _auto_batch(model, spec['train_args'], spec['auto_batch'], event_queue)
+
+        meter = _ThroughputMeter()
+
+        def on_train_epoch_start(trainer):
+            meter.start_epoch()
+            # 其他任务启停后父进程会发来新的CPU预算，在每个epoch开始时生效
+            latest = None
+            while True:
+                try:
+                    latest = control_queue.get_nowait()
+                except queue.Empty:
+                    break
+            _apply_cpu_allocation(torch, latest)
+
+        def on_train_batch_end(trainer):
+            data = meter.batch(trainer)
+            if data is not None:
+                event_queue.put({'type': 'batch', **data})
+
+        def on_fit_epoch_end(trainer):
+            # 验证结束后触发，trainer.metrics 中已有 mAP 和验证损失
+            try:
+                loss = _epoch_loss(trainer)
+            except Exception:
+                loss = None
+            metrics = {k: float(v) for k, v in (getattr(trainer, 'metrics', None) or {}).items()}
+            event_queue.put({
+                'type': 'epoch',
+                'epoch': trainer.epoch + 1,
+                'epochs': trainer.epochs,
+                'loss': loss,
+                'losses': _loss_items(trainer),
+                'metrics': metrics,
+                'lr': _learning_rate(trainer),
+                **meter.rates(trainer),
+            })
+
+        def on_model_save(trainer):
+            # last.pt 每轮都会覆盖写入，父进程据此记录可恢复的检查点
+            event_queue.put({'type': 'checkpoint', 'path': str(trainer.last), 'epoch': trainer.epoch + 1})
+
+        model.add_callback('on_train_epoch_start', on_train_epoch_start)
+        model.add_callback('on_train_batch_end', on_train_batch_end)
+        model.add_callback('on_fit_epoch_end', on_fit_epoch_end)
+        model.add_callback('on_model_save', on_model_save)
+
+        results = model.train(**spec['train_args'])
+
+        try:
+            metrics = _extract_metrics(results)
+        except Exception as e:
+            print(f"提取训练指标时出错: {e}")
+            metrics = {'note': '训练完成但指标提取失败'}
+        save_dir = getattr(getattr(model, 'trainer', None), 'save_dir', None)
+        event_queue.put({'type': 'result', 'save_dir': str(save_dir) if save_dir else None, 'metrics': metrics})
+    except BaseException as e:
+        traceback.print_exc()
+        event_queue.put({'type': 'error', 'message': str(e) or e.__class__.__name__})
+    finally:
+        sys.stdout.flush()
+
+
+class TrainingProcess:
+    """
+    父进程中的训练子进程句柄
+
+    Args:
+        model_path: 模型权重路径
+        train_args: 传给 model.train 的参数
+        log_path: 子进程日志文件
+        cpu_allocation: performance_manager 分配的CPU预算
+        auto_batch: 可选，批量大小探测参数 {'cache_path', 'model_name', 'memory_budget',
+            'image_paths', 'max_workers', 'fallback_batch'}，提供时由子进程探测 batch 和 workers
+    """
+
+    def __init__(self, model_path, train_args, log_path, cpu_allocation=None, auto_batch=None):
+        ctx = mp.get_context('spawn')
+        self.log_path = log_path
+        self._events = ctx.Queue()
+        self._control = ctx.Queue()
+        spec = {
+            'model_path': model_path,
+            'train_args': train_args,
+            'log_path': log_path,
+            'cpu_allocation': cpu_allocation,
+            'auto_batch': auto_batch,
+            'limits': {'nice': TRAINING_PROCESS_NICE, 'memory_gb': TRAINING_MEMORY_LIMIT_GB},
+        }
+        self._process = ctx.Process(target=run_training_job, args=(spec, self._events, self._control),
+                                    name='visiofirm-training')
+
+    def start(self):
+        self._process.start()
+        logger.info(f"训练子进程已启动 (pid={self._process.pid})，日志: {self.log_path}")
+
+    @property
+    def pid(self):
+        return self._process.pid
+
+    @property
+    def exitcode(self):
+        return self._process.exitcode
+
+    def is_alive(self):
+        return self._process.is_alive()
+
+    def next_event(self, timeout=1.0):
+        """等待下一条子进程消息，超时返回 None"""
+        try:
+            return self._events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def events(self, poll_interval=1.0, on_idle=None):
+        """
+        依次产出子进程消息，直到子进程退出且消息取尽
+
+        Args:
+            on_idle: 可选，每次等待超时时调用（例如推送新的CPU预算）
+        """
+        while True:
+            event = self.next_event(poll_interval)
+            if event is not None:
+                yield event
+                continue
+            if not self.is_alive():
+                # 进程退出后取出剩余消息
+                while True:
+                    event = self.next_event(0.2)
+                    if event is None:
+                        break
+                    yield event
+                self._process.join()
+                return
+            if on_idle is not None:
+                on_idle()
+
+    def set_cpu_budget(self, allocation):
+        self._control.put(allocation)
+
+    def stop(self, timeout=10):
+        """终止子进程：先 SIGTERM，超时后 SIGKILL"""
+        if not self._process.is_alive():
+            return
+        self._process.terminate()
+        self._process.join(timeout)
+        if self._process.is_alive():
+            logger.warning(f"训练子进程 {self._process.pid} 未响应终止信号，强制结束")
+            self._process.kill()
+            self._process.join()
@@ -0,0 +1,147 @@
+"""
+WebDataset 分片导出模块
+每个划分的图像与 YOLO 标签按顺序打包进固定大小的 tar 分片，并生成 index.json，
+训练加载器可以顺序流式读取分片，避免在网络文件系统上创建大量小文件。
+"""
+
+import io
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+import time
+from io import BytesIO
+
+from visiofirm.config import WEBDATASET_SHARD_SIZE_MB
+from visiofirm.utils.archive_writer import open_archive
+from visiofirm.utils.export_utils import iter_export_records, ProgressTracker, render_fragment, yolo_label
+
+INDEX_FILE = 'index.json'
+
+# tar 头和对齐填充的近似开销
+_TAR_ENTRY_OVERHEAD = 1024
+
+
+class ShardWriter:
+    """
+    顺序写入 tar 分片，超过 max_bytes 时切换到下一个分片
+
+    Args:
+        directory: 分片输出目录
+        prefix: 分片文件名前缀，如 'train/shard'
+        max_bytes: 单个分片的目标大小
+    """
+
+    def __init__(self, directory, prefix, max_bytes):
+        self.directory = directory
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.shards = []
+        self._tar = None
+        self._current = None
+
+    def _open_next(self):
+        self.close()
+        name = f'{self.prefix}-{len(self.shards):06d}.tar'
+        path = os.path.join(self.directory, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._tar = tarfile.open(path, mode='w', format=tarfile.USTAR_FORMAT)
+        self._current = {'path': name, 'samples': 0, 'size': 0, 'first_key': None}
+        self.shards.append(self._current)
+
+    def write_sample(self, key, entries):
+        """
+        写入一个样本
+
+        Args:
+            key: 样本键，同一样本的所有条目共享该前缀
+            entries: {扩展名: bytes 或 文件路径}
+        """
+        sizes = {ext: os.path.getsize(value) if isinstance(value, str) else len(value) for ext, value in entries.items()}
+        sample_size = sum(size + _TAR_ENTRY_OVERHEAD for size in sizes.values())
+        if self._tar is None or (self._current['samples'] and self._current['size'] + sample_size > self.max_bytes):
+            self._open_next()
+
+        mtime = int(time.time())
+        for ext, value in entries.items():
+            info = tarfile.TarInfo(f'{key}.{ext}')
+            info.size = sizes[ext]
+            info.mtime = mtime
+            if isinstance(value, str):
+                with open(value, 'rb') as f:
+                    self._tar.addfile(info, f)
+            else:
+                self._tar.addfile(info, io.BytesIO(value))
+        self._current['samples'] += 1
+        self._current['size'] += sample_size
+        if self._current['first_key'] is None:
+            self._current['first_key'] = key
+
+    def close(self):
+        if self._tar is not None:
+            self._tar.close()
+            self._current['size'] = os.path.getsize(os.path.join(self.directory, self._current['path']))
+            self._tar = None
+
+
+def generate_webdataset_export(project, splits, setup_type, project_name, project_description, output=None,
+                               archive_format='zip', progress_callback=None, cache=None,
+                               shard_size_mb=WEBDATASET_SHARD_SIZE_MB):
+    """Generate a WebDataset export: {split}/shard-NNNNNN.tar files plus index.json.
+
+    Each sample is `<key>.<image ext>`, `<key>.txt` (YOLO label) and `<key>.json`
+    (image metadata). Shards are written to a temporary directory and then added
+    to the output container, so 'dir' or 'link' output is the natural choice for large projects.
+    """
+    categories = project.get_classes()
+    category_dict = {name: idx for idx, name in enumerate(categories)}
+    max_bytes = int(shard_size_mb * 1024 * 1024)
+
+    progress = ProgressTracker(splits, progress_callback)
+    zip_buffer = BytesIO() if output is None else output
+    temp_dir = tempfile.mkdtemp(prefix='visiofirm_wds_')
+    try:
+        with open_archive(zip_buffer, archive_format) as zip_file:
+            index = {
+                'format': 'webdataset',
+                'project_name': project_name,
+                'project_description': project_description,
+                'setup_type': setup_type,
+                'names': categories,
+                'label_format': 'yolo',
+                'shard_size_bytes': max_bytes,
+                'splits': {}
+            }
+            for split_name, split_images in splits.items():
+                writer = ShardWriter(temp_dir, f'{split_name}/shard', max_bytes)
+                for seq, record in enumerate(progress.track(iter_export_records(project.db_path, split_images, cache))):
+                    label = render_fragment(record, cache, lambda r: yolo_label(r, setup_type, category_dict))
+                    metadata = {
+                        'image_id': record.image_id,
+                        'file_name': os.path.basename(record.path),
+                        'width': record.width,
+                        'height': record.height
+                    }
+                    image_ext = os.path.splitext(record.path)[1].lstrip('.').lower() or 'jpg'
+                    writer.write_sample(f'{seq:08d}', {
+                        image_ext: record.path,
+                        'txt': label.encode('utf-8'),
+                        'json': json.dumps(metadata).encode('utf-8')
+                    })
+                writer.close()
+                for shard in writer.shards:
+                    zip_file.write(os.path.join(temp_dir, shard['path']), shard['path'])
+                index['splits'][split_name] = {
+                    'samples': sum(shard['samples'] for shard in writer.shards),
+                    'shards': writer.shards
+                }
+            zip_file.writestr(INDEX_FILE, json.dumps(index, indent=2))
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    if cache is not None:
+        cache.flush()
+    if output is None:
+        zip_buffer.seek(0)
+    return zip_buffer
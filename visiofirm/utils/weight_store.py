@@ -0,0 +1,218 @@
+"""
+模型权重存储模块
+统一管理 WEIGHTS_FOLDER 中的权重文件：文件锁防止并发写坏同一文件，
+HTTP Range 断点续传，SHA-256 校验，原子重命名，以及记录来源与校验和的 manifest。
+
+校验和来源：调用方传入的 sha256，其次是 WEIGHT_SHA256_PINS / pins.json 中固定的摘要。
+两者都没有时按首次下载信任（trust-on-first-use）：清单记录首次下载的摘要，
+之后只能发现文件被改动，无法发现首次下载本身被截断或篡改，清单中以 'trust': 'first_use' 标出。
+"""
+
+import hashlib
+import json
+import logging
+import os
+import time
+
+import requests
+from filelock import FileLock
+
+from visiofirm.config import WEIGHTS_FOLDER, WEIGHT_SHA256_PINS
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = 'manifest.json'
+PINS_NAME = 'pins.json'
+
+
+def _offline_from_env():
+    return os.environ.get('VISIOFIRM_OFFLINE', '').lower() in ('1', 'true', 'yes')
+
+
+def sha256_file(path, chunk_size=1024 * 1024):
+    """计算文件的 SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class WeightStore:
+    """
+    共享的模型权重缓存
+
+    Args:
+        root: 权重目录，默认 WEIGHTS_FOLDER
+        offline: 离线模式，只使用预先放置的文件；默认读取环境变量 VISIOFIRM_OFFLINE
+        chunk_size: 下载分块大小
+        timeout: HTTP 超时（秒）
+    """
+
+    def __init__(self, root=WEIGHTS_FOLDER, offline=None, chunk_size=1024 * 1024, timeout=60):
+        self.root = root
+        self.offline = _offline_from_env() if offline is None else offline
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.manifest_path = os.path.join(self.root, MANIFEST_NAME)
+        os.makedirs(self.root, exist_ok=True)
+
+    def path_for(self, filename):
+        return os.path.join(self.root, filename)
+
+    def lock(self, filename):
+        """获取某个权重文件的跨进程文件锁"""
+        return FileLock(self.path_for(filename) + '.lock')
+
+    def _manifest_lock(self):
+        return FileLock(self.manifest_path + '.lock')
+
+    def load_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return {}
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"权重清单损坏，将重新生成: {e}")
+            return {}
+
+    def pinned_sha256(self, filename):
+        """固定的期望校验和：先查 WEIGHT_SHA256_PINS，再查权重目录下的 pins.json"""
+        if filename in WEIGHT_SHA256_PINS:
+            return WEIGHT_SHA256_PINS[filename]
+        pins_path = os.path.join(self.root, PINS_NAME)
+        if not os.path.exists(pins_path):
+            return None
+        try:
+            with open(pins_path, 'r', encoding='utf-8') as f:
+                return json.load(f).get(filename)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"读取 {pins_path} 失败: {e}")
+            return None
+
+    def _record(self, filename, sha256, size, url=None, pinned=False):
+        path = self.path_for(filename)
+        with self._manifest_lock():
+            manifest = self.load_manifest()
+            entry = manifest.get(filename, {})
+            entry.update({
+                'sha256': sha256,
+                'size': size,
+                # 大小和修改时间都与清单一致时才跳过重新计算哈希
+                'mtime_ns': os.stat(path).st_mtime_ns if os.path.exists(path) else None,
+                'trust': 'pinned' if pinned else entry.get('trust', 'first_use'),
+                'updated_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            })
+            if url:
+                entry['url'] = url
+            manifest[filename] = entry
+            tmp_path = self.manifest_path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(manifest, f, indent=2, ensure_ascii=False)
+            os.replace(tmp_path, self.manifest_path)
+        return entry
+
+    def register(self, filename, url=None):
+        """把已存在（例如离线预先放置）的权重文件登记到清单中"""
+        path = self.path_for(filename)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"权重文件不存在: {path}")
+        digest = sha256_file(path)
+        expected = self.pinned_sha256(filename)
+        if expected and digest != expected:
+            raise ValueError(f"权重文件 {filename} 校验失败 (期望 {expected}, 实际 {digest})")
+        return self._record(filename, digest, os.path.getsize(path), url, pinned=bool(expected))
+
+    def _is_valid(self, filename, sha256=None):
+        """
+        检查已存在的文件
+
+        清单中的大小和修改时间都与文件一致、且摘要与期望值相符时不重复计算哈希；
+        否则重新计算，有期望值时必须相符。
+        """
+        path = self.path_for(filename)
+        if not os.path.exists(path):
+            return False
+        entry = self.load_manifest().get(filename)
+        stat = os.stat(path)
+        if (entry and entry.get('size') == stat.st_size and entry.get('mtime_ns') == stat.st_mtime_ns
+                and (sha256 is None or entry.get('sha256') == sha256)):
+            return True
+        digest = sha256_file(path)
+        if sha256 is not None and digest != sha256:
+            logger.warning(f"权重文件 {filename} 校验失败 (期望 {sha256}, 实际 {digest})")
+            return False
+        if sha256 is None and entry and entry.get('sha256') and entry['sha256'] != digest:
+            logger.warning(f"权重文件 {filename} 与首次记录的校验和不一致，重新获取")
+            return False
+        self._record(filename, digest, stat.st_size, entry.get('url') if entry else None, pinned=sha256 is not None)
+        return True
+
+    def _download(self, url, part_path, progress_callback=None):
+        """下载到 .part 文件，已有部分内容时通过 Range 续传"""
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        headers = {'Range': f'bytes={offset}-'} if offset else {}
+        with requests.get(url, stream=True, headers=headers, timeout=self.timeout) as r:
+            if offset and r.status_code == 416:
+                # 服务器认为已经没有剩余内容，说明 .part 已完整
+                return
+            if offset and r.status_code == 206:
+                mode = 'ab'
+                logger.info(f"从 {offset} 字节处续传 {url}")
+            elif r.status_code == 200:
+                offset = 0
+                mode = 'wb'
+            else:
+                raise ValueError(f"下载失败: {url} (状态码: {r.status_code})")
+            total = offset + int(r.headers.get('content-length', 0))
+            downloaded = offset
+            with open(part_path, mode) as f:
+                for chunk in r.iter_content(chunk_size=self.chunk_size):
+                    if chunk:
+                        f.write(chunk)
+                        downloaded += len(chunk)
+                        if progress_callback:
+                            progress_callback(downloaded, total)
+
+    def fetch(self, url, filename, sha256=None, progress_callback=None):
+        """
+        获取权重文件，必要时下载
+
+        Args:
+            url: 下载地址
+            filename: WEIGHTS_FOLDER 下的文件名
+            sha256: 期望的校验和；为空时使用固定的摘要（WEIGHT_SHA256_PINS / pins.json），
+                都没有时按首次下载信任，使用清单中的记录
+            progress_callback: 回调 (已下载字节数, 总字节数)
+
+        Returns:
+            str: 权重文件的绝对路径
+        """
+        path = self.path_for(filename)
+        sha256 = sha256 or self.pinned_sha256(filename)
+        with self.lock(filename):
+            if self._is_valid(filename, sha256):
+                return path
+            if self.offline:
+                raise FileNotFoundError(f"离线模式下缺少权重文件: {filename}，请预先放置到 {self.root}")
+            if os.path.exists(path):
+                os.remove(path)
+
+            expected = sha256 or self.load_manifest().get(filename, {}).get('sha256')
+            part_path = path + '.part'
+            logger.info(f"开始下载权重 {filename}: {url}")
+            self._download(url, part_path, progress_callback)
+            digest = sha256_file(part_path)
+            if expected and digest != expected:
+                os.remove(part_path)
+                raise ValueError(f"权重文件 {filename} 校验失败 (期望 {expected}, 实际 {digest})")
+            if not expected:
+                logger.warning(f"权重 {filename} 没有固定的校验和，按首次下载记录 {digest}（trust-on-first-use）")
+            os.replace(part_path, path)
+            self._record(filename, digest, os.path.getsize(path), url, pinned=bool(sha256))
+            logger.info(f"权重 {filename} 下载完成")
+            return path
+
+
+weight_store = WeightStore()